@@ -1,12 +1,24 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
 import logging
-from ingestion import process_uploaded_file
-from retrieval import get_index, upsert_documents, search_similar_documents, check_index_contents, rerank_chunks
-from generator import generate_study_guide, generate_study_guide_from_text
+from ingestion import iter_file_text, chunk_text_stream
+from ingestion_jobs import IngestionJobQueue, JobProgress
+from retrieval import (get_index, upsert_documents, search_similar_documents, check_index_contents, rerank_chunks,
+                       get_index_stats, get_rerank_stats, get_query_cache_stats, hybrid_search, RERANK_MAX_CANDIDATES,
+                       EMBEDDING_MODEL_NAME, UPSERT_BATCH_SIZE, delete_documents, fetch_metadata)
+from keyword_index import keyword_index
+from generator import (generate_study_guide, generate_study_guide_from_text, generate_study_guide_map_reduce,
+                       get_generation_params, build_map_reduce_context, stream_study_guide,
+                       stream_study_guide_from_text, get_generator_stats, DECODING_PROFILES,
+                       DEFAULT_DECODING_PROFILE)
+from summary_cache import summary_cache, make_cache_key
+from chunk_store import chunk_store, find_legacy_vector_ids, make_vector_id
+from content_store import content_store, hash_file, hash_text
+from chunker import chunker_fingerprint
 from quiz_generator import QuizGenerator
 import uuid
+import shutil
 from routes.auth import auth_bp
 from models import db
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -15,7 +27,11 @@ from functools import wraps
 import sqlite3
 import datetime
 import json
-from typing import Tuple, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Tuple, List, Optional
 import nltk
 
 # Configure logging
@@ -49,10 +65,18 @@ CORS(app, resources={
 # Configure upload folder
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'uploaded_files')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+INGESTION_FOLDER = os.path.join(UPLOAD_FOLDER, 'pending')  # Uploads waiting for their ingestion job
+os.makedirs(INGESTION_FOLDER, exist_ok=True)
 
 # In-memory storage for document chunks
 document_chunks = []
 
+# Per-file content lookups for a request run in parallel, each with its own timeout
+FILE_FETCH_MAX_WORKERS = int(os.getenv('FILE_FETCH_MAX_WORKERS', 8))
+FILE_FETCH_TIMEOUT = float(os.getenv('FILE_FETCH_TIMEOUT', 5))  # Seconds one file's lookup may take before it is left out
+FILE_FETCH_WAIT_TIMEOUT = float(os.getenv('FILE_FETCH_WAIT_TIMEOUT', 15))  # Seconds a request waits for its lookups, queueing included
+file_fetch_executor = ThreadPoolExecutor(max_workers=FILE_FETCH_MAX_WORKERS, thread_name_prefix='file-fetch')
+
 # Initialize database
 db.init_app(app)
 
@@ -120,6 +144,21 @@ def check_index():
     except Exception as e:
         return f"Error checking index: {str(e)}"
 
+@app.route('/api/metrics', methods=['GET'])
+@token_required
+def get_metrics(current_user):
+    """Report service metrics."""
+    return jsonify({
+        'summary_cache': summary_cache.stats(),
+        'generator': get_generator_stats(),
+        'vector_index': get_index_stats(),
+        'chunk_store': chunk_store.stats(),
+        'reranker': get_rerank_stats(),
+        'query_embeddings': get_query_cache_stats(),
+        'keyword_index': keyword_index.stats(),
+        'content_store': content_store.stats()
+    })
+
 @app.route('/signup', methods=['POST'])
 def signup():
     data = request.get_json()
@@ -193,6 +232,274 @@ def login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def ingest_file(file_path: str, filename: str, username: str, progress: Optional[JobProgress] = None) -> dict:
+    """
+    Parse, chunk, embed and index an uploaded file.
+    
+    The file is streamed through the pipeline: chunks are produced page by
+    page and written to the chunk store, keyword index and vector index one
+    batch at a time, so memory use does not grow with the document.
+    
+    Vector ids are derived from chunk content, so when a file is uploaded
+    again only new or changed chunks are embedded and upserted, and vectors
+    of chunks that are gone are deleted afterwards.
+    
+    When run as a job, progress is reported through the job's JobProgress
+    and the chunks up to its last checkpoint are skipped, so a failed
+    attempt resumes after the last chunks that were fully upserted, as
+    long as the file has not changed since.
+    
+    Returns:
+        dict: Number of chunks, whether the content was seen before, how
+            many chunks were unchanged, how many embeddings were reused and
+            how many stale vectors were deleted
+    """
+    def pages():
+        # Pages of a PDF, paragraphs of a DOCX or blocks of a TXT file
+        for segment in iter_file_text(file_path):
+            if progress is not None:
+                progress.add(pages_parsed=1)
+            yield segment
+    
+    # Reuse the chunks of content that was parsed before, by any user, with the same chunker
+    file_hash, file_size = hash_file(file_path)
+    chunker = chunker_fingerprint()
+    resume_from = progress.start(file_hash) if progress is not None else 0
+    known_chunks = content_store.get_file_chunks(file_hash, chunker)
+    deduplicated = known_chunks is not None
+    if deduplicated:
+        logger.info(f"Content of {filename} was seen before, skipping parsing ({file_size} bytes)")
+        chunks = iter(known_chunks)
+    else:
+        chunks = chunk_text_stream(pages())
+    
+    # Vectors the previous version of the file, or an earlier attempt, left in the index
+    existing_ids = set(chunk_store.get_vector_ids(username, filename))
+    current_ids = set()
+    occurrences = {}
+    
+    if resume_from:
+        logger.info(f"Resuming ingestion of {filename} after {resume_from} committed chunks")
+    else:
+        if not existing_ids and filename in get_user_filenames(username):
+            # Uploaded before vector ids were recorded; record its positional ids so they are cleaned up
+            existing_ids = set(find_legacy_vector_ids(fetch_metadata, username, filename))
+            chunk_store.add_vector_ids(username, filename, sorted(existing_ids))
+        # Replace the stored text of any previous version of the file
+        chunk_store.delete_file(username, filename)
+    counts = {'chunks': 0, 'unchanged_chunks': 0, 'embeddings_reused': 0}
+    
+    # Chunks are committed once every chunk before them is in the index; upserts finish out of order
+    pending_positions = {}
+    finished_positions = set()
+    committed = {'chunks': resume_from}
+    # Positions are finished from both the embedding and the upsert threads
+    positions_lock = threading.Lock()
+    
+    def finish_positions(positions):
+        with positions_lock:
+            finished_positions.update(positions)
+            while committed['chunks'] in finished_positions:
+                finished_positions.remove(committed['chunks'])
+                committed['chunks'] += 1
+            if progress is not None:
+                progress.checkpoint(committed['chunks'])
+    
+    def on_embedded(docs, embeddings):
+        # Store new embeddings for later uploads of the same content
+        content_store.put_embeddings([doc['content_hash'] for doc in docs], embeddings, EMBEDDING_MODEL_NAME)
+        if progress is not None:
+            progress.add(chunks_embedded=len(docs))
+    
+    def on_upserted(ids):
+        chunk_store.add_vector_ids(username, filename, ids)
+        if progress is not None:
+            progress.add(batches_upserted=1)
+        with positions_lock:
+            positions = [pending_positions.pop(vector_id) for vector_id in ids]
+        finish_positions(positions)
+    
+    def documents():
+        while True:
+            batch = list(islice(chunks, UPSERT_BATCH_SIZE))
+            if not batch:
+                return
+            start_index = counts['chunks']
+            counts['chunks'] += len(batch)
+            
+            # Ids depend on the chunk text and how often it occurred earlier in the file
+            chunk_hashes = [hash_text(chunk) for chunk in batch]
+            vector_ids = []
+            for chunk_hash in chunk_hashes:
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                vector_ids.append(make_vector_id(username, filename, chunk_hash, occurrence))
+            current_ids.update(vector_ids)
+            
+            # Chunks before the checkpoint were fully handled by an earlier attempt
+            skip = max(0, min(len(batch), resume_from - start_index))
+            if skip == len(batch):
+                continue
+            batch, chunk_hashes, vector_ids = batch[skip:], chunk_hashes[skip:], vector_ids[skip:]
+            start_index += skip
+            
+            # Prepare documents for Pinecone
+            batch_documents = []
+            for i, (chunk, chunk_hash, vector_id) in enumerate(zip(batch, chunk_hashes, vector_ids), start=start_index):
+                batch_documents.append({
+                    'id': vector_id,
+                    'text': chunk,
+                    'content_hash': chunk_hash,
+                    'metadata': {
+                        'filename': filename,
+                        'chunk_index': i,
+                        'username': username
+                    }
+                })
+            
+            # Keep the ordered chunk text for reading the file back
+            if not deduplicated:
+                content_store.add_file_chunks(file_hash, chunker, start_index, batch)
+            chunk_store.append_chunks(username, filename, start_index, batch)
+            
+            # Chunks whose vector is already in the index are not embedded or upserted again
+            changed = []
+            unchanged_positions = []
+            for position, doc in enumerate(batch_documents, start=start_index):
+                if doc['id'] in existing_ids:
+                    unchanged_positions.append(position)
+                else:
+                    with positions_lock:
+                        pending_positions[doc['id']] = position
+                    changed.append(doc)
+            counts['unchanged_chunks'] += len(unchanged_positions)
+            # Chunks embedded before are upserted with their stored embeddings
+            known_embeddings = content_store.get_embeddings([doc['content_hash'] for doc in changed], EMBEDDING_MODEL_NAME)
+            for doc in changed:
+                doc['values'] = known_embeddings.get(doc['content_hash'])
+            # Index new chunks for keyword search before their vectors are recorded as upserted
+            keyword_index.add_documents(changed)
+            if unchanged_positions:
+                finish_positions(unchanged_positions)
+            counts['embeddings_reused'] += sum(1 for doc in changed if doc['values'] is not None)
+            yield from changed
+    
+    # Upsert to Pinecone
+    upsert_documents(documents(), batch_size=UPSERT_BATCH_SIZE, on_embedded=on_embedded, on_upserted=on_upserted)
+    
+    # Delete vectors of chunks that are no longer in the file
+    stale_ids = sorted(existing_ids - current_ids)
+    if stale_ids:
+        delete_documents(stale_ids)
+        keyword_index.delete_ids(stale_ids, username)
+        chunk_store.remove_vector_ids(username, filename, stale_ids)
+    
+    if not deduplicated:
+        content_store.commit_file(file_hash, chunker, file_size, counts['chunks'])
+    content_store.add_ref(username, filename, file_hash)
+    logger.info(f"Ingested {counts['chunks']} chunks of {filename}: {counts['unchanged_chunks']} unchanged, "
+                f"{counts['embeddings_reused']} embeddings reused, {len(stale_ids)} stale vectors deleted")
+    
+    return {'deduplicated': deduplicated, **counts, 'deleted_vectors': len(stale_ids)}
+
+def run_ingestion_job(job: dict, progress: JobProgress) -> dict:
+    """Ingest an uploaded file in the background and make it available to the user."""
+    result = ingest_file(job['file_path'], job['filename'], job['username'], progress)
+    
+    # Replace the served copy of the file only once its new version is indexed
+    shutil.copyfile(job['file_path'], os.path.join(UPLOAD_FOLDER, job['filename']))
+    
+    # Save file info to database; a new version of a file replaces the old one
+    conn = sqlite3.connect('users.db')
+    c = conn.cursor()
+    c.execute('UPDATE uploaded_files SET upload_date = CURRENT_TIMESTAMP WHERE username = ? AND filename = ?',
+             (job['username'], job['filename']))
+    if c.rowcount == 0:
+        c.execute('INSERT INTO uploaded_files (username, filename) VALUES (?, ?)',
+                 (job['username'], job['filename']))
+    conn.commit()
+    conn.close()
+    
+    # Summaries built from the user's previous files are now stale
+    summary_cache.invalidate_user(job['username'])
+    
+    os.remove(job['file_path'])
+    return result
+
+# Background ingestion of uploaded files
+def discard_failed_ingestion(job: dict) -> None:
+    """
+    Undo what an ingestion job that failed for good wrote.
+    
+    The file's chunks were replaced as the job went, so no complete version
+    of it is left to serve: its chunk store and keyword rows, its listing
+    and served copy are removed first, then its vectors. Vector ids that
+    could not be deleted stay recorded and are cleaned up as stale by the
+    next upload of the file.
+    """
+    username, filename = job['username'], job['filename']
+    if os.path.exists(job['file_path']):
+        os.remove(job['file_path'])
+    
+    conn = sqlite3.connect('users.db')
+    c = conn.cursor()
+    c.execute('DELETE FROM uploaded_files WHERE username = ? AND filename = ?', (username, filename))
+    conn.commit()
+    conn.close()
+    served_path = os.path.join(UPLOAD_FOLDER, filename)
+    if os.path.exists(served_path):
+        os.remove(served_path)
+    chunk_store.delete_file(username, filename)
+    keyword_index.delete_file(username, filename)
+    summary_cache.invalidate_user(username)
+    
+    vector_ids = chunk_store.get_vector_ids(username, filename)
+    delete_documents(vector_ids)
+    chunk_store.remove_vector_ids(username, filename, vector_ids)
+    logger.info(f"Discarded partial ingestion of {filename} ({username}): {len(vector_ids)} vectors deleted")
+
+def backfill_keyword_index() -> int:
+    """
+    Index the stored chunks of files uploaded before the keyword index existed.
+    
+    Runs before the ingestion queue starts, so no job changes a file while
+    it is read. Chunks get the content-derived ids ingestion gives them.
+    
+    Returns:
+        int: Number of files indexed
+    """
+    indexed = keyword_index.indexed_files()
+    missing = [(username, filename) for username, filename in chunk_store.list_files()
+               if (username, filename) not in indexed]
+    for username, filename in missing:
+        occurrences = {}
+        chunks = enumerate(chunk_store.iter_chunks(username, filename))
+        while True:
+            batch = list(islice(chunks, UPSERT_BATCH_SIZE))
+            if not batch:
+                break
+            documents = []
+            for i, chunk in batch:
+                chunk_hash = hash_text(chunk)
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                documents.append({
+                    'id': make_vector_id(username, filename, chunk_hash, occurrence),
+                    'text': chunk,
+                    'metadata': {'filename': filename, 'chunk_index': i, 'username': username}
+                })
+            keyword_index.add_documents(documents)
+    if missing:
+        logger.info(f"Backfilled keyword index with {len(missing)} files")
+    return len(missing)
+
+try:
+    backfill_keyword_index()
+except Exception as e:
+    logger.error(f"Error backfilling keyword index: {str(e)}", exc_info=True)
+
+ingestion_jobs = IngestionJobQueue(run_ingestion_job, on_failed=discard_failed_ingestion)
+
 @app.route('/upload', methods=['POST'])
 @token_required
 def upload_file(current_user):
@@ -211,51 +518,52 @@ def upload_file(current_user):
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        # Save the file
+        # Save the file where only its job reads it; another upload of the same name must not replace it
         filename = file.filename
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        file_path = os.path.join(INGESTION_FOLDER, f"{uuid.uuid4().hex}_{filename}")
         file.save(file_path)
         logger.info(f"File saved to {file_path}")
         
-        # Process the file and get chunks
-        chunks = process_uploaded_file(file_path)
-        logger.info(f"File processed into {len(chunks)} chunks")
-        
-        # Prepare documents for Pinecone
-        documents = []
-        for i, chunk in enumerate(chunks):
-            doc_id = f"{filename}_{i}"
-            documents.append({
-                'id': doc_id,
-                'text': chunk,
-                'metadata': {
-                    'filename': filename,
-                    'chunk_index': i,
-                    'username': current_user['username']
-                }
-            })
-        
-        # Upsert to Pinecone
-        upsert_documents(documents)
-        logger.info(f"Successfully upserted {len(documents)} chunks to Pinecone")
-        
-        # Save file info to database
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute('INSERT INTO uploaded_files (username, filename) VALUES (?, ?)',
-                 (current_user['username'], filename))
-        conn.commit()
-        conn.close()
+        # Parse, embed and index the file in the background
+        job_id = ingestion_jobs.submit(current_user['username'], filename, file_path)
         
         return jsonify({
-            'message': 'File uploaded and processed successfully',
-            'chunks': len(chunks)
-        }), 200
+            'message': 'File uploaded, processing started',
+            'job_id': job_id,
+            'status': 'queued'
+        }), 202
     
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_ingestion_job(current_user, job_id):
+    """Report the status and progress of a file ingestion job."""
+    try:
+        job = ingestion_jobs.get(job_id)
+        if job is None or job['username'] != current_user['username']:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({
+            'job_id': job['id'],
+            'filename': job['filename'],
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'progress': {
+                'pages_parsed': job['pages_parsed'],
+                'chunks_embedded': job['chunks_embedded'],
+                'batches_upserted': job['batches_upserted'],
+                'committed_chunks': job['committed_chunks']
+            },
+            'result': job['result'],
+            'error': job['error']
+        })
+    except Exception as e:
+        logger.error(f"Error getting ingestion job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/files', methods=['GET'])
 @token_required
 def get_user_files(current_user):
@@ -275,6 +583,138 @@ def get_user_files(current_user):
         logger.error(f"Error getting user files: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def get_user_filenames(username: str) -> List[str]:
+    """Return the names of the files a user has uploaded."""
+    conn = sqlite3.connect('users.db')
+    c = conn.cursor()
+    c.execute('SELECT filename FROM uploaded_files WHERE username = ?', (username,))
+    files = c.fetchall()
+    conn.close()
+    return [file[0] for file in files]
+
+def get_topic_content(username: str, topic: str, top_k: int, rerank: bool = False) -> Optional[List[str]]:
+    """
+    Retrieve the chunks of a user's files that best match a topic.
+    
+    Chunks come from one hybrid keyword and vector search across all of the
+    user's files, optionally reranked with the cross-encoder, so the cost
+    depends on top_k rather than on how much the user has uploaded.
+    
+    Returns:
+        - None if the user has not uploaded any files
+        - The top_k chunks, best first (may be empty if no content was found)
+    """
+    if not get_user_filenames(username):
+        return None
+    
+    candidates = hybrid_search(topic, username, top_k=RERANK_MAX_CANDIDATES if rerank else top_k)
+    if not rerank:
+        return [match['text'] for match in candidates]
+    return rerank_chunks(topic, [match['text'] for match in candidates], top_k,
+                         chunk_ids=[match['id'] for match in candidates])
+
+def get_user_content(username: str) -> Optional[List[str]]:
+    """
+    Load the content of every file a user has uploaded.
+    
+    Returns:
+        - None if the user has not uploaded any files
+        - List of file contents (may be empty if no content was found)
+    """
+    files = get_user_filenames(username)
+    
+    if not files:
+        return None
+        
+    # Get content from all files in parallel; each lookup gives up after FILE_FETCH_TIMEOUT
+    futures = [file_fetch_executor.submit(get_file_text, filename, username, FILE_FETCH_TIMEOUT) for filename in files]
+    _, not_done = wait(futures, timeout=FILE_FETCH_WAIT_TIMEOUT)
+    if not_done:
+        # Lookups still queued behind other requests are dropped; running ones stop at their own timeout
+        for future in not_done:
+            future.cancel()
+        logger.warning(f"Left out {len(not_done)} of {len(files)} files for {username} "
+                       f"that were not fetched within {FILE_FETCH_WAIT_TIMEOUT}s")
+    
+    all_chunks = []
+    for future in futures:
+        if future in not_done:
+            continue
+        content = future.result()
+        if content:
+            all_chunks.append(content)
+    return all_chunks
+
+def parse_retrieval_options(data: dict) -> Tuple[str, int, bool]:
+    """
+    Read how content is gathered for generation from a request body.
+    
+    Returns:
+        - Scope: 'topic' to retrieve the chunks matching the topic, 'library' for all files
+        - Number of chunks retrieved for the 'topic' scope
+        - Whether to rerank retrieved chunks with the cross-encoder
+    """
+    scope = data.get('scope', 'topic')
+    if scope not in ('topic', 'library'):
+        raise ValueError(f"Unsupported scope: {scope}")
+    
+    top_k = data.get('top_k', 10)
+    if not isinstance(top_k, int) or not 1 <= top_k <= RERANK_MAX_CANDIDATES:
+        raise ValueError(f'top_k must be between 1 and {RERANK_MAX_CANDIDATES}')
+    return scope, top_k, bool(data.get('rerank', False))
+
+def get_generation_content(username: str, topic: str, scope: str, top_k: int, rerank: bool) -> Optional[List[str]]:
+    """
+    Gather the text a study guide is generated from.
+    
+    Returns:
+        - None if the user has not uploaded any files
+        - List of texts (may be empty if no content was found)
+    """
+    if scope == 'library':
+        return get_user_content(username)
+    
+    chunks = get_topic_content(username, topic, top_k, rerank)
+    if chunks is not None and not chunks:
+        # Nothing indexed matches the topic, summarize the whole library instead
+        logger.info(f"No chunks retrieved for topic '{topic}', using all of {username}'s files")
+        return get_user_content(username)
+    return chunks
+
+def parse_decoding_options(data: dict) -> Tuple[str, Optional[float]]:
+    """
+    Read the decoding profile and latency budget from a request body.
+    
+    Returns:
+        - Requested decoding profile
+        - Latency budget in seconds, or None for no budget
+    """
+    profile = data.get('profile', DEFAULT_DECODING_PROFILE)
+    if profile not in DECODING_PROFILES:
+        raise ValueError(f"Unsupported profile: {profile}. Choose one of {', '.join(DECODING_PROFILES)}")
+    
+    latency_budget = data.get('latency_budget')
+    if latency_budget is not None:
+        try:
+            latency_budget = float(latency_budget)
+        except (TypeError, ValueError):
+            raise ValueError('latency_budget must be a number of seconds')
+        if latency_budget <= 0:
+            raise ValueError('latency_budget must be positive')
+    return profile, latency_budget
+
+def format_sse(event: dict) -> str:
+    """Format an event dict as a Server-Sent Events message."""
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+def sse_response(events) -> Response:
+    """Stream an iterator of event dicts to the client as Server-Sent Events."""
+    return Response(
+        stream_with_context(format_sse(event) for event in events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/generate', methods=['POST'])
 @token_required
 def generate(current_user):
@@ -282,46 +722,118 @@ def generate(current_user):
     try:
         data = request.get_json()
         topic = data.get('topic')
+        # 'truncate' summarizes the most relevant ~800 tokens, 'map_reduce' covers the whole text
+        mode = data.get('mode', 'truncate')
         
         if not topic:
             return jsonify({'error': 'No topic provided'}), 400
+        if mode not in ('truncate', 'map_reduce'):
+            return jsonify({'error': f'Unsupported mode: {mode}'}), 400
+        try:
+            scope, top_k, rerank = parse_retrieval_options(data)
+            profile, latency_budget = parse_decoding_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
             
-        # Get user's uploaded files
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        c.execute('SELECT filename FROM uploaded_files WHERE username = ?', (current_user['username'],))
-        files = c.fetchall()
-        conn.close()
+        # Get content from the user's uploaded files
+        all_chunks = get_generation_content(current_user['username'], topic, scope, top_k, rerank)
         
-        if not files:
+        if all_chunks is None:
             return jsonify({'error': 'No files uploaded yet'}), 400
             
-        # Get content from all files
-        all_chunks = []
-        for file in files:
-            filename = file[0]
-            content, _ = get_file_content(filename, current_user['username'])
-            if content:
-                all_chunks.append(content)
-            
         if not all_chunks:
             return jsonify({'error': 'No content found in files'}), 400
             
-        # Generate study guide
-        study_guide = generate_study_guide(topic, ' '.join(all_chunks))
+        # Serve a cached summary if this topic was already generated from the same content
+        input_text = ' '.join(all_chunks)
+        cache_key = make_cache_key(input_text, topic, params={**get_generation_params(), 'mode': mode, 'profile': profile,
+                                                              'scope': scope, 'top_k': top_k, 'rerank': rerank})
+        study_guide = summary_cache.get(cache_key)
+        generation_info = {'profile': profile}
         
-        if study_guide.startswith('Error'):
-            return jsonify({'error': study_guide}), 500
+        if study_guide is None:
+            # Generate study guide
+            if mode == 'map_reduce':
+                study_guide = generate_study_guide_map_reduce(topic, input_text, profile=profile,
+                                                              latency_budget=latency_budget,
+                                                              generation_info=generation_info)
+            else:
+                study_guide = generate_study_guide(topic, input_text, profile=profile,
+                                                   latency_budget=latency_budget,
+                                                   generation_info=generation_info)
+            
+            if study_guide.startswith('Error'):
+                return jsonify({'error': study_guide}), 500
+                
+            # Summaries downgraded to meet a budget are not what the profile asked for
+            if generation_info['profile'] == profile:
+                summary_cache.set(cache_key, study_guide, current_user['username'])
             
         return jsonify({
             'message': 'Summary generated successfully',
-            'study_guide': study_guide
+            'study_guide': study_guide,
+            'profile': generation_info['profile']
         })
         
     except Exception as e:
         logger.error(f"Error generating study guide: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/generate-stream', methods=['POST'])
+@token_required
+def generate_stream(current_user):
+    """Stream a study guide from uploaded documents as Server-Sent Events."""
+    data = request.get_json()
+    topic = data.get('topic')
+    mode = data.get('mode', 'truncate')
+    username = current_user['username']
+    
+    if not topic:
+        return jsonify({'error': 'No topic provided'}), 400
+    if mode not in ('truncate', 'map_reduce'):
+        return jsonify({'error': f'Unsupported mode: {mode}'}), 400
+    try:
+        scope, top_k, rerank = parse_retrieval_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def events():
+        # Set when the client disconnects and the stream is closed
+        cancel_event = threading.Event()
+        try:
+            all_chunks = get_generation_content(username, topic, scope, top_k, rerank)
+            if all_chunks is None:
+                yield {'event': 'error', 'error': 'No files uploaded yet'}
+                return
+            if not all_chunks:
+                yield {'event': 'error', 'error': 'No content found in files'}
+                return
+            yield {'event': 'progress', 'stage': 'retrieve', 'scope': scope, 'texts': len(all_chunks)}
+            
+            input_text = ' '.join(all_chunks)
+            cache_key = make_cache_key(input_text, topic, params={**get_generation_params(), 'mode': mode, 'stream': True,
+                                                                  'scope': scope, 'top_k': top_k, 'rerank': rerank})
+            study_guide = summary_cache.get(cache_key)
+            if study_guide is not None:
+                yield {'event': 'done', 'study_guide': study_guide, 'cached': True}
+                return
+            
+            if mode == 'map_reduce':
+                input_text = build_map_reduce_context(topic, input_text)
+                yield {'event': 'progress', 'stage': 'map_reduce'}
+            
+            for event in stream_study_guide(topic, input_text, cancel_event):
+                if event['event'] == 'done':
+                    summary_cache.set(cache_key, event['study_guide'], username)
+                yield event
+        except Exception as e:
+            logger.error(f"Error streaming study guide: {str(e)}")
+            yield {'event': 'error', 'error': str(e)}
+        finally:
+            cancel_event.set()
+    
+    return sse_response(events())
+
 @app.route('/generate-from-text', methods=['POST'])
 @token_required
 def generate_from_text(current_user):
@@ -334,22 +846,73 @@ def generate_from_text(current_user):
         
         if not text_chunks:
             return jsonify({'error': 'No text provided'}), 400
+        try:
+            profile, latency_budget = parse_decoding_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
             
-        # Generate study guide
-        study_guide = generate_study_guide_from_text(text_chunks, topic, preferences)
+        # Serve a cached summary if this topic was already generated from the same text
+        cache_key = make_cache_key('\n'.join(text_chunks), topic, preferences,
+                                   {**get_generation_params(), 'profile': profile})
+        study_guide = summary_cache.get(cache_key)
+        generation_info = {'profile': profile}
         
-        if study_guide.startswith('Error'):
-            return jsonify({'error': study_guide}), 500
+        if study_guide is None:
+            # Generate study guide
+            study_guide = generate_study_guide_from_text(text_chunks, topic, preferences, profile,
+                                                         latency_budget, generation_info)
+            
+            if study_guide.startswith('Error'):
+                return jsonify({'error': study_guide}), 500
+                
+            # Summaries downgraded to meet a budget are not what the profile asked for
+            if generation_info['profile'] == profile:
+                summary_cache.set(cache_key, study_guide)
             
         return jsonify({
             'message': 'Summary generated successfully',
-            'study_guide': study_guide
+            'study_guide': study_guide,
+            'profile': generation_info['profile']
         })
         
     except Exception as e:
         logger.error(f"Error generating study guide: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/generate-from-text-stream', methods=['POST'])
+@token_required
+def generate_from_text_stream(current_user):
+    """Stream a study guide from provided text as Server-Sent Events."""
+    data = request.get_json()
+    text_chunks = data.get('text_chunks', [])
+    topic = data.get('topic', 'General Topic')
+    preferences = data.get('preferences', '')
+    
+    if not text_chunks:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    def events():
+        # Set when the client disconnects and the stream is closed
+        cancel_event = threading.Event()
+        try:
+            cache_key = make_cache_key('\n'.join(text_chunks), topic, preferences, {**get_generation_params(), 'stream': True})
+            study_guide = summary_cache.get(cache_key)
+            if study_guide is not None:
+                yield {'event': 'done', 'study_guide': study_guide, 'cached': True}
+                return
+            
+            for event in stream_study_guide_from_text(text_chunks, topic, preferences, cancel_event):
+                if event['event'] == 'done':
+                    summary_cache.set(cache_key, event['study_guide'])
+                yield event
+        except Exception as e:
+            logger.error(f"Error streaming study guide: {str(e)}")
+            yield {'event': 'error', 'error': str(e)}
+        finally:
+            cancel_event.set()
+    
+    return sse_response(events())
+
 @app.route('/api/files/<filename>', methods=['GET'])
 @token_required
 def get_file(current_user, filename):
@@ -406,9 +969,7 @@ def get_file_content(current_user, filename):
             import PyPDF2
             with open(file_path, 'rb') as f:
                 pdf = PyPDF2.PdfReader(f)
-                content = ''
-                for page in pdf.pages:
-                    content += page.extract_text() + '\n'
+                content = ''.join(page.extract_text() + '\n' for page in pdf.pages)
         elif ext.lower() == '.docx':
             # For DOCX files, you might want to use python-docx
             # This is a simple example that might not work for all DOCX files
@@ -427,29 +988,83 @@ def get_file_content(current_user, filename):
         logger.error(f"Error reading file content: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/files/<filename>/chunks', methods=['GET'])
+@token_required
+def get_file_chunks(current_user, filename):
+    """Get a page of a file's chunks in document order."""
+    try:
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+        
+        chunks = chunk_store.get_chunks(current_user['username'], filename, offset, limit)
+        total = chunk_store.count_chunks(current_user['username'], filename)
+        if not total:
+            return jsonify({'error': 'File not found or access denied'}), 404
+        
+        return jsonify({
+            'filename': filename,
+            'offset': offset,
+            'total': total,
+            'chunks': chunks
+        })
+    except Exception as e:
+        logger.error(f"Error reading file chunks: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def get_file_text(filename: str, username: str, timeout: Optional[float] = None) -> Optional[str]:
+    """
+    Retrieve the text of a specific file by joining its chunks in document order.
+    
+    Args:
+        filename (str): Name of the file
+        username (str): Owner of the file
+        timeout (float, optional): Seconds the lookup may take, across the chunk
+            store read and the vector index fallback
+    
+    Returns:
+        The combined text, or None if the file has no content or the lookup timed out
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        combined_text = chunk_store.get_file_text(username, filename, timeout)
+        
+        if combined_text is None:
+            # Files uploaded before the chunk store existed are only in the vector index
+            logger.warning(f"No stored chunks for {filename}, falling back to a vector index search")
+            results = search_similar_documents(
+                query="",
+                filter={
+                    'filename': {"$eq": filename},
+                    'username': {"$eq": username}
+                },
+                top_k=1000,
+                timeout=None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            if not results:
+                return None
+            combined_text = ' '.join(results)
+        return combined_text
+    
+    except TimeoutError:
+        logger.warning(f"Retrieving text of {filename} took longer than {timeout}s")
+        return None
+    except Exception as e:
+        logger.error(f"Error retrieving file text: {str(e)}")
+        return None
+
 def get_file_content(filename: str, username: str) -> Tuple[str, List[str]]:
     """
-    Retrieve all chunks of a specific file from Pinecone.
+    Retrieve all chunks of a specific file, in document order.
     Returns:
         - Combined text
         - List of all noun phrases found in the document (for better distractor generation)
     """
     try:
-        # Search for all chunks with the exact filename
-        results = search_similar_documents(
-            query="",  # Empty query returns all matching documents
-            filter={
-                'filename': {"$eq": filename},
-                'username': {"$eq": username}
-            },
-            top_k=1000  # Get all chunks for this file
-        )
-        
-        if not results:
+        combined_text = get_file_text(filename, username)
+        if combined_text is None:
             return None, None
             
-        # Combine all chunks and extract noun phrases
-        combined_text = ' '.join(results)
+        # Extract noun phrases
         noun_phrases = extract_noun_phrases(combined_text)
         
         return combined_text, noun_phrases
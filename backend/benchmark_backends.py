@@ -0,0 +1,107 @@
+"""
+Compare latency and output drift between generator backends.
+
+Usage:
+    python benchmark_backends.py --backends pytorch pytorch-int8 onnx --runs 3
+    python benchmark_backends.py --input data/uploaded_files/test_document.txt --topic "Mount Everest"
+
+The first backend is the reference: every other backend's output is compared
+with it for each prompt, as word-level similarity of the generated text.
+"""
+import argparse
+import difflib
+import statistics
+import time
+
+import generator
+from generator import (GENERATOR_MODEL_NAME, SUMMARY_GENERATION_KWARGS, REWRITE_GENERATION_KWARGS,
+                       build_study_guide_prompt, build_clarity_prompt)
+from inference_backends import GENERATION_BACKENDS, load_generation_backend
+
+SAMPLE_CONTEXT = (
+    "Mount Everest is Earth's highest mountain above sea level, located in the Mahalangur Himal "
+    "sub-range of the Himalayas. The China-Nepal border runs across its summit point. Its elevation "
+    "of 8,848.86 m was most recently established in 2020 by the Chinese and Nepali authorities. "
+    "Mount Everest attracts many climbers, including highly experienced mountaineers. There are two "
+    "main climbing routes, one approaching the summit from the southeast in Nepal and the other from "
+    "the north in Tibet. While not posing substantial technical climbing challenges on the standard "
+    "route, Everest presents dangers such as altitude sickness, weather, and wind, as well as hazards "
+    "from avalanches and the Khumbu Icefall."
+)
+
+def build_prompts(context: str, topic: str) -> list:
+    """Build the summary and sentence-rewrite prompts used by the service."""
+    sentences = [s.strip() for s in context.split('.') if s.strip()]
+    return [
+        ('summary', build_study_guide_prompt(topic, context), SUMMARY_GENERATION_KWARGS),
+        *[('rewrite', build_clarity_prompt(sentence, topic), REWRITE_GENERATION_KWARGS) for sentence in sentences[:3]]
+    ]
+
+def run_backend(pipe, prompts: list, runs: int) -> dict:
+    """Time every prompt on one backend and keep the last output of each."""
+    latencies = {kind: [] for kind, _, _ in prompts}
+    outputs = []
+
+    # Warm up so one-time initialization is not counted
+    pipe(prompts[0][1], **prompts[0][2])
+
+    for kind, prompt, kwargs in prompts:
+        output = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = pipe(prompt, **kwargs)[0]['generated_text']
+            latencies[kind].append(time.perf_counter() - start)
+        outputs.append(output)
+
+    return {'latencies': latencies, 'outputs': outputs}
+
+def drift(reference: str, candidate: str) -> float:
+    """Similarity of two outputs at word level, 1.0 meaning identical."""
+    return difflib.SequenceMatcher(None, reference.split(), candidate.split()).ratio()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=list(GENERATION_BACKENDS),
+                        choices=list(GENERATION_BACKENDS), help='Backends to compare, reference first')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per prompt')
+    parser.add_argument('--input', help='Text file to use as context instead of the built-in sample')
+    parser.add_argument('--topic', default='Mount Everest', help='Topic for the prompts')
+    args = parser.parse_args()
+
+    context = SAMPLE_CONTEXT
+    if args.input:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            context = f.read()
+    prompts = build_prompts(context, args.topic)
+
+    results = {}
+    for backend in args.backends:
+        print(f"Loading backend: {backend}")
+        load_start = time.perf_counter()
+        if backend == generator.GENERATOR_BACKEND:
+            pipe = generator.generator  # Already loaded by generator.py
+        else:
+            pipe = load_generation_backend(GENERATOR_MODEL_NAME, backend)
+        print(f"  loaded in {time.perf_counter() - load_start:.1f}s")
+        results[backend] = run_backend(pipe, prompts, args.runs)
+
+    reference = args.backends[0]
+    print()
+    print(f"{'backend':<14}{'kind':<10}{'mean (s)':>10}{'p50 (s)':>10}{'max (s)':>10}{'speedup':>10}{'drift':>8}")
+    for backend, result in results.items():
+        for kind, latencies in result['latencies'].items():
+            mean = statistics.mean(latencies)
+            reference_mean = statistics.mean(results[reference]['latencies'][kind])
+            similarities = [
+                drift(ref, out)
+                for (k, _, _), ref, out in zip(prompts, results[reference]['outputs'], result['outputs'])
+                if k == kind
+            ]
+            print(f"{backend:<14}{kind:<10}{mean:>10.2f}{statistics.median(latencies):>10.2f}"
+                  f"{max(latencies):>10.2f}{reference_mean / mean:>9.2f}x{1 - statistics.mean(similarities):>8.2f}")
+
+    print()
+    print("drift = 1 - word-level similarity to the reference backend's output (0.00 means identical)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark the token-aware chunker on a synthetic corpus.
+
+Usage:
+    python benchmark_chunking.py --sentences 20000
+    python benchmark_chunking.py --input data/uploaded_files/test_document.txt --overlap 0 32 64
+
+Reports chunking throughput, checks that run time grows linearly with the
+corpus, and compares chunk sizes in model tokens against the previous
+1000-character sentence chunker, whose long chunks were silently cut off
+at the embedding model's 256 word-piece limit.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from chunker import TokenChunker, get_tokenizer, CHUNK_MAX_TOKENS, MODEL_MAX_TOKENS, split_sentences_regex
+
+WORDS = ("mountain glacier summit climber altitude oxygen expedition route weather avalanche ridge base camp "
+         "ice fall rope tent storm season permit sherpa valley peak acclimatization hypothermia crevasse "
+         "Khumbu Himalayas Everest Nepal Tibet 8848 metres 1953 Hillary Norgay").split()
+
+def synthetic_corpus(sentences: int, seed: int = 0) -> str:
+    """Build text with a realistic spread of sentence lengths, including a few very long sentences."""
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(sentences):
+        length = rng.randint(120, 300) if rng.random() < 0.01 else rng.randint(4, 35)
+        parts.append(' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.')
+    return ' '.join(parts)
+
+def char_chunks(text: str, max_chunk_size: int = 1000) -> list:
+    """The previous chunker: whole sentences packed into chunks of at most 1000 characters."""
+    chunks, current, size = [], [], 0
+    for sentence in split_sentences_regex(text):
+        if size + len(sentence) > max_chunk_size and current:
+            chunks.append(' '.join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += len(sentence)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+def token_lengths(chunks: list) -> list:
+    """Length of each chunk in model tokens, including [CLS] and [SEP]."""
+    return [len(ids) for ids in get_tokenizer()(chunks, add_special_tokens=True)['input_ids']]
+
+def report(label: str, chunks: list, elapsed: float, text: str) -> None:
+    lengths = token_lengths(chunks)
+    over = sum(1 for length in lengths if length > MODEL_MAX_TOKENS)
+    lost = sum(length - MODEL_MAX_TOKENS for length in lengths if length > MODEL_MAX_TOKENS)
+    print(f"{label:<28}{len(chunks):>8}{elapsed:>10.3f}s{len(text) / elapsed / 1e6:>10.2f}"
+          f"{statistics.mean(lengths):>10.1f}{max(lengths):>8}{over:>8}{lost:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sentences', type=int, default=20000, help='Sentences in the synthetic corpus')
+    parser.add_argument('--input', help='Text file to chunk instead of the synthetic corpus')
+    parser.add_argument('--overlap', type=int, nargs='+', default=[0, 32], help='Overlap settings to compare, in tokens')
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = synthetic_corpus(args.sentences)
+    print(f"Chunking {len(text) / 1e6:.1f}M characters")
+
+    # Warm up so tokenizer loading is not counted
+    TokenChunker().chunk_text(text[:10000])
+
+    print(f"{'chunker':<28}{'chunks':>8}{'time':>11}{'MB/s':>10}{'mean tok':>10}{'max':>8}{'over':>8}{'tok lost':>12}")
+    start = time.perf_counter()
+    chunks = char_chunks(text)
+    report('1000 chars (before)', chunks, time.perf_counter() - start, text)
+    for overlap in args.overlap:
+        chunker = TokenChunker(CHUNK_MAX_TOKENS, overlap)
+        start = time.perf_counter()
+        chunks = chunker.chunk_text(text)
+        report(f'{CHUNK_MAX_TOKENS} tokens, overlap {overlap}', chunks, time.perf_counter() - start, text)
+    print("over = chunks longer than the model's input limit; tok lost = word pieces truncated away")
+
+    # Linear scaling: doubling the input should roughly double the time
+    print()
+    print(f"{'corpus size':<16}{'time':>11}{'per MB':>12}")
+    base = text[:len(text) // 4]
+    for factor in (1, 2, 4, 8):
+        corpus = ' '.join([base] * factor)
+        start = time.perf_counter()
+        TokenChunker().chunk_text(corpus)
+        elapsed = time.perf_counter() - start
+        print(f"{factor}x{'':<14}{elapsed:>10.3f}s{elapsed / (len(corpus) / 1e6):>11.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Measure embedding throughput for document chunks.
+
+Usage:
+    python benchmark_embedding.py --chunks 500
+    python benchmark_embedding.py --input data/uploaded_files/test_document.pdf --batch-sizes 16 32 64
+
+Compares the old one-chunk-per-call encoding with batched encoding, with
+and without length-sorted bucketing, and prints chunks per second.
+"""
+import argparse
+import os
+import random
+import time
+
+# Benchmarks never need the remote index
+os.environ.setdefault('VECTOR_STORE_BACKEND', 'local')
+
+from ingestion import process_uploaded_file
+from retrieval import model, embed_texts
+
+WORDS = ("mountain glacier summit climber altitude oxygen expedition route weather avalanche "
+         "ridge base camp ice fall rope tent storm season permit sherpa valley peak").split()
+
+def synthetic_chunks(count: int, seed: int = 0) -> list:
+    """Build chunks with a realistic spread of lengths, from one sentence to about 1000 characters."""
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        sentences = []
+        for _ in range(rng.randint(1, 12)):
+            sentences.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize() + '.')
+        chunks.append(' '.join(sentences))
+    return chunks
+
+def measure(label: str, fn, count: int) -> None:
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36}{elapsed:>10.2f}s{count / elapsed:>14.1f} chunks/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=500, help='Number of synthetic chunks')
+    parser.add_argument('--input', help='File to chunk instead of using synthetic chunks')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--skip-single', action='store_true', help='Skip the slow one-chunk-per-call baseline')
+    args = parser.parse_args()
+
+    chunks = process_uploaded_file(args.input) if args.input else synthetic_chunks(args.chunks)
+    print(f"Embedding {len(chunks)} chunks")
+
+    # Warm up so model initialization is not counted
+    embed_texts(chunks[:8])
+
+    print(f"{'method':<36}{'time':>11}{'throughput':>20}")
+    if not args.skip_single:
+        measure('one chunk per call (before)', lambda: [model.encode(chunk) for chunk in chunks], len(chunks))
+    for batch_size in args.batch_sizes:
+        measure(f'batched, batch_size={batch_size}',
+                lambda: embed_texts(chunks, batch_size=batch_size, sort_by_length=False), len(chunks))
+        measure(f'batched + length sort, batch_size={batch_size}',
+                lambda: embed_texts(chunks, batch_size=batch_size, sort_by_length=True), len(chunks))
+
+if __name__ == "__main__":
+    main()
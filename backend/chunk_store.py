@@ -0,0 +1,298 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default location of the chunk store
+CHUNK_STORE_DB = os.path.join(os.path.dirname(__file__), 'chunk_store.db')
+
+# Chunks read per query when iterating over a whole file
+CHUNK_PAGE_SIZE = 256
+
+# Positional ids looked up per index request when finding a file's legacy vectors
+LEGACY_ID_BATCH_SIZE = 100
+
+def make_vector_id(username: str, filename: str, chunk_hash: str, occurrence: int = 0) -> str:
+    """
+    Derive a vector id from a chunk's content rather than its position.
+
+    An unchanged chunk keeps its id when the file is uploaded again, even
+    if text was inserted before it.
+
+    Args:
+        username (str): Owner of the file
+        filename (str): Name of the file
+        chunk_hash (str): Hash of the chunk text
+        occurrence (int): How many earlier chunks of the file have the same text
+
+    Returns:
+        str: Vector id
+    """
+    key = f"{username}\0{filename}\0{chunk_hash}\0{occurrence}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def find_legacy_vector_ids(fetch_metadata: Callable[[List[str]], Dict[str, dict]], username: str, filename: str,
+                           batch_size: int = LEGACY_ID_BATCH_SIZE) -> List[str]:
+    """
+    Find the vectors a file got before ids were derived from content.
+
+    Those vectors have positional ids, f"{filename}_{i}", which do not
+    include the owner: when two users uploaded a file with the same name,
+    the later upload overwrote the earlier one's vectors. Only the ids
+    whose stored metadata names this user are returned, so cleaning up
+    never touches another user's vectors.
+
+    Args:
+        fetch_metadata (Callable): Takes a list of ids and returns the
+            metadata of those that exist in the index, keyed by id
+        username (str): Owner of the file
+        filename (str): Name of the file
+        batch_size (int): Ids looked up per call
+
+    Returns:
+        List[str]: Positional ids owned by this user's copy of the file
+    """
+    ids = []
+    start = 0
+    while True:
+        batch = [f"{filename}_{i}" for i in range(start, start + batch_size)]
+        found = fetch_metadata(batch)
+        # Positions were assigned from 0 without gaps, so the first empty batch is past every upload
+        if not found:
+            return ids
+        ids.extend(vector_id for vector_id in batch
+                   if vector_id in found
+                   and found[vector_id].get('username') == username
+                   and found[vector_id].get('filename') == filename)
+        start += batch_size
+
+class ChunkStore:
+    """
+    Ordered store of the text chunks of every uploaded file.
+
+    Chunks are keyed by (username, filename, chunk_index) and written at
+    upload time alongside the vector index, so a file's text can be read
+    back in order without a similarity search. The store also records the
+    ids of the vectors each file has in the index, so a new version of the
+    file only has to upsert new chunks and delete the ones that are gone.
+    """
+
+    def __init__(self, db_path: str = CHUNK_STORE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.chunks_read = 0
+        self.chunks_written = 0
+        self._init_db()
+
+    def _connect(self, timeout: float = 30) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=timeout)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS chunks
+                     (username TEXT NOT NULL,
+                      filename TEXT NOT NULL,
+                      chunk_index INTEGER NOT NULL,
+                      text TEXT NOT NULL,
+                      PRIMARY KEY (username, filename, chunk_index))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS vectors
+                     (username TEXT NOT NULL,
+                      filename TEXT NOT NULL,
+                      vector_id TEXT NOT NULL,
+                      PRIMARY KEY (username, filename, vector_id))''')
+        conn.commit()
+        conn.close()
+
+    def append_chunks(self, username: str, filename: str, start_index: int, chunks: List[str]) -> None:
+        """
+        Store a batch of a file's chunks while the file is still being processed.
+
+        Args:
+            username (str): Owner of the file
+            filename (str): Name of the file
+            start_index (int): Chunk index of the first chunk in the batch
+            chunks (List[str]): Chunk texts in document order
+        """
+        conn = self._connect()
+        try:
+            conn.executemany('INSERT OR REPLACE INTO chunks (username, filename, chunk_index, text) VALUES (?, ?, ?, ?)',
+                             [(username, filename, start_index + i, chunk) for i, chunk in enumerate(chunks)])
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.chunks_written += len(chunks)
+
+    def get_chunks(self, username: str, filename: str, offset: int = 0, limit: Optional[int] = None,
+                   deadline: Optional[float] = None) -> List[str]:
+        """
+        Read a page of a file's chunks in document order.
+
+        Args:
+            username (str): Owner of the file
+            filename (str): Name of the file
+            offset (int): Index of the first chunk to return
+            limit (int, optional): Maximum number of chunks to return, all remaining if None
+            deadline (float, optional): time.monotonic() value after which the read is abandoned
+
+        Returns:
+            List[str]: Chunk texts ordered by chunk index
+
+        Raises:
+            TimeoutError: If the deadline passed
+        """
+        conn = self._connect(30 if deadline is None else max(0.0, deadline - time.monotonic()))
+        if deadline is not None:
+            # Interrupt the query once the deadline passes
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT text FROM chunks
+                         WHERE username = ? AND filename = ? AND chunk_index >= ?
+                         ORDER BY chunk_index
+                         LIMIT ?''',
+                      (username, filename, offset, -1 if limit is None else limit))
+            chunks = [row[0] for row in c.fetchall()]
+        except sqlite3.OperationalError:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Reading chunks of {filename} timed out")
+            raise
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.reads += 1
+            self.chunks_read += len(chunks)
+        return chunks
+
+    def iter_chunks(self, username: str, filename: str, page_size: int = CHUNK_PAGE_SIZE,
+                    deadline: Optional[float] = None) -> Iterator[str]:
+        """
+        Iterate over all of a file's chunks in order, reading one page at a time.
+
+        Args:
+            username (str): Owner of the file
+            filename (str): Name of the file
+            page_size (int): Chunks read per query
+            deadline (float, optional): time.monotonic() value after which reading is abandoned
+
+        Yields:
+            str: Chunk texts ordered by chunk index
+        """
+        offset = 0
+        while True:
+            page = self.get_chunks(username, filename, offset, page_size, deadline)
+            yield from page
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def get_file_text(self, username: str, filename: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Read a file's full text by joining its chunks in order.
+
+        Args:
+            username (str): Owner of the file
+            filename (str): Name of the file
+            timeout (float, optional): Seconds the read may take
+
+        Returns:
+            Optional[str]: The file text, or None if no chunks are stored for it
+
+        Raises:
+            TimeoutError: If the read took longer than timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        text = ' '.join(self.iter_chunks(username, filename, deadline=deadline))
+        return text or None
+
+    def count_chunks(self, username: str, filename: str) -> int:
+        """Return the number of chunks stored for a file."""
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*) FROM chunks WHERE username = ? AND filename = ?', (username, filename))
+            return c.fetchone()[0]
+        finally:
+            conn.close()
+
+    def list_files(self) -> List[Tuple[str, str]]:
+        """Return the (username, filename) of every file with stored chunks."""
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT DISTINCT username, filename FROM chunks').fetchall()
+        finally:
+            conn.close()
+
+    def delete_file(self, username: str, filename: str) -> int:
+        """
+        Remove every chunk of a file.
+
+        Returns:
+            int: Number of chunks removed
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('DELETE FROM chunks WHERE username = ? AND filename = ?', (username, filename))
+            removed = c.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return removed
+
+    def get_vector_ids(self, username: str, filename: str) -> List[str]:
+        """
+        Return the ids of the vectors recorded for a file.
+
+        Files uploaded before ids were recorded have none; see
+        find_legacy_vector_ids.
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT vector_id FROM vectors WHERE username = ? AND filename = ?', (username, filename))
+            return [row[0] for row in c.fetchall()]
+        finally:
+            conn.close()
+
+    def add_vector_ids(self, username: str, filename: str, vector_ids: List[str]) -> None:
+        """Record vectors upserted for a file."""
+        conn = self._connect()
+        try:
+            conn.executemany('INSERT OR IGNORE INTO vectors (username, filename, vector_id) VALUES (?, ?, ?)',
+                             [(username, filename, vector_id) for vector_id in vector_ids])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def remove_vector_ids(self, username: str, filename: str, vector_ids: List[str]) -> None:
+        """Forget vectors deleted from the index."""
+        conn = self._connect()
+        try:
+            conn.executemany('DELETE FROM vectors WHERE username = ? AND filename = ? AND vector_id = ?',
+                             [(username, filename, vector_id) for vector_id in vector_ids])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return read/write counters."""
+        with self._lock:
+            return {
+                'reads': self.reads,
+                'chunks_read': self.chunks_read,
+                'chunks_written': self.chunks_written
+            }
+
+# Shared chunk store instance
+chunk_store = ChunkStore()
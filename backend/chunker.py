@@ -1,85 +1,195 @@
-from typing import List
+import logging
+import os
+import re
+import threading
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional
 
-def chunk_text(text: str, chunk_size: int = 600, overlap: int = 100, min_chunk_length: int = 100) -> List[str]:
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Tokenizer of the embedding model; chunk sizes are measured in its word pieces
+CHUNK_TOKENIZER_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+MODEL_MAX_TOKENS = 256  # all-MiniLM-L6-v2 truncates longer inputs
+CHUNK_MAX_TOKENS = MODEL_MAX_TOKENS - 2  # Leave room for [CLS] and [SEP]
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 32))  # Trailing sentences repeated in the next chunk
+CHUNKER_VERSION = 1  # Bump when a change to the chunking code changes its output
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+def get_tokenizer():
+    """Load the chunking tokenizer on first use."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                from transformers import AutoTokenizer
+                logger.info(f"Loading chunking tokenizer: {CHUNK_TOKENIZER_NAME}")
+                _tokenizer = AutoTokenizer.from_pretrained(CHUNK_TOKENIZER_NAME)
+    return _tokenizer
+
+def split_sentences_regex(text: str) -> List[str]:
+    """Split text into sentences at ., ! or ? followed by whitespace."""
+    return [sentence for sentence in re.split(r'(?<=[.!?])\s+', text) if sentence]
+
+def chunker_fingerprint(max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> str:
     """
-    Split text into smaller, focused chunks with overlap.
-    
+    Identify the chunking settings, so chunks stored under other settings are not reused.
+
+    Args:
+        max_tokens (int): Maximum size of each chunk in tokens
+        overlap_tokens (int): Tokens of trailing sentences repeated in the next chunk
+
+    Returns:
+        str: Tokenizer, sizes and chunker version
+    """
+    return f"{CHUNK_TOKENIZER_NAME}:{max_tokens}:{overlap_tokens}:v{CHUNKER_VERSION}"
+
+class TokenChunker:
+    """
+    Sentence-aligned chunker that sizes chunks in tokens of the embedding model.
+
+    Sentences are packed into chunks of at most max_tokens word pieces, and
+    each chunk starts with the trailing sentences of the previous one, up to
+    overlap_tokens. Every sentence is tokenized once, in batches, and the
+    running window is updated incrementally, so chunking is linear in the
+    length of the text. Sentences longer than max_tokens are cut at token
+    boundaries rather than silently truncated by the model.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 split_sentences: Optional[Callable[[str], List[str]]] = None, tokenizer=None):
+        if max_tokens <= 0:
+            raise ValueError('max_tokens must be positive')
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError('overlap_tokens must be at least 0 and smaller than max_tokens')
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.split_sentences = split_sentences or split_sentences_regex
+        self._tokenizer = tokenizer
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer if self._tokenizer is not None else get_tokenizer()
+
+    def count_tokens(self, sentences: List[str]) -> List[int]:
+        """Return the number of word pieces in each sentence, without special tokens."""
+        if not sentences:
+            return []
+        encoded = self.tokenizer(sentences, add_special_tokens=False)['input_ids']
+        return [len(ids) for ids in encoded]
+
+    def split_long_sentence(self, sentence: str) -> List[str]:
+        """Cut a sentence longer than max_tokens into pieces at token boundaries."""
+        encoding = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoding['offset_mapping']
+        pieces = []
+        for start in range(0, len(offsets), self.max_tokens):
+            window = offsets[start:start + self.max_tokens]
+            piece = sentence[window[0][0]:window[-1][1]].strip()
+            if piece:
+                pieces.append(piece)
+        return pieces
+
+    def chunk_stream(self, segments: Iterable[str], separator: str = ' ') -> Iterator[str]:
+        """
+        Chunk a stream of text segments, such as the pages of a document.
+
+        The unfinished last sentence of each segment is carried over to the
+        next, so sentences that cross a segment boundary stay whole. Chunks
+        are yielded as soon as they are full, and are the same as those of
+        chunk_text(separator.join(segments)).
+
+        Args:
+            segments (Iterable[str]): Consecutive pieces of the document text
+            separator (str): Text between consecutive segments; ' ' for pages or
+                paragraphs, '' for blocks cut from a continuous text
+
+        Yields:
+            str: Text chunks in document order
+        """
+        window = deque()  # (sentence, tokens) pairs of the chunk being built
+        window_tokens = 0
+        fresh = False  # Whether the window holds sentences not yet emitted
+        carry = ''
+
+        def add(sentence: str, tokens: int):
+            nonlocal window_tokens, fresh
+            if tokens > self.max_tokens:
+                pieces = self.split_long_sentence(sentence)
+                for piece, piece_tokens in zip(pieces, self.count_tokens(pieces)):
+                    yield from add(piece, min(piece_tokens, self.max_tokens))
+                return
+
+            if window_tokens + tokens > self.max_tokens and fresh:
+                yield ' '.join(s for s, _ in window)
+                fresh = False
+                # Keep the trailing sentences that fit in the overlap
+                while window and window_tokens > self.overlap_tokens:
+                    window_tokens -= window.popleft()[1]
+            # Drop overlap that would leave no room for the new sentence
+            while window and window_tokens + tokens > self.max_tokens:
+                window_tokens -= window.popleft()[1]
+
+            window.append((sentence, tokens))
+            window_tokens += tokens
+            fresh = True
+
+        first = True
+        for segment in segments:
+            # The segment edges are kept: a segment may start or end in the middle of a word
+            text = segment if first else f"{carry}{separator}{segment}"
+            first = False
+            # Collapse runs of whitespace
+            text = re.sub(r'\s+', ' ', text)
+
+            sentences = [s.strip() for s in self.split_sentences(text) if s.strip()]
+            if not sentences:
+                carry = text
+                continue
+            counts = self.count_tokens(sentences)
+            # The last sentence may continue in the next segment, unless it is already too long to keep waiting
+            if counts[-1] <= self.max_tokens:
+                carry = sentences.pop()
+                counts.pop()
+                # Keep the whitespace after it, which separates it from the next segment
+                if text.endswith(' '):
+                    carry += ' '
+            else:
+                carry = ''
+            for sentence, tokens in zip(sentences, counts):
+                yield from add(sentence, tokens)
+
+        carry = carry.strip()
+        if carry:
+            yield from add(carry, self.count_tokens([carry])[0])
+        if fresh:
+            yield ' '.join(s for s, _ in window)
+
+    def chunk_text(self, text: str) -> List[str]:
+        """
+        Split text into token-sized chunks of complete sentences.
+
+        Args:
+            text (str): Input text to chunk
+
+        Returns:
+            List[str]: List of text chunks
+        """
+        return list(self.chunk_stream([text]))
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """
+    Split text into overlapping chunks of at most max_tokens tokens.
+
     Args:
         text (str): Text to split into chunks
-        chunk_size (int): Target size of each chunk in characters (reduced for more focused chunks)
-        overlap (int): Number of characters to overlap between chunks
-        min_chunk_length (int): Minimum length for a chunk to be included
-        
+        max_tokens (int): Maximum size of each chunk in tokens of the embedding model
+        overlap_tokens (int): Maximum number of tokens of trailing sentences repeated
+            at the start of the next chunk
+
     Returns:
         List[str]: List of text chunks
     """
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    sentences_per_chunk = 3  # Maximum number of sentences per chunk
-    
-    # Split text into sentences first to avoid cutting mid-sentence
-    sentences = text.split('. ')
-    
-    for sentence in sentences:
-        # Add period back to sentence
-        sentence = sentence.strip() + '. '
-        
-        # If adding this sentence would exceed the chunk size or sentence limit
-        if (current_size + len(sentence) > chunk_size) or (len(current_chunk) >= sentences_per_chunk):
-            # If we have content in the current chunk, save it
-            if current_chunk:
-                chunk_text = ''.join(current_chunk)
-                # Only add chunk if it meets minimum length requirement
-                if len(chunk_text) >= min_chunk_length:
-                    chunks.append(chunk_text)
-                    
-                    # Keep the last part for overlap
-                    overlap_start = max(0, len(chunk_text) - overlap)
-                    current_chunk = [chunk_text[overlap_start:]]
-                    current_size = len(current_chunk[0])
-                else:
-                    logger.info(f"Skipping short chunk (length: {len(chunk_text)})")
-                    current_chunk = []
-                    current_size = 0
-            else:
-                # If the sentence itself is too long, split it
-                if len(sentence) > chunk_size:
-                    # Split into smaller parts
-                    parts = [sentence[i:i+chunk_size] for i in range(0, len(sentence), chunk_size)]
-                    for part in parts:
-                        if len(part) >= min_chunk_length:
-                            chunks.append(part)
-                        else:
-                            logger.info(f"Skipping short part (length: {len(part)})")
-                    current_chunk = []
-                    current_size = 0
-                else:
-                    current_chunk = [sentence]
-                    current_size = len(sentence)
-        else:
-            current_chunk.append(sentence)
-            current_size += len(sentence)
-    
-    # Add the last chunk if it exists and meets minimum length
-    if current_chunk:
-        chunk_text = ''.join(current_chunk)
-        if len(chunk_text) >= min_chunk_length:
-            chunks.append(chunk_text)
-        else:
-            logger.info(f"Skipping final short chunk (length: {len(chunk_text)})")
-    
-    # Log chunk statistics
-    logger.info(f"Created {len(chunks)} chunks")
-    total_chars = sum(len(chunk) for chunk in chunks)
-    avg_chunk_size = total_chars / len(chunks) if chunks else 0
-    logger.info(f"Average chunk size: {avg_chunk_size:.2f} characters")
-    logger.info(f"Total characters in chunks: {total_chars}")
-    
-    # Log sample chunks
-    for i, chunk in enumerate(chunks[:3]):  # Show first 3 chunks
-        logger.info(f"\nChunk {i+1} (length: {len(chunk)}):")
-        logger.info(f"Start: {chunk[:100]}...")
-        logger.info(f"End: ...{chunk[-100:]}")
-    
-    return chunks 
\ No newline at end of file
+    return TokenChunker(max_tokens, overlap_tokens).chunk_text(text)
@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default location of the content-addressed store
+CONTENT_STORE_DB = os.path.join(os.path.dirname(__file__), 'content_store.db')
+
+# Bytes read at a time when hashing uploaded files
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_text(text: str) -> str:
+    """Return the SHA-256 hex digest of a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def hash_file(file_path: str) -> Tuple[str, int]:
+    """
+    Hash a file's contents without reading it into memory at once.
+
+    Args:
+        file_path (str): Path to the file
+
+    Returns:
+        Tuple[str, int]: SHA-256 hex digest and size in bytes
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+class ContentStore:
+    """
+    Content-addressed store of parsed files, chunks and chunk embeddings.
+
+    Files are keyed by the hash of their bytes and the chunker that split
+    them, and chunks by the hash of their text, so an upload whose content
+    was seen before, from any user, reuses the stored chunks and embeddings
+    instead of parsing and embedding again. Users hold references to files
+    by filename.
+    """
+
+    def __init__(self, db_path: str = CONTENT_STORE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.files_reused = 0
+        self.bytes_saved = 0
+        self.embeddings_reused = 0
+        self.embeddings_stored = 0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        # Files recorded before chunks were keyed by chunker were split by an older chunker
+        columns = [row[1] for row in c.execute('PRAGMA table_info(files)')]
+        if columns and 'chunker' not in columns:
+            logger.info("Dropping parsed files recorded without a chunker fingerprint")
+            c.execute('DROP TABLE files')
+            c.execute('DROP TABLE IF EXISTS file_chunks')
+        c.execute('''CREATE TABLE IF NOT EXISTS files
+                     (file_hash TEXT NOT NULL,
+                      chunker TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      chunk_count INTEGER NOT NULL,
+                      created_at REAL NOT NULL,
+                      PRIMARY KEY (file_hash, chunker))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS file_chunks
+                     (file_hash TEXT NOT NULL,
+                      chunker TEXT NOT NULL,
+                      chunk_index INTEGER NOT NULL,
+                      chunk_hash TEXT NOT NULL,
+                      PRIMARY KEY (file_hash, chunker, chunk_index))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS chunks
+                     (chunk_hash TEXT PRIMARY KEY,
+                      text TEXT NOT NULL)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS embeddings
+                     (chunk_hash TEXT NOT NULL,
+                      model TEXT NOT NULL,
+                      embedding BLOB NOT NULL,
+                      PRIMARY KEY (chunk_hash, model))''')
+        c.execute('''CREATE TABLE IF NOT EXISTS refs
+                     (username TEXT NOT NULL,
+                      filename TEXT NOT NULL,
+                      file_hash TEXT NOT NULL,
+                      PRIMARY KEY (username, filename))''')
+        conn.commit()
+        conn.close()
+
+    def get_file_chunks(self, file_hash: str, chunker: str) -> Optional[List[str]]:
+        """
+        Look up the chunks of a file that was parsed before.
+
+        Args:
+            file_hash (str): Hash from hash_file
+            chunker (str): Fingerprint of the chunker, from chunker.chunker_fingerprint
+
+        Returns:
+            Optional[List[str]]: Chunk texts in document order, or None for unknown content
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT size FROM files WHERE file_hash = ? AND chunker = ?', (file_hash, chunker))
+            row = c.fetchone()
+            if row is None:
+                return None
+            c.execute('''SELECT chunks.text FROM file_chunks
+                         JOIN chunks ON chunks.chunk_hash = file_chunks.chunk_hash
+                         WHERE file_chunks.file_hash = ? AND file_chunks.chunker = ?
+                         ORDER BY file_chunks.chunk_index''', (file_hash, chunker))
+            chunks = [r[0] for r in c.fetchall()]
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.files_reused += 1
+            self.bytes_saved += row[0]
+        return chunks
+
+    def add_file_chunks(self, file_hash: str, chunker: str, start_index: int, chunks: List[str]) -> None:
+        """
+        Record a batch of the chunks a file is being parsed into.
+
+        The file is not reused by later uploads until commit_file is called.
+
+        Args:
+            file_hash (str): Hash from hash_file
+            chunker (str): Fingerprint of the chunker that produced the chunks
+            start_index (int): Chunk index of the first chunk in the batch
+            chunks (List[str]): Chunk texts in document order
+        """
+        chunk_hashes = [hash_text(chunk) for chunk in chunks]
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.executemany('INSERT OR IGNORE INTO chunks (chunk_hash, text) VALUES (?, ?)',
+                          list(zip(chunk_hashes, chunks)))
+            c.executemany('''INSERT OR REPLACE INTO file_chunks (file_hash, chunker, chunk_index, chunk_hash)
+                             VALUES (?, ?, ?, ?)''',
+                          [(file_hash, chunker, start_index + i, chunk_hash) for i, chunk_hash in enumerate(chunk_hashes)])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def commit_file(self, file_hash: str, chunker: str, size: int, chunk_count: int) -> None:
+        """
+        Mark a file's chunks as complete so later uploads of the same content reuse them.
+
+        Args:
+            file_hash (str): Hash from hash_file
+            chunker (str): Fingerprint of the chunker that produced the chunks
+            size (int): File size in bytes
+            chunk_count (int): Number of chunks recorded with add_file_chunks
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            # Drop chunks left over from an earlier, longer attempt at parsing the same content
+            c.execute('DELETE FROM file_chunks WHERE file_hash = ? AND chunker = ? AND chunk_index >= ?',
+                      (file_hash, chunker, chunk_count))
+            c.execute('''INSERT OR REPLACE INTO files (file_hash, chunker, size, chunk_count, created_at)
+                         VALUES (?, ?, ?, ?, ?)''', (file_hash, chunker, size, chunk_count, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_embeddings(self, chunk_hashes: List[str], model: str) -> Dict[str, np.ndarray]:
+        """
+        Look up stored embeddings of chunks about to be upserted.
+
+        Every chunk with a stored embedding is counted as reused, so only
+        pass the chunks that would otherwise be embedded.
+
+        Args:
+            chunk_hashes (List[str]): Hashes from hash_text
+            model (str): Name of the embedding model
+
+        Returns:
+            Dict[str, np.ndarray]: Embeddings of the chunks that have one, by chunk hash
+        """
+        unique = list(dict.fromkeys(chunk_hashes))
+        found = {}
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            # Stay under SQLite's limit on bound parameters
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                c.execute(f'SELECT chunk_hash, embedding FROM embeddings WHERE model = ? AND chunk_hash IN ({placeholders})',
+                          [model, *batch])
+                for chunk_hash, blob in c.fetchall():
+                    found[chunk_hash] = np.frombuffer(blob, dtype=np.float32)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.embeddings_reused += sum(1 for chunk_hash in chunk_hashes if chunk_hash in found)
+        return found
+
+    def put_embeddings(self, chunk_hashes: List[str], embeddings: np.ndarray, model: str) -> None:
+        """
+        Store newly computed chunk embeddings.
+
+        Args:
+            chunk_hashes (List[str]): Hashes from hash_text
+            embeddings (np.ndarray): One embedding row per chunk hash
+            model (str): Name of the embedding model
+        """
+        rows = [(chunk_hash, model, np.asarray(embedding, dtype=np.float32).tobytes())
+                for chunk_hash, embedding in zip(chunk_hashes, embeddings)]
+        conn = self._connect()
+        try:
+            conn.executemany('INSERT OR IGNORE INTO embeddings (chunk_hash, model, embedding) VALUES (?, ?, ?)', rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.embeddings_stored += len(rows)
+
+    def add_ref(self, username: str, filename: str, file_hash: str) -> None:
+        """Point a user's filename at stored content."""
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO refs (username, filename, file_hash) VALUES (?, ?, ?)',
+                         (username, filename, file_hash))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return deduplication counters."""
+        with self._lock:
+            return {
+                'files_reused': self.files_reused,
+                'bytes_saved': self.bytes_saved,
+                'embeddings_reused': self.embeddings_reused,
+                'embeddings_stored': self.embeddings_stored
+            }
+
+# Shared content store instance
+content_store = ContentStore()
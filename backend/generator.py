@@ -1,24 +1,274 @@
-from transformers import pipeline
-import torch
-from typing import List
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from inference_backends import GENERATOR_BACKEND, load_generation_backend
+from inference_scheduler import InferenceScheduler, SchedulerQueueFullError
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional
 import logging
+import threading
+import time
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Initialize the text2text-generation pipeline
+# Model used for all text2text generation
+GENERATOR_MODEL_NAME = "google/flan-t5-base"
+
+# Initialize the text2text-generation pipeline with the configured backend
 try:
-    generator = pipeline(
-        "text2text-generation",
-        model="google/flan-t5-base",
-        device=0 if torch.cuda.is_available() else -1
-    )
+    generator = load_generation_backend(GENERATOR_MODEL_NAME, GENERATOR_BACKEND)
     logger.info("Successfully loaded text2text-generation model")
 except Exception as e:
     logger.error(f"Error loading text2text-generation model: {str(e)}")
     raise
 
+# All prompts go through the scheduler so concurrent requests share padded batches
+scheduler = InferenceScheduler(generator)
+
+# Decoding parameters used for study guide generation
+SUMMARY_GENERATION_KWARGS = {
+    'max_length': 512,  # Model's maximum sequence length
+    'min_length': 100,
+    'num_beams': 5,
+    'do_sample': False,  # Deterministic generation
+    'repetition_penalty': 1.5,
+    'length_penalty': 1.0,
+    'no_repeat_ngram_size': 3
+}
+
+# Named decoding profiles for study guide generation, from cheapest to most expensive
+DECODING_PROFILES = {
+    'fast': {
+        'max_length': 256,
+        'min_length': 60,
+        'num_beams': 1,  # Greedy decoding
+        'do_sample': False,
+        'repetition_penalty': 1.5,
+        'no_repeat_ngram_size': 3
+    },
+    'balanced': {
+        'max_length': 384,
+        'min_length': 80,
+        'num_beams': 3,
+        'do_sample': False,
+        'repetition_penalty': 1.5,
+        'length_penalty': 1.0,
+        'no_repeat_ngram_size': 3
+    },
+    'quality': SUMMARY_GENERATION_KWARGS
+}
+DEFAULT_DECODING_PROFILE = 'quality'
+
+# Initial estimate of each prompt's share of a batch's run time per (input token x beam),
+# refined from observed runs
+SECONDS_PER_TOKEN_BEAM = 0.005
+COST_ESTIMATE_SMOOTHING = 0.2  # Weight of the latest observation in the running estimate
+
+# Decoding parameters used when streaming a study guide. Token streaming only
+# works with a single hypothesis, so this profile decodes greedily.
+STREAM_GENERATION_KWARGS = {
+    'max_length': 512,
+    'min_length': 100,
+    'num_beams': 1,
+    'do_sample': False,
+    'repetition_penalty': 1.5,
+    'no_repeat_ngram_size': 3
+}
+
+# Maximum number of context tokens passed to a single study guide generation
+MAX_CONTEXT_TOKENS = 800
+
+# Map-reduce summarization settings for documents that do not fit one prompt
+MAP_REDUCE_CONTEXT_TOKENS = 400  # Context per prompt, leaving room for instructions in flan-t5's 512 tokens
+MAP_REDUCE_FAN_OUT = 4  # Maximum number of summaries combined by one reduce step
+MAP_REDUCE_MAX_DEPTH = 3  # Maximum number of map/reduce levels before falling back to truncation
+MAP_REDUCE_MAX_QUEUED = 32  # Prompts one request keeps queued on the scheduler, leaving room for other requests
+
+# Decoding parameters used for intermediate map-reduce summaries
+PARTIAL_SUMMARY_GENERATION_KWARGS = {
+    'max_length': 150,
+    'min_length': 30,
+    'num_beams': 2,
+    'do_sample': False,
+    'repetition_penalty': 1.5,
+    'no_repeat_ngram_size': 3
+}
+
+# Sentences one request keeps queued on the scheduler when rewriting, which batches them
+REWRITE_MAX_QUEUED = 32
+
+# Decoding parameters used for sentence rewriting
+REWRITE_GENERATION_KWARGS = {
+    'max_length': 100,
+    'min_length': 10,
+    'num_beams': 4,
+    'do_sample': False,
+    'repetition_penalty': 1.2
+}
+
+def get_generation_params() -> dict:
+    """
+    Describe the model and decoding parameters that determine a study guide.
+    
+    Returns:
+        dict: Parameters to include in summary cache keys
+    """
+    return {
+        'model': GENERATOR_MODEL_NAME,
+        'backend': GENERATOR_BACKEND,
+        'profiles': DECODING_PROFILES,
+        'rewrite': REWRITE_GENERATION_KWARGS,
+        'partial_summary': PARTIAL_SUMMARY_GENERATION_KWARGS,
+        'stream': STREAM_GENERATION_KWARGS
+    }
+
+# Cost model used to predict generation latency
+_load_lock = threading.Lock()
+_cost_per_token_beam = SECONDS_PER_TOKEN_BEAM
+
+def get_queue_depth() -> int:
+    """Return the number of prompts waiting in the inference queue."""
+    return scheduler.queue_depth()
+
+def predict_generation_seconds(input_tokens: int, profile: str, queue_depth: Optional[int] = None) -> float:
+    """
+    Predict how long a study guide generation will take.
+    
+    Prompts ahead in the queue run first, in batches of up to the
+    scheduler's max_batch_size; the new prompt then runs in a batch of its
+    own. Every prompt is assumed to be about the size of this one.
+    
+    Args:
+        input_tokens (int): Number of tokens in the prompt
+        profile (str): Name of the decoding profile
+        queue_depth (int, optional): Prompts waiting in the inference queue; defaults to the current depth
+        
+    Returns:
+        float: Predicted seconds until the result is ready
+    """
+    if queue_depth is None:
+        queue_depth = get_queue_depth()
+    num_beams = DECODING_PROFILES[profile].get('num_beams', 1)
+    with _load_lock:
+        cost = _cost_per_token_beam
+    batch_size = min(scheduler.max_batch_size, queue_depth + 1)
+    batches = queue_depth // scheduler.max_batch_size + 1
+    return input_tokens * num_beams * cost * batch_size * batches
+
+def select_decoding_profile(input_tokens: int, profile: Optional[str] = None,
+                            latency_budget: Optional[float] = None, queue_depth: Optional[int] = None) -> str:
+    """
+    Pick the decoding profile for a request, downgrading it to meet a latency budget.
+    
+    Args:
+        input_tokens (int): Number of tokens in the prompt
+        profile (str, optional): Requested profile, defaults to DEFAULT_DECODING_PROFILE
+        latency_budget (float, optional): Seconds the request may spend generating
+        queue_depth (int, optional): Prompts waiting in the inference queue; defaults to the current depth
+        
+    Returns:
+        str: The requested profile, or the most expensive cheaper profile predicted
+            to fit the budget ('fast' if none does)
+    """
+    profile = profile or DEFAULT_DECODING_PROFILE
+    if profile not in DECODING_PROFILES:
+        raise ValueError(f"Unknown decoding profile: {profile}")
+    if latency_budget is None:
+        return profile
+
+    candidates = list(DECODING_PROFILES)
+    # Profiles are ordered from cheapest to most expensive, so try the requested one first and walk down
+    for candidate in reversed(candidates[:candidates.index(profile) + 1]):
+        if predict_generation_seconds(input_tokens, candidate, queue_depth) <= latency_budget:
+            return candidate
+    return candidates[0]
+
+def _record_generation_cost(input_tokens: int, num_beams: int, run_seconds: float, batch_size: int) -> None:
+    # Update the running estimate of seconds per (input token x beam) from the batch a prompt ran in
+    global _cost_per_token_beam
+    if input_tokens <= 0 or run_seconds is None:
+        return
+    observed = run_seconds / max(1, batch_size) / (input_tokens * max(1, num_beams))
+    with _load_lock:
+        _cost_per_token_beam += COST_ESTIMATE_SMOOTHING * (observed - _cost_per_token_beam)
+
+def get_generator_stats() -> dict:
+    """Return load and cost-model metrics for study guide generation."""
+    with _load_lock:
+        stats = {
+            'seconds_per_token_beam': _cost_per_token_beam
+        }
+    stats['scheduler'] = scheduler.stats()
+    return stats
+
+class TokenCache:
+    """
+    Request-scoped cache of generator tokenizer output.
+    
+    The relevance helpers compare the same topic and sentences many times; this
+    cache encodes each distinct text once and lets callers batch-encode all the
+    texts they are about to score in a single tokenizer call.
+    """
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer if tokenizer is not None else generator.tokenizer
+        self._token_ids: Dict[str, List[int]] = {}
+        self._token_sets: Dict[str, frozenset] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def prime(self, texts: Iterable[str]) -> None:
+        """
+        Batch-encode every text that is not cached yet in one tokenizer call.
+        
+        Args:
+            texts (Iterable[str]): Texts that are about to be scored
+        """
+        missing = [text for text in dict.fromkeys(texts) if text not in self._token_ids]
+        if not missing:
+            return
+        self.misses += len(missing)
+        encoded = self.tokenizer(missing)['input_ids']
+        for text, token_ids in zip(missing, encoded):
+            self._token_ids[text] = list(token_ids)
+
+    def token_ids(self, text: str) -> List[int]:
+        """
+        Get the token ids for a text, encoding it on first use.
+        
+        Args:
+            text (str): Text to encode
+            
+        Returns:
+            List[int]: Token ids, including special tokens as with tokenizer.encode
+        """
+        token_ids = self._token_ids.get(text)
+        if token_ids is None:
+            self.misses += 1
+            token_ids = self.tokenizer.encode(text)
+            self._token_ids[text] = token_ids
+        else:
+            self.hits += 1
+        return token_ids
+
+    def token_set(self, text: str) -> frozenset:
+        """
+        Get the set of token ids for a text.
+        
+        Args:
+            text (str): Text to encode
+            
+        Returns:
+            frozenset: Distinct token ids of the text
+        """
+        token_set = self._token_sets.get(text)
+        if token_set is None:
+            token_set = frozenset(self.token_ids(text))
+            self._token_sets[text] = token_set
+        else:
+            self.hits += 1
+        return token_set
+
 def clean_and_deduplicate_text(text: str) -> str:
     """
     Clean text by removing repetitions and improving sentence structure.
@@ -139,94 +389,395 @@ def format_summary_for_display(text: str) -> str:
         logger.error(f"Error formatting summary: {str(e)}")
         return text
 
-def generate_study_guide(topic: str, input_text: str) -> str:
+def build_study_guide_prompt(topic: str, context: str) -> str:
+    """
+    Build the prompt used to generate a study guide.
+    
+    Args:
+        topic (str): The topic for the study guide
+        context (str): Cleaned and truncated context
+        
+    Returns:
+        str: Prompt for the generator
+    """
+    return f"""Write a clear and concise summary about the topic '{topic}' using ONLY the information provided in the context below.
+Follow these instructions strictly:
+1. Use ONLY the information from the provided context - do not add external knowledge.
+2. Focus on the main topic and its key aspects mentioned in the context.
+3. Write a single, well-structured paragraph that flows naturally.
+4. Maintain the original meaning and emphasis from the context.
+5. If the context doesn't contain enough information about a specific aspect, do not make assumptions.
+
+        Context:
+{context}
+        """
+
+def finalize_study_guide(generated_text: str) -> str:
+    """
+    Clean and format generated text for display.
+    
+    Args:
+        generated_text (str): Raw generator output
+        
+    Returns:
+        str: The study guide shown to the user
+    """
+    # Clean the generated text
+    generated_text = clean_and_deduplicate_text(generated_text)
+    
+    # Format the text for display
+    generated_text = format_summary_for_display(generated_text)
+
+    # Add a disclaimer if the generated text is too short
+    if len(generated_text.split()) < 50:
+        generated_text += "\n\nNote: The provided context may not contain enough information for a comprehensive summary."
+    
+    return generated_text
+
+def generate_study_guide(topic: str, input_text: str, token_cache: Optional[TokenCache] = None,
+                         profile: Optional[str] = None, latency_budget: Optional[float] = None,
+                         generation_info: Optional[dict] = None) -> str:
     """
     Generate a concise and informative study guide using a text2text-generation model.
     
     Args:
         topic (str): The topic for the study guide
         input_text (str): The context to use for generation
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
+        profile (str, optional): Requested decoding profile, defaults to DEFAULT_DECODING_PROFILE
+        latency_budget (float, optional): Seconds the generation may take; the profile is
+            downgraded when the predicted cost does not fit
+        generation_info (dict, optional): Filled with the profile actually used and its
+            predicted and measured time
         
     Returns:
         str: The generated study guide
     """
     try:
+        if token_cache is None:
+            token_cache = TokenCache()
+
         # Clean and deduplicate input text
         cleaned_text = clean_and_deduplicate_text(input_text)
         logger.info(f"Cleaned text length: {len(cleaned_text)}")
 
         # Pre-process the input text to ensure topic relevance
-        relevant_text = select_relevant_content(cleaned_text, topic)
+        relevant_text = select_relevant_content(cleaned_text, topic, token_cache)
         logger.info(f"Selected relevant content length: {len(relevant_text)}")
 
         # Truncate input text if it's too long, preserving topic context
-        max_tokens = 800  # Increased from 400 to allow more context
-        truncated_text = truncate_text_with_context(relevant_text, topic, max_tokens)
+        truncated_text = truncate_text_with_context(relevant_text, topic, MAX_CONTEXT_TOKENS, token_cache)
         logger.info(f"Input text truncated from {len(relevant_text)} to {len(truncated_text)} characters")
 
         # Create a more focused prompt
-        prompt = f"""Write a clear and concise summary about the topic '{topic}' using ONLY the information provided in the context below.
-Follow these instructions strictly:
-1. Use ONLY the information from the provided context - do not add external knowledge.
-2. Focus on the main topic and its key aspects mentioned in the context.
-3. Write a single, well-structured paragraph that flows naturally.
-4. Maintain the original meaning and emphasis from the context.
-5. If the context doesn't contain enough information about a specific aspect, do not make assumptions.
-
-        Context:
-{truncated_text}
-        """
+        prompt = build_study_guide_prompt(topic, truncated_text)
         
         logger.info(f"Generating summary for topic: {topic}")
         logger.info(f"Input text length: {len(truncated_text)}")
         
+        # Pick decoding parameters that fit the latency budget under the current load
+        input_tokens = len(generator.tokenizer.encode(prompt))
+        chosen_profile = select_decoding_profile(input_tokens, profile, latency_budget)
+        decoding_kwargs = DECODING_PROFILES[chosen_profile]
+        predicted = predict_generation_seconds(input_tokens, chosen_profile)
+        if chosen_profile != (profile or DEFAULT_DECODING_PROFILE):
+            logger.info(f"Downgraded decoding profile to '{chosen_profile}' to meet "
+                        f"{latency_budget}s budget (predicted {predicted:.1f}s)")
+        
         # Use deterministic generation with appropriate parameters
-        result = generator(
-            prompt,
-            max_length=512,  # Model's maximum sequence length
-            min_length=100,
-            num_beams=5,
-            do_sample=False,  # Deterministic generation
-            repetition_penalty=1.5,
-            length_penalty=1.0,
-            no_repeat_ngram_size=3
-        )
+        generation_start = time.perf_counter()
+        future = scheduler.submit(prompt, **decoding_kwargs)
+        result = future.result()
+        elapsed = time.perf_counter() - generation_start
+        # Learn from the model's run time only; queueing is predicted from the queue depth
+        _record_generation_cost(input_tokens, decoding_kwargs.get('num_beams', 1), future.run_seconds, future.batch_size)
+        logger.info(f"Generated with '{chosen_profile}' profile in {elapsed:.2f}s (predicted {predicted:.2f}s)")
+        
+        if generation_info is not None:
+            generation_info.update({
+                'profile': chosen_profile,
+                'predicted_seconds': predicted,
+                'generation_seconds': elapsed
+            })
         
         generated_text = result[0]['generated_text']
         logger.info(f"Generated summary length: {len(generated_text)}")
         logger.info(f"Generated content preview: {generated_text[:200]}...")
         
-        # Clean the generated text
-        generated_text = clean_and_deduplicate_text(generated_text)
+        return finalize_study_guide(generated_text)
         
-        # Format the text for display
-        generated_text = format_summary_for_display(generated_text)
+    except Exception as e:
+        logger.error(f"Error generating summary: {str(e)}")
+        return f"Error generating summary: {str(e)}"
+
+class CancelledCriteria(StoppingCriteria):
+    """Stop generation once the given event is set."""
 
-        # Add a disclaimer if the generated text is too short
-        if len(generated_text.split()) < 50:
-            generated_text += "\n\nNote: The provided context may not contain enough information for a comprehensive summary."
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+def stream_study_guide(topic: str, input_text: str, cancel_event: Optional[threading.Event] = None,
+                       token_cache: Optional[TokenCache] = None) -> Iterator[dict]:
+    """
+    Generate a study guide, yielding progress and decoded text as events.
+    
+    Events are dicts with an 'event' key: 'progress' after each pre-processing
+    stage, 'token' for each piece of decoded text, then 'done' with the
+    formatted study guide or 'error'. Setting cancel_event (or closing the
+    iterator) stops generation at the next decoding step.
+    
+    Args:
+        topic (str): The topic for the study guide
+        input_text (str): The context to use for generation
+        cancel_event (threading.Event, optional): Event that cancels generation
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
-        return generated_text
+    Yields:
+        dict: Progress, token, done or error events
+    """
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    if token_cache is None:
+        token_cache = TokenCache()
+
+    try:
+        stage_start = time.perf_counter()
+        cleaned_text = clean_and_deduplicate_text(input_text)
+        yield {'event': 'progress', 'stage': 'clean', 'elapsed': time.perf_counter() - stage_start}
+
+        stage_start = time.perf_counter()
+        relevant_text = select_relevant_content(cleaned_text, topic, token_cache)
+        yield {'event': 'progress', 'stage': 'select', 'elapsed': time.perf_counter() - stage_start}
+
+        stage_start = time.perf_counter()
+        truncated_text = truncate_text_with_context(relevant_text, topic, MAX_CONTEXT_TOKENS, token_cache)
+        yield {'event': 'progress', 'stage': 'truncate', 'elapsed': time.perf_counter() - stage_start}
+
+        prompt = build_study_guide_prompt(topic, truncated_text)
+        inputs = generator.tokenizer(prompt, return_tensors='pt').to(generator.model.device)
+        streamer = TextIteratorStreamer(generator.tokenizer, skip_special_tokens=True)
+        errors = []
+
+        def run_generation():
+            try:
+                generator.model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([CancelledCriteria(cancel_event)]),
+                    **STREAM_GENERATION_KWARGS
+                )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # Unblock the consumer
+
+        logger.info(f"Streaming summary for topic: {topic}")
+        thread = threading.Thread(target=run_generation, daemon=True)
+        thread.start()
+
+        pieces = []
+        for text in streamer:
+            if cancel_event.is_set():
+                break
+            if text:
+                pieces.append(text)
+                yield {'event': 'token', 'text': text}
+        thread.join()
+
+        if cancel_event.is_set():
+            logger.info(f"Streaming generation cancelled for topic: {topic}")
+            return
+        if errors:
+            raise errors[0]
+
+        yield {'event': 'done', 'study_guide': finalize_study_guide(''.join(pieces))}
+
+    except Exception as e:
+        logger.error(f"Error streaming summary: {str(e)}")
+        yield {'event': 'error', 'error': f"Error generating summary: {str(e)}"}
+    finally:
+        # Reached when the consumer closes the stream early, so stop decoding too
+        cancel_event.set()
+
+def group_texts_by_tokens(texts: List[str], max_tokens: int, max_items: Optional[int] = None,
+                          token_cache: Optional[TokenCache] = None) -> List[str]:
+    """
+    Pack consecutive texts into groups that fit a token budget.
+    
+    Args:
+        texts (List[str]): Texts to pack, in order
+        max_tokens (int): Maximum number of tokens per group
+        max_items (int, optional): Maximum number of texts per group
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
+    Returns:
+        List[str]: Groups of texts joined with spaces. A single text longer than
+            the budget is cut at token level.
+    """
+    if token_cache is None:
+        token_cache = TokenCache()
+    token_cache.prime(texts)
+
+    groups = []
+    current_group = []
+    current_tokens = 0
+    
+    for text in texts:
+        token_ids = token_cache.token_ids(text)
+        # Drop the end-of-sequence token, the group gets a single one when encoded
+        cost = max(0, len(token_ids) - 1)
+        
+        if cost > max_tokens:
+            text = generator.tokenizer.decode(token_ids[:max_tokens], skip_special_tokens=True)
+            cost = max_tokens
+        
+        full = current_tokens + cost > max_tokens or (max_items is not None and len(current_group) >= max_items)
+        if full and current_group:
+            groups.append(' '.join(current_group))
+            current_group = []
+            current_tokens = 0
+        
+        current_group.append(text)
+        current_tokens += cost
+    
+    if current_group:
+        groups.append(' '.join(current_group))
+    
+    return groups
+
+def summarize_texts(texts: List[str], topic: str) -> List[str]:
+    """
+    Summarize several texts.
+    
+    Prompts are submitted to the scheduler MAP_REDUCE_MAX_QUEUED at a time,
+    and it runs them in padded batches of up to SCHEDULER_MAX_BATCH_SIZE.
+    
+    Args:
+        texts (List[str]): Texts to summarize
+        topic (str): Topic the summaries should focus on
+        
+    Returns:
+        List[str]: One summary per input text, in the same order
+    """
+    prompts = [f"""Summarize the following text, keeping every fact about the topic '{topic}'.
+Use ONLY the information in the text.
+
+Text:
+{text}""" for text in texts]
+    summaries = []
+    for start in range(0, len(prompts), MAP_REDUCE_MAX_QUEUED):
+        results = scheduler.generate(prompts[start:start + MAP_REDUCE_MAX_QUEUED], **PARTIAL_SUMMARY_GENERATION_KWARGS)
+        summaries.extend((result[0] if isinstance(result, list) else result)['generated_text'].strip()
+                         for result in results)
+    return summaries
+
+def build_map_reduce_context(topic: str, input_text: str, fan_out: int = MAP_REDUCE_FAN_OUT,
+                             max_depth: int = MAP_REDUCE_MAX_DEPTH, token_cache: Optional[TokenCache] = None) -> str:
+    """
+    Reduce a long text to about one prompt of context by summarizing it hierarchically.
+    
+    The text is split into prompt-sized pieces that are summarized in
+    scheduler batches (map). The summaries are then grouped and summarized again (reduce)
+    until they fit a single prompt or max_depth levels have run.
+    
+    Args:
+        topic (str): The topic for the study guide
+        input_text (str): The context to reduce
+        fan_out (int): Maximum number of summaries combined by one reduce step
+        max_depth (int): Maximum number of map/reduce levels
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
+        
+    Returns:
+        str: The reduced context, or the input text if it already fits one prompt
+    """
+    if token_cache is None:
+        token_cache = TokenCache()
+    fan_out = max(2, fan_out)
+
+    # Split the cleaned text into prompt-sized pieces at sentence boundaries
+    cleaned_text = clean_and_deduplicate_text(input_text)
+    sentences = [s.strip() + '.' for s in cleaned_text.split('.') if s.strip()]
+    pieces = group_texts_by_tokens(sentences, MAP_REDUCE_CONTEXT_TOKENS, token_cache=token_cache)
+
+    if len(pieces) <= 1:
+        # Everything already fits in one prompt
+        return input_text
+
+    depth = 0
+    while len(pieces) > 1 and depth < max_depth:
+        depth += 1
+        level_start = time.perf_counter()
+        summaries = summarize_texts(pieces, topic)
+        logger.info(f"Map-reduce level {depth}: summarized {len(pieces)} pieces "
+                    f"in {time.perf_counter() - level_start:.2f}s")
+        
+        next_pieces = group_texts_by_tokens(summaries, MAP_REDUCE_CONTEXT_TOKENS, fan_out, token_cache)
+        if len(next_pieces) >= len(pieces):
+            # Summaries are not getting any shorter, stop and let truncation handle the rest
+            pieces = next_pieces
+            break
+        pieces = next_pieces
+
+    logger.info(f"Map-reduce finished after {depth} levels with {len(pieces)} pieces")
+    return ' '.join(pieces)
+
+def generate_study_guide_map_reduce(topic: str, input_text: str, fan_out: int = MAP_REDUCE_FAN_OUT,
+                                    max_depth: int = MAP_REDUCE_MAX_DEPTH, profile: Optional[str] = None,
+                                    latency_budget: Optional[float] = None,
+                                    generation_info: Optional[dict] = None) -> str:
+    """
+    Generate a study guide covering the whole input by summarizing it hierarchically.
+    
+    Args:
+        topic (str): The topic for the study guide
+        input_text (str): The context to use for generation
+        fan_out (int): Maximum number of summaries combined by one reduce step
+        max_depth (int): Maximum number of map/reduce levels
+        profile (str, optional): Requested decoding profile for the final summary
+        latency_budget (float, optional): Seconds left for the final summary once the
+            map and reduce levels have run
+        generation_info (dict, optional): Filled as in generate_study_guide
+        
+    Returns:
+        str: The generated study guide
+    """
+    try:
+        token_cache = TokenCache()
+        reduce_start = time.perf_counter()
+        context = build_map_reduce_context(topic, input_text, fan_out, max_depth, token_cache)
+        if latency_budget is not None:
+            latency_budget = max(0.0, latency_budget - (time.perf_counter() - reduce_start))
+        return generate_study_guide(topic, context, token_cache, profile, latency_budget, generation_info)
+
     except Exception as e:
-        logger.error(f"Error generating summary: {str(e)}")
+        logger.error(f"Error generating map-reduce summary: {str(e)}")
         return f"Error generating summary: {str(e)}"
 
-def select_relevant_content(text: str, topic: str) -> str:
+def select_relevant_content(text: str, topic: str, token_cache: Optional[TokenCache] = None) -> str:
     """
     Select content most relevant to the given topic.
     
     Args:
         text (str): Input text to analyze
         topic (str): Topic to focus on
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         str: Selected relevant content
     """
     try:
+        if token_cache is None:
+            token_cache = TokenCache()
+
         # Split text into sentences
         sentences = text.split('. ')
         
+        # Encode the topic and all sentences in one tokenizer call
+        token_cache.prime([topic] + [s for s in sentences if s.strip()])
+        topic_tokens = token_cache.token_set(topic)
+        
         # Score sentences based on topic relevance
         scored_sentences = []
         topic_words = set(topic.lower().split())
@@ -242,15 +793,14 @@ def select_relevant_content(text: str, topic: str) -> str:
             word_score = len(common_words) / len(topic_words) if topic_words else 0
             
             # Calculate semantic similarity using token overlap
-            topic_tokens = set(generator.tokenizer.encode(topic))
-            sentence_tokens = set(generator.tokenizer.encode(sentence))
+            sentence_tokens = token_cache.token_set(sentence)
             token_overlap = len(topic_tokens.intersection(sentence_tokens)) / len(topic_tokens)
             
             # Calculate context score (how well it fits with other relevant sentences)
             context_score = 0
             if scored_sentences:
                 prev_sentence = scored_sentences[-1][0]
-                prev_tokens = set(generator.tokenizer.encode(prev_sentence))
+                prev_tokens = token_cache.token_set(prev_sentence)
                 context_score = len(sentence_tokens.intersection(prev_tokens)) / len(sentence_tokens)
             
             # Combine scores with weights
@@ -280,7 +830,8 @@ def select_relevant_content(text: str, topic: str) -> str:
         
         # Sort selected sentences by their original order
         original_sentences = [s.strip() for s in text.split('.') if s.strip()]
-        selected_sentences = [s for s in original_sentences if s in selected_sentences]
+        selected_set = set(selected_sentences)
+        selected_sentences = [s for s in original_sentences if s in selected_set]
         
         return '. '.join(selected_sentences) + '.'
         
@@ -288,14 +839,18 @@ def select_relevant_content(text: str, topic: str) -> str:
         logger.error(f"Error selecting relevant content: {str(e)}")
         return text
 
-def truncate_text_with_context(text: str, topic: str, max_tokens: int) -> str:
+def truncate_text_with_context(text: str, topic: str, max_tokens: int, token_cache: Optional[TokenCache] = None) -> str:
     """
     Truncate text while preserving topic context and sentence boundaries.
     
+    Each sentence is tokenized once and the selection is planned against a
+    running token total, so the cost stays linear in the number of sentences.
+    
     Args:
         text (str): Input text to truncate
         topic (str): Topic to preserve context for
         max_tokens (int): Maximum number of tokens allowed
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         str: Truncated text with preserved context
@@ -306,66 +861,68 @@ def truncate_text_with_context(text: str, topic: str, max_tokens: int) -> str:
         if not sentences:
             return text
 
-        # Find topic-relevant sentences
-        topic_sentences = []
-        other_sentences = []
-        
-        for sentence in sentences:
-            # Check if sentence contains topic
-            if topic.lower() in sentence.lower():
-                topic_sentences.append(sentence)
-            else:
-                other_sentences.append(sentence)
+        if token_cache is None:
+            token_cache = TokenCache()
+
+        # Find topic-relevant sentences by index
+        topic_lower = topic.lower()
+        is_topic = [topic_lower in sentence.lower() for sentence in sentences]
+        topic_indices = [i for i, flag in enumerate(is_topic) if flag]
 
         # If no topic sentences found, use first few sentences
-        if not topic_sentences:
-            selected_sentences = sentences[:5]  # Increased from 3 to 5 sentences
+        if not topic_indices:
+            selected = list(range(min(5, len(sentences))))
         else:
-            # Start with topic sentences
-            selected_sentences = topic_sentences.copy()
-            
-            # Add context sentences before and after topic sentences
-            for topic_sentence in topic_sentences:
-                topic_idx = sentences.index(topic_sentence)
-                
-                # Add 2-3 sentences before (increased from 1-2)
-                for i in range(max(0, topic_idx - 3), topic_idx):
-                    if sentences[i] not in selected_sentences:
-                        selected_sentences.insert(0, sentences[i])
-                
-                # Add 2-3 sentences after (increased from 1-2)
-                for i in range(topic_idx + 1, min(len(sentences), topic_idx + 4)):
-                    if sentences[i] not in selected_sentences:
-                        selected_sentences.append(sentences[i])
+            # Keep topic sentences plus up to 3 sentences of context on each side
+            keep = bytearray(len(sentences))
+            for topic_idx in topic_indices:
+                for i in range(max(0, topic_idx - 3), min(len(sentences), topic_idx + 4)):
+                    keep[i] = 1
+            selected = [i for i, flag in enumerate(keep) if flag]
 
-        # Join sentences and check token length
-        truncated_text = '. '.join(selected_sentences) + '.'
-        tokens = generator.tokenizer.encode(truncated_text)
-        
-        # If still too long, remove sentences from the end while preserving topic sentences
-        while len(tokens) > max_tokens and len(selected_sentences) > len(topic_sentences):
-            # Remove the last non-topic sentence
-            for i in range(len(selected_sentences) - 1, -1, -1):
-                if selected_sentences[i] not in topic_sentences:
-                    selected_sentences.pop(i)
-                    break
-            truncated_text = '. '.join(selected_sentences) + '.'
-            tokens = generator.tokenizer.encode(truncated_text)
-        
-        # If still too long, remove sentences from the beginning while preserving topic sentences
-        while len(tokens) > max_tokens and len(selected_sentences) > len(topic_sentences):
-            # Remove the first non-topic sentence
-            for i in range(len(selected_sentences)):
-                if selected_sentences[i] not in topic_sentences:
-                    selected_sentences.pop(i)
+        # Tokenize each selected sentence once, with the period it gets back when joined
+        pieces = [sentences[i] + '.' for i in selected]
+        token_cache.prime(pieces)
+        # Drop the end-of-sequence token from each piece and count it once for the whole text
+        costs = [max(0, len(token_cache.token_ids(piece)) - 1) for piece in pieces]
+        total_tokens = sum(costs) + 1
+
+        # If too long, remove context sentences from the end while preserving topic sentences
+        kept = [True] * len(selected)
+        for pos in range(len(selected) - 1, -1, -1):
+            if total_tokens <= max_tokens:
+                break
+            if not is_topic[selected[pos]]:
+                kept[pos] = False
+                total_tokens -= costs[pos]
+
+        # If still too long, keep the longest prefix of sentences that fits the budget
+        if total_tokens > max_tokens:
+            budget = max_tokens - 1
+            for pos in range(len(selected)):
+                if not kept[pos]:
+                    continue
+                if costs[pos] <= budget:
+                    budget -= costs[pos]
+                else:
+                    # Cut here so the text ends at a sentence boundary
+                    for rest in range(pos, len(selected)):
+                        kept[rest] = False
                     break
-            truncated_text = '. '.join(selected_sentences) + '.'
-            tokens = generator.tokenizer.encode(truncated_text)
+
+        final_sentences = [sentences[i] for pos, i in enumerate(selected) if kept[pos]]
+        if not final_sentences:
+            # Not even one sentence fits, so fall back to a token-level cut of the first one
+            final_sentences = [sentences[selected[0]]]
+
+        truncated_text = '. '.join(final_sentences) + '.'
+        tokens = generator.tokenizer.encode(truncated_text)
         
-        # If still too long, truncate at token level but try to end at a sentence boundary
+        # Per-sentence counts are an estimate of the joined text, so enforce the limit
+        # at token level but try to end at a sentence boundary
         if len(tokens) > max_tokens:
             truncated_tokens = tokens[:max_tokens]
-            truncated_text = generator.tokenizer.decode(truncated_tokens)
+            truncated_text = generator.tokenizer.decode(truncated_tokens, skip_special_tokens=True)
             # Find last complete sentence
             last_period = truncated_text.rfind('.')
             if last_period > 0:
@@ -385,7 +942,68 @@ def truncate_text_with_context(text: str, topic: str, max_tokens: int) -> str:
         # Fallback: simple character-based truncation
         return text[:max_tokens * 4] + "..."  # Rough estimate: 4 chars per token
 
-def generate_study_guide_from_text(text_chunks: List[str], topic: str = "", preferences: str = "") -> str:
+def build_context_from_chunks(text_chunks: List[str], topic: str, preferences: str = "",
+                              token_cache: Optional[TokenCache] = None) -> Iterator[dict]:
+    """
+    Rank chunks, rewrite their relevant sentences and combine them into a context.
+    
+    Args:
+        text_chunks (list): List of text chunks to process
+        topic (str): Topic to guide the generation
+        preferences (str): User preferences for the guide
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
+        
+    Yields:
+        dict: A 'progress' event after each stage, then a 'context' event whose
+            'context' is the combined text, or None if nothing was relevant
+    """
+    if token_cache is None:
+        token_cache = TokenCache()
+
+    # First stage: Initial ranking of chunks
+    stage_start = time.perf_counter()
+    initial_ranked_chunks = rank_chunks(text_chunks, topic, token_cache)
+    logger.info(f"Initial ranking completed for {len(initial_ranked_chunks)} chunks")
+    yield {'event': 'progress', 'stage': 'rank', 'elapsed': time.perf_counter() - stage_start}
+
+    # Second stage: Rerank top chunks with more detailed analysis
+    stage_start = time.perf_counter()
+    top_chunks = [chunk for chunk, _ in initial_ranked_chunks[:10]]  # Take top 10 for reranking
+    reranked_chunks = rerank_chunks(top_chunks, topic, token_cache)
+    logger.info(f"Reranking completed for {len(reranked_chunks)} chunks")
+    yield {'event': 'progress', 'stage': 'rerank', 'elapsed': time.perf_counter() - stage_start}
+
+    # Extract and modify relevant sentences from reranked chunks
+    stage_start = time.perf_counter()
+    candidate_sentences = []
+    for chunk, _ in reranked_chunks:
+        sentences = [s.strip() for s in chunk.split('.') if s.strip()]
+        for sentence in sentences:
+            if is_relevant_to_topic(sentence, topic, token_cache):
+                candidate_sentences.append(sentence)
+
+    # Rewrite all candidate sentences in batches rather than one generation per sentence
+    modified_sentences = modify_sentences_for_clarity(candidate_sentences, topic)
+    relevant_sentences = [sentence for sentence in modified_sentences if sentence]
+    yield {'event': 'progress', 'stage': 'rewrite', 'elapsed': time.perf_counter() - stage_start}
+
+    if not relevant_sentences:
+        yield {'event': 'context', 'context': None}
+        return
+
+    # Combine sentences into a coherent text
+    combined_text = ' '.join(relevant_sentences)
+    logger.debug(f"Combined text length: {len(combined_text)}")
+    
+    # Add preferences if provided
+    if preferences:
+        combined_text = f"Additional Requirements:\n{preferences}\n\nContext:\n{combined_text}"
+    
+    yield {'event': 'context', 'context': combined_text}
+
+def generate_study_guide_from_text(text_chunks: List[str], topic: str = "", preferences: str = "",
+                                   profile: Optional[str] = None, latency_budget: Optional[float] = None,
+                                   generation_info: Optional[dict] = None) -> str:
     """
     Generate a study guide from provided text chunks.
     
@@ -393,6 +1011,10 @@ def generate_study_guide_from_text(text_chunks: List[str], topic: str = "", pref
         text_chunks (list): List of text chunks to process
         topic (str): Topic to guide the generation
         preferences (str): User preferences for the guide
+        profile (str, optional): Requested decoding profile for the final summary
+        latency_budget (float, optional): Seconds the whole request may take; the final
+            summary gets what is left after ranking and rewriting
+        generation_info (dict, optional): Filled as in generate_study_guide
         
     Returns:
         str: Generated study guide
@@ -406,62 +1028,87 @@ def generate_study_guide_from_text(text_chunks: List[str], topic: str = "", pref
         if not topic:
             return "Error: No topic provided for study guide generation."
 
-        # First stage: Initial ranking of chunks
-        initial_ranked_chunks = rank_chunks(text_chunks, topic)
-        logger.info(f"Initial ranking completed for {len(initial_ranked_chunks)} chunks")
+        # Share tokenizer output between all ranking and relevance helpers
+        token_cache = TokenCache()
+        request_start = time.perf_counter()
 
-        # Second stage: Rerank top chunks with more detailed analysis
-        top_chunks = [chunk for chunk, _ in initial_ranked_chunks[:10]]  # Take top 10 for reranking
-        reranked_chunks = rerank_chunks(top_chunks, topic)
-        logger.info(f"Reranking completed for {len(reranked_chunks)} chunks")
+        combined_text = None
+        for event in build_context_from_chunks(text_chunks, topic, preferences, token_cache):
+            if event['event'] == 'context':
+                combined_text = event['context']
 
-        # Extract and modify relevant sentences from reranked chunks
-        relevant_sentences = []
-        for chunk, _ in reranked_chunks:
-            sentences = [s.strip() for s in chunk.split('.') if s.strip()]
-            for sentence in sentences:
-                if is_relevant_to_topic(sentence, topic):
-                    modified_sentence = modify_sentence_for_clarity(sentence, topic)
-                    if modified_sentence:
-                        relevant_sentences.append(modified_sentence)
-
-        if not relevant_sentences:
+        if not combined_text:
             return "Error: No relevant content found for the given topic."
-
-        # Combine sentences into a coherent text
-        combined_text = ' '.join(relevant_sentences)
-        logger.debug(f"Combined text length: {len(combined_text)}")
         
-        # Add preferences if provided
-        if preferences:
-            combined_text = f"Additional Requirements:\n{preferences}\n\nContext:\n{combined_text}"
+        if latency_budget is not None:
+            latency_budget = max(0.0, latency_budget - (time.perf_counter() - request_start))
         
         # Generate the study guide
-        return generate_study_guide(topic, combined_text)
+        return generate_study_guide(topic, combined_text, token_cache, profile, latency_budget, generation_info)
 
     except Exception as e:
         logger.error(f"Error generating study guide from text: {str(e)}", exc_info=True)
         return f"Error generating study guide from text: {str(e)}"
 
-def rank_chunks(chunks: List[str], topic: str) -> List[tuple]:
+def stream_study_guide_from_text(text_chunks: List[str], topic: str, preferences: str = "",
+                                 cancel_event: Optional[threading.Event] = None) -> Iterator[dict]:
+    """
+    Stream a study guide generated from provided text chunks.
+    
+    Args:
+        text_chunks (list): List of text chunks to process
+        topic (str): Topic to guide the generation
+        preferences (str): User preferences for the guide
+        cancel_event (threading.Event, optional): Event that cancels generation
+        
+    Yields:
+        dict: Events as described in stream_study_guide
+    """
+    try:
+        token_cache = TokenCache()
+
+        combined_text = None
+        for event in build_context_from_chunks(text_chunks, topic, preferences, token_cache):
+            if event['event'] == 'context':
+                combined_text = event['context']
+            else:
+                yield event
+
+        if not combined_text:
+            yield {'event': 'error', 'error': "Error: No relevant content found for the given topic."}
+            return
+
+        yield from stream_study_guide(topic, combined_text, cancel_event, token_cache)
+
+    except Exception as e:
+        logger.error(f"Error streaming study guide from text: {str(e)}", exc_info=True)
+        yield {'event': 'error', 'error': f"Error generating study guide from text: {str(e)}"}
+
+def rank_chunks(chunks: List[str], topic: str, token_cache: Optional[TokenCache] = None) -> List[tuple]:
     """
     First stage ranking of chunks based on basic relevance metrics.
     
     Args:
         chunks (List[str]): List of text chunks to rank
         topic (str): Topic to rank against
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         List[tuple]: List of (chunk, score) tuples sorted by score
     """
     try:
+        if token_cache is None:
+            token_cache = TokenCache()
+        if topic.strip():
+            token_cache.prime([topic] + [chunk for chunk in chunks if chunk.strip()])
+
         ranked_chunks = []
         for chunk in chunks:
             if not chunk.strip():
                 continue
                 
             # Basic relevance score
-            relevance_score = calculate_chunk_relevance(chunk, topic)
+            relevance_score = calculate_chunk_relevance(chunk, topic, token_cache)
             
             # Topic mention bonus
             topic_mention_bonus = 0.2 if topic.lower() in chunk.lower() else 0
@@ -486,18 +1133,23 @@ def rank_chunks(chunks: List[str], topic: str) -> List[tuple]:
         logger.error(f"Error in initial chunk ranking: {str(e)}")
         return [(chunk, 0.0) for chunk in chunks]
 
-def rerank_chunks(chunks: List[str], topic: str) -> List[tuple]:
+def rerank_chunks(chunks: List[str], topic: str, token_cache: Optional[TokenCache] = None) -> List[tuple]:
     """
     Second stage ranking with more detailed analysis of chunks.
     
     Args:
         chunks (List[str]): List of text chunks to rerank
         topic (str): Topic to rank against
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         List[tuple]: List of (chunk, score) tuples sorted by score
     """
     try:
+        if token_cache is None:
+            token_cache = TokenCache()
+        token_cache.prime([s.strip() for chunk in chunks for s in chunk.split('.') if s.strip()])
+
         reranked_chunks = []
         topic_words = set(topic.lower().split())
         
@@ -513,7 +1165,7 @@ def rerank_chunks(chunks: List[str], topic: str) -> List[tuple]:
             topic_coverage = topic_sentences / len(sentences) if sentences else 0
             
             # Semantic coherence
-            coherence_score = calculate_semantic_coherence(sentences)
+            coherence_score = calculate_semantic_coherence(sentences, token_cache)
             
             # Information density
             info_density = calculate_information_density(chunk, topic_words)
@@ -535,12 +1187,13 @@ def rerank_chunks(chunks: List[str], topic: str) -> List[tuple]:
         logger.error(f"Error in chunk reranking: {str(e)}")
         return [(chunk, 0.0) for chunk in chunks]
 
-def calculate_semantic_coherence(sentences: List[str]) -> float:
+def calculate_semantic_coherence(sentences: List[str], token_cache: Optional[TokenCache] = None) -> float:
     """
     Calculate semantic coherence between sentences in a chunk.
     
     Args:
         sentences (List[str]): List of sentences to analyze
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         float: Coherence score between 0 and 1
@@ -549,12 +1202,16 @@ def calculate_semantic_coherence(sentences: List[str]) -> float:
         if len(sentences) < 2:
             return 1.0  # Single sentence is considered coherent
             
+        if token_cache is None:
+            token_cache = TokenCache()
+        token_cache.prime(sentences)
+            
         total_overlap = 0
         comparisons = 0
         
         for i in range(len(sentences) - 1):
-            current_tokens = set(generator.tokenizer.encode(sentences[i]))
-            next_tokens = set(generator.tokenizer.encode(sentences[i + 1]))
+            current_tokens = token_cache.token_set(sentences[i])
+            next_tokens = token_cache.token_set(sentences[i + 1])
             
             # Calculate token overlap
             overlap = len(current_tokens.intersection(next_tokens)) / len(current_tokens)
@@ -600,13 +1257,14 @@ def calculate_information_density(chunk: str, topic_words: set) -> float:
         logger.error(f"Error calculating information density: {str(e)}")
         return 0.0
 
-def is_relevant_to_topic(sentence: str, topic: str) -> bool:
+def is_relevant_to_topic(sentence: str, topic: str, token_cache: Optional[TokenCache] = None) -> bool:
     """
     Check if a sentence is relevant to the topic.
     
     Args:
         sentence (str): Sentence to check
         topic (str): Topic to check against
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         bool: True if sentence is relevant to topic
@@ -620,8 +1278,10 @@ def is_relevant_to_topic(sentence: str, topic: str) -> bool:
             return True
             
         # Check for semantic relevance
-        topic_tokens = set(generator.tokenizer.encode(topic))
-        sentence_tokens = set(generator.tokenizer.encode(sentence))
+        if token_cache is None:
+            token_cache = TokenCache()
+        topic_tokens = token_cache.token_set(topic)
+        sentence_tokens = token_cache.token_set(sentence)
         token_overlap = len(topic_tokens.intersection(sentence_tokens)) / len(topic_tokens)
         
         # Check for related terms
@@ -636,23 +1296,18 @@ def is_relevant_to_topic(sentence: str, topic: str) -> bool:
         logger.error(f"Error checking sentence relevance: {str(e)}")
         return False
 
-def modify_sentence_for_clarity(sentence: str, topic: str) -> str:
+def build_clarity_prompt(sentence: str, topic: str) -> str:
     """
-    Modify a sentence to make it clearer and more focused on the topic.
+    Build the prompt used to rewrite a sentence for clarity.
     
     Args:
         sentence (str): Original sentence
         topic (str): Topic to focus on
         
     Returns:
-        str: Modified sentence
+        str: Prompt for the generator
     """
-    try:
-        if not sentence.strip():
-            return ""
-            
-        # Create a prompt for sentence modification
-        prompt = f"""Modify the following sentence to be clearer and more focused on the topic '{topic}'.
+    return f"""Modify the following sentence to be clearer and more focused on the topic '{topic}'.
 Keep the original meaning but make it more concise and direct.
 Only use information present in the original sentence.
 
@@ -660,35 +1315,107 @@ Original sentence: {sentence}
 
 Modified sentence:"""
 
-        # Generate modified sentence
-        result = generator(
-            prompt,
-            max_length=100,
-            min_length=10,
-            num_beams=4,
-            do_sample=False,
-            repetition_penalty=1.2
-        )
+def accept_modified_sentence(original: str, modified: str) -> str:
+    """
+    Decide whether a rewritten sentence can replace the original.
+    
+    Args:
+        original (str): Original sentence
+        modified (str): Sentence produced by the generator
         
-        modified = result[0]['generated_text'].strip()
+    Returns:
+        str: The modified sentence, or the original if too much was removed
+    """
+    modified = modified.strip()
+    
+    # Ensure the modified sentence is not too different from original
+    if len(modified.split()) < len(original.split()) * 0.5:
+        return original  # Return original if too much was removed
         
-        # Ensure the modified sentence is not too different from original
-        if len(modified.split()) < len(sentence.split()) * 0.5:
-            return sentence  # Return original if too much was removed
-            
-        return modified
+    return modified
+
+def modify_sentence_for_clarity(sentence: str, topic: str) -> str:
+    """
+    Modify a sentence to make it clearer and more focused on the topic.
+    
+    Args:
+        sentence (str): Original sentence
+        topic (str): Topic to focus on
         
-    except Exception as e:
-        logger.error(f"Error modifying sentence: {str(e)}")
-        return sentence  # Return original sentence on error
+    Returns:
+        str: Modified sentence
+    """
+    return modify_sentences_for_clarity([sentence], topic)[0]
+
+def modify_sentences_for_clarity(sentences: List[str], topic: str, max_queued: int = REWRITE_MAX_QUEUED) -> List[str]:
+    """
+    Modify sentences to make them clearer.
+    
+    Sentences are submitted to the scheduler before any result is collected,
+    up to max_queued at a time, so it can run them in padded batches of up
+    to SCHEDULER_MAX_BATCH_SIZE.
+    
+    Args:
+        sentences (List[str]): Original sentences
+        topic (str): Topic to focus on
+        max_queued (int): Sentences kept queued on the scheduler at once
+        
+    Returns:
+        List[str]: Modified sentences in the same order as the input. Empty
+            sentences map to "" and sentences that failed keep their
+            original text.
+    """
+    modified_sentences = ["" if not sentence.strip() else sentence for sentence in sentences]
+    pending = [i for i, sentence in enumerate(sentences) if sentence.strip()]
+    if not pending:
+        return modified_sentences
+
+    max_queued = max(1, max_queued)
+    total_start = time.perf_counter()
+    submitted = deque()
+    next_pending = 0
+    failed = 0
+    try:
+        while next_pending < len(pending) or submitted:
+            # Keep the scheduler supplied with sentences while results are collected in order
+            while next_pending < len(pending) and len(submitted) < max_queued:
+                i = pending[next_pending]
+                next_pending += 1
+                try:
+                    future = scheduler.submit(build_clarity_prompt(sentences[i], topic), **REWRITE_GENERATION_KWARGS)
+                except SchedulerQueueFullError as e:
+                    logger.error(f"Error modifying sentence {i}: {str(e)}")
+                    failed += 1
+                    continue  # Keep the original sentence
+                submitted.append((i, future))
+            if not submitted:
+                continue
+            
+            i, future = submitted.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Error modifying sentence {i}: {str(e)}")
+                failed += 1
+                continue  # Keep the original sentence
+            modified_sentences[i] = accept_modified_sentence(sentences[i], result[0]['generated_text'])
+    finally:
+        # Nobody will read the remaining results if rewriting was interrupted
+        for _, future in submitted:
+            future.cancel()
+
+    logger.info(f"Rewrote {len(pending) - failed} of {len(pending)} sentences "
+                f"in {time.perf_counter() - total_start:.2f}s")
+    return modified_sentences
 
-def calculate_chunk_relevance(chunk: str, topic: str) -> float:
+def calculate_chunk_relevance(chunk: str, topic: str, token_cache: Optional[TokenCache] = None) -> float:
     """
     Calculate how relevant a chunk is to the given topic.
     
     Args:
         chunk (str): Text chunk to evaluate
         topic (str): Topic to check relevance against
+        token_cache (TokenCache, optional): Tokenizer cache shared for this request
         
     Returns:
         float: Relevance score between 0 and 1
@@ -704,8 +1431,10 @@ def calculate_chunk_relevance(chunk: str, topic: str) -> float:
         word_score = len(common_words) / len(topic_words) if topic_words else 0
         
         # Calculate semantic similarity using token overlap
-        topic_tokens = set(generator.tokenizer.encode(topic))
-        chunk_tokens = set(generator.tokenizer.encode(chunk))
+        if token_cache is None:
+            token_cache = TokenCache()
+        topic_tokens = token_cache.token_set(topic)
+        chunk_tokens = token_cache.token_set(chunk)
         token_overlap = len(topic_tokens.intersection(chunk_tokens)) / len(topic_tokens)
         
         # Calculate topic density (how much of the chunk is about the topic)
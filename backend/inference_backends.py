@@ -0,0 +1,109 @@
+from transformers import pipeline, AutoModelForSeq2SeqLM, AutoTokenizer
+import torch
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Generation backend: 'pytorch', 'pytorch-int8' or 'onnx'
+GENERATOR_BACKEND = os.getenv('GENERATOR_BACKEND', 'pytorch')
+
+# Directory holding exported ONNX models, one sub-directory per model
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', os.path.join(os.path.dirname(__file__), 'onnx_models'))
+
+def load_pytorch_pipeline(model_name: str):
+    """
+    Load the fp32 PyTorch text2text-generation pipeline.
+
+    Args:
+        model_name (str): Hugging Face model name
+
+    Returns:
+        Pipeline: text2text-generation pipeline
+    """
+    return pipeline(
+        "text2text-generation",
+        model=model_name,
+        device=0 if torch.cuda.is_available() else -1
+    )
+
+def load_quantized_pipeline(model_name: str):
+    """
+    Load a PyTorch pipeline with int8 dynamic quantization of the linear layers.
+
+    Dynamic quantization only runs on CPU, so this backend ignores any GPU.
+
+    Args:
+        model_name (str): Hugging Face model name
+
+    Returns:
+        Pipeline: text2text-generation pipeline
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+    model.eval()
+    quantized_model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("text2text-generation", model=quantized_model, tokenizer=tokenizer, device=-1)
+
+def load_onnx_pipeline(model_name: str, model_dir: str = ONNX_MODEL_DIR):
+    """
+    Load an ONNX Runtime pipeline, exporting the model on first use.
+
+    The export has separate encoder and decoder sessions, and the decoder
+    reuses its key/value cache between steps instead of re-running the
+    whole prefix.
+
+    Args:
+        model_name (str): Hugging Face model name
+        model_dir (str): Directory where exported models are stored
+
+    Returns:
+        Pipeline: text2text-generation pipeline
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError("The 'onnx' generator backend requires optimum[onnxruntime] to be installed") from e
+
+    export_path = os.path.join(model_dir, model_name.replace('/', '--'))
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if os.path.exists(os.path.join(export_path, 'config.json')):
+        logger.info(f"Loading exported ONNX model from {export_path}")
+        model = ORTModelForSeq2SeqLM.from_pretrained(export_path, use_cache=True)
+    else:
+        logger.info(f"Exporting {model_name} to ONNX at {export_path}")
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+        model.save_pretrained(export_path)
+        tokenizer.save_pretrained(export_path)
+
+    return pipeline("text2text-generation", model=model, tokenizer=tokenizer)
+
+# Available generation backends
+GENERATION_BACKENDS = {
+    'pytorch': load_pytorch_pipeline,
+    'pytorch-int8': load_quantized_pipeline,
+    'onnx': load_onnx_pipeline
+}
+
+def load_generation_backend(model_name: str, backend: str = GENERATOR_BACKEND):
+    """
+    Load the text2text-generation pipeline for the configured backend.
+
+    Every backend returns a transformers pipeline, so callers can use the
+    same call signature, tokenizer and model.generate whichever is chosen.
+
+    Args:
+        model_name (str): Hugging Face model name
+        backend (str): One of GENERATION_BACKENDS
+
+    Returns:
+        Pipeline: text2text-generation pipeline
+    """
+    if backend not in GENERATION_BACKENDS:
+        raise ValueError(f"Unsupported generator backend: {backend}. "
+                         f"Choose one of {', '.join(GENERATION_BACKENDS)}")
+
+    logger.info(f"Loading {model_name} with the '{backend}' generator backend")
+    return GENERATION_BACKENDS[backend](model_name)
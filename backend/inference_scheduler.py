@@ -0,0 +1,224 @@
+from concurrent.futures import Future
+from typing import Dict, List, Union
+import logging
+import os
+import queue
+import threading
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Micro-batching settings
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv('SCHEDULER_MAX_BATCH_SIZE', 8))  # Prompts per generator call
+SCHEDULER_MAX_WAIT_MS = float(os.getenv('SCHEDULER_MAX_WAIT_MS', 20))  # How long a prompt waits for others to join its batch
+SCHEDULER_MAX_QUEUE_SIZE = int(os.getenv('SCHEDULER_MAX_QUEUE_SIZE', 256))  # Prompts waiting before submissions are rejected
+
+class SchedulerQueueFullError(RuntimeError):
+    """Raised when the scheduler queue is at its limit."""
+
+class InferenceFuture(Future):
+    """
+    Future of a single prompt.
+
+    Once it resolves, run_seconds is how long the pipeline call for the
+    prompt's batch took, excluding time spent waiting in the queue, and
+    batch_size is the number of prompts in that batch.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.run_seconds = None
+        self.batch_size = None
+
+class _Request:
+    """A single prompt waiting to be generated."""
+
+    def __init__(self, prompt: str, generation_kwargs: dict):
+        self.prompt = prompt
+        self.generation_kwargs = generation_kwargs
+        # Prompts can only share a batch when they decode with the same parameters
+        self.batch_key = tuple(sorted(generation_kwargs.items()))
+        self.future = InferenceFuture()
+        self.enqueued_at = time.perf_counter()
+
+class InferenceScheduler:
+    """
+    Micro-batching scheduler in front of a shared text2text-generation pipeline.
+
+    Prompts submitted from any thread are queued; a single worker thread
+    collects prompts that use the same decoding parameters for up to
+    max_wait_ms, runs them through the pipeline as one padded batch and
+    hands each result back through its future.
+    """
+
+    def __init__(self, pipe, max_batch_size: int = SCHEDULER_MAX_BATCH_SIZE,
+                 max_wait_ms: float = SCHEDULER_MAX_WAIT_MS, max_queue_size: int = SCHEDULER_MAX_QUEUE_SIZE):
+        self.pipe = pipe
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # Requests taken off the queue that did not fit in the batch being built
+        self._pending: Dict[tuple, List[_Request]] = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'rejected': 0,
+            'batches': 0,
+            'max_batch_size_seen': 0,
+            'total_batch_size': 0,
+            'total_wait_seconds': 0.0,
+            'total_batch_seconds': 0.0,
+            'errors': 0
+        }
+        self._worker = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, **generation_kwargs) -> InferenceFuture:
+        """
+        Queue a prompt for generation.
+
+        Args:
+            prompt (str): Prompt to generate from
+            **generation_kwargs: Decoding parameters passed to the pipeline
+
+        Returns:
+            InferenceFuture: Resolves to the pipeline output for this prompt, a
+                list of {'generated_text': ...} dicts
+        """
+        request = _Request(prompt, generation_kwargs)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            raise SchedulerQueueFullError(f"Inference queue is full ({self._queue.maxsize} prompts waiting)")
+        with self._stats_lock:
+            self._stats['requests'] += 1
+        return request.future
+
+    def generate(self, prompts: Union[str, List[str]], timeout: float = None, **generation_kwargs):
+        """
+        Generate from one or more prompts, blocking until all results are ready.
+
+        Takes the same arguments as calling the pipeline directly and returns
+        results in the same shape: a list of dicts for a single prompt, or one
+        such list per prompt for a list of prompts.
+
+        Args:
+            prompts (str or List[str]): Prompt or prompts to generate from
+            timeout (float, optional): Seconds to wait for each result
+            **generation_kwargs: Decoding parameters passed to the pipeline
+
+        Returns:
+            list: Pipeline output
+        """
+        generation_kwargs.pop('batch_size', None)  # Batching is the scheduler's job
+        if isinstance(prompts, str):
+            return self.submit(prompts, **generation_kwargs).result(timeout=timeout)
+
+        futures = []
+        try:
+            for prompt in prompts:
+                futures.append(self.submit(prompt, **generation_kwargs))
+            return [future.result(timeout=timeout) for future in futures]
+        except BaseException:
+            # Nobody will read the remaining results, keep them from taking up the model
+            for future in futures:
+                future.cancel()
+            raise
+
+    def queue_depth(self) -> int:
+        """Return the number of prompts waiting to be batched."""
+        return self._queue.qsize() + sum(len(group) for group in list(self._pending.values()))
+
+    def stats(self) -> dict:
+        """Return batching and latency metrics."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats['batches']
+        batched = stats['total_batch_size']
+        return {
+            'requests': stats['requests'],
+            'rejected': stats['rejected'],
+            'errors': stats['errors'],
+            'batches': batches,
+            'queue_depth': self.queue_depth(),
+            'avg_batch_size': batched / batches if batches else 0.0,
+            'max_batch_size_seen': stats['max_batch_size_seen'],
+            'avg_wait_ms': 1000 * stats['total_wait_seconds'] / batched if batched else 0.0,
+            'avg_batch_ms': 1000 * stats['total_batch_seconds'] / batches if batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_queue_size': self._queue.maxsize
+        }
+
+    def _add_pending(self, request: _Request) -> None:
+        self._pending.setdefault(request.batch_key, []).append(request)
+
+    def _next_batch(self) -> List[_Request]:
+        # Block until there is work, then grow the oldest request's batch until it is full or its wait is over
+        if not self._pending:
+            self._add_pending(self._queue.get())
+
+        batch_key = min(self._pending, key=lambda key: self._pending[key][0].enqueued_at)
+        group = self._pending[batch_key]
+        deadline = group[0].enqueued_at + self.max_wait
+
+        while len(group) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Once the wait is over, still take prompts that queued up while the last batch ran
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._add_pending(request)
+
+        batch = group[:self.max_batch_size]
+        rest = group[self.max_batch_size:]
+        if rest:
+            self._pending[batch_key] = rest
+        else:
+            del self._pending[batch_key]
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = self._next_batch()
+            except Exception as e:
+                logger.error(f"Error collecting inference batch: {str(e)}", exc_info=True)
+                continue
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Request]) -> None:
+        # Drop requests whose caller gave up while they were queued
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        prompts = [request.prompt for request in batch]
+        try:
+            results = self.pipe(prompts, batch_size=len(prompts), **batch[0].generation_kwargs)
+        except Exception as e:
+            logger.error(f"Error running inference batch of {len(batch)}: {str(e)}")
+            with self._stats_lock:
+                self._stats['errors'] += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - started
+        for request, result in zip(batch, results):
+            request.future.run_seconds = elapsed
+            request.future.batch_size = len(batch)
+            # Normalize to the shape the pipeline returns for a single prompt
+            request.future.set_result(result if isinstance(result, list) else [result])
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['total_batch_size'] += len(batch)
+            self._stats['max_batch_size_seen'] = max(self._stats['max_batch_size_seen'], len(batch))
+            self._stats['total_wait_seconds'] += sum(started - request.enqueued_at for request in batch)
+            self._stats['total_batch_seconds'] += elapsed
+        logger.info(f"Ran inference batch of {len(batch)} prompts in {elapsed:.2f}s")
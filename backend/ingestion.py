@@ -4,99 +4,190 @@ import os
 import re
 import nltk
 from nltk.tokenize import sent_tokenize
+from collections import deque
+from typing import Iterable, Iterator, List
+from chunker import TokenChunker, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from pdf_extract import PDF_EXTRACT_WORKERS, get_pdf_pool
 
 # Set NLTK data path
 nltk.data.path.append(os.path.join(os.path.dirname(__file__), 'nltk_data'))
 
-def chunk_text(text: str, max_chunk_size: int = 1000) -> list:
+# Text read at a time from plain text files
+TXT_BLOCK_SIZE = 64 * 1024
+
+# Parallel PDF extraction settings
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 64))  # Smaller PDFs are extracted serially
+PDF_PAGES_PER_TASK = 16  # Pages extracted by a worker per task
+
+def split_sentences(text: str) -> List[str]:
     """
-    Split text into chunks of complete sentences.
+    Split text into sentences using NLTK's sent_tokenize.
     
     Args:
-        text (str): Input text to chunk
-        max_chunk_size (int): Maximum size of each chunk
+        text (str): Input text
         
     Returns:
-        list: List of text chunks
+        List[str]: Sentences
     """
-    # Clean the text
-    text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with single space
-    text = text.strip()
-    
-    # Split into sentences using NLTK's sent_tokenize
     try:
-        sentences = sent_tokenize(text)
+        return sent_tokenize(text)
     except LookupError:
         # If punkt_tab is not found, download it
         print("Downloading NLTK punkt_tab data...")
         nltk.download('punkt_tab', download_dir=os.path.join(os.path.dirname(__file__), 'nltk_data'))
-        sentences = sent_tokenize(text)
+        return sent_tokenize(text)
+
+def chunk_text_stream(segments: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS, separator: str = ' ') -> Iterator[str]:
+    """
+    Split a stream of text segments into token-sized chunks of complete sentences.
     
-    chunks = []
-    current_chunk = []
-    current_size = 0
+    Segments such as PDF pages are consumed one at a time and chunks are
+    yielded as soon as they are full; see chunker.TokenChunker.
     
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence:  # Skip empty sentences
-            continue
-            
-        sentence_size = len(sentence)
-        
-        # If adding this sentence would exceed the max size, save current chunk and start new one
-        if current_size + sentence_size > max_chunk_size and current_chunk:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = []
-            current_size = 0
+    Args:
+        segments (Iterable[str]): Consecutive pieces of the document text
+        max_tokens (int): Maximum size of each chunk in tokens of the embedding model
+        overlap_tokens (int): Tokens of trailing sentences repeated in the next chunk
+        separator (str): Text between consecutive segments, see TokenChunker.chunk_stream
         
-        current_chunk.append(sentence)
-        current_size += sentence_size
-    
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    
-    return chunks
+    Yields:
+        str: Text chunks in document order
+    """
+    return TokenChunker(max_tokens, overlap_tokens, split_sentences).chunk_stream(segments, separator)
 
-def process_uploaded_file(file_path: str) -> list:
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
     """
-    Process an uploaded file and extract its text content in chunks.
+    Split text into token-sized chunks of complete sentences.
     
     Args:
-        file_path (str): Path to the uploaded file
+        text (str): Input text to chunk
+        max_tokens (int): Maximum size of each chunk in tokens of the embedding model
+        overlap_tokens (int): Tokens of trailing sentences repeated in the next chunk
         
     Returns:
         list: List of text chunks
     """
+    return list(chunk_text_stream([text], max_tokens, overlap_tokens))
+
+def iter_file_text(file_path: str) -> Iterator[str]:
+    """
+    Read a file's text one segment at a time.
+    
+    Args:
+        file_path (str): Path to the file
+        
+    Yields:
+        str: Pages of a PDF, paragraphs of a DOCX or blocks of a TXT file
+    """
     _, ext = os.path.splitext(file_path)
     
     if ext.lower() == '.pdf':
-        text = process_pdf(file_path)
+        yield from iter_pdf_pages(file_path)
     elif ext.lower() == '.docx':
-        text = process_docx(file_path)
+        doc = docx.Document(file_path)
+        for paragraph in doc.paragraphs:
+            yield paragraph.text
     elif ext.lower() == '.txt':
-        text = process_txt(file_path)
+        with open(file_path, 'r', encoding='utf-8') as file:
+            yield from iter_text_blocks(file)
     else:
         raise ValueError(f"Unsupported file type: {ext}")
+
+def iter_text_blocks(file, block_size: int = TXT_BLOCK_SIZE) -> Iterator[str]:
+    """
+    Read a text file in blocks that end at whitespace.
+    
+    Blocks are cut after the last whitespace in each read, so no word is
+    split between two blocks and joining them with a space does not change
+    the text as the chunker sees it.
     
-    return chunk_text(text)
+    Args:
+        file: Text file object
+        block_size (int): Characters read at a time
+        
+    Yields:
+        str: Consecutive blocks of the file text
+    """
+    remainder = ''
+    for block in iter(lambda: file.read(block_size), ''):
+        block = remainder + block
+        # Cut after the last whitespace character
+        match = re.search(r'\s', block[::-1])
+        if match is None:
+            # No whitespace yet, keep reading until the word ends
+            remainder = block
+            continue
+        cut = len(block) - match.start()
+        remainder = block[cut:]
+        yield block[:cut]
+    if remainder:
+        yield remainder
 
-def process_pdf(file_path: str) -> str:
+def process_uploaded_file_stream(file_path: str) -> Iterator[str]:
     """
-    Extract text from a PDF file.
+    Process an uploaded file, yielding its chunks as they are produced.
     
     Args:
-        file_path (str): Path to the PDF file
+        file_path (str): Path to the uploaded file
+        
+    Yields:
+        str: Text chunks in document order
+    """
+    return chunk_text_stream(iter_file_text(file_path))
+
+def process_uploaded_file(file_path: str) -> list:
+    """
+    Process an uploaded file and extract its text content in chunks.
+    
+    Args:
+        file_path (str): Path to the uploaded file
         
     Returns:
-        str: Extracted text
+        list: List of text chunks
+    """
+    return list(process_uploaded_file_stream(file_path))
+
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
+    """
+    Extract text from a PDF file one page at a time.
+    
+    PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page
+    ranges extracted by the shared worker pool from pdf_extract, since
+    PyPDF2 extraction is pure Python and bound to one core. Pages are
+    still yielded in order, and only a few ranges are in flight at once so
+    memory stays bounded.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        
+    Yields:
+        str: Text of each page
     """
-    text = ""
     with open(file_path, 'rb') as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text()
-    return text
+        page_count = len(pdf_reader.pages)
+        pool = get_pdf_pool() if page_count >= PDF_PARALLEL_MIN_PAGES else None
+        if pool is None:
+            for page in pdf_reader.pages:
+                yield page.extract_text() or ''
+            return
+    
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    pending = deque()
+    next_range = 0
+    try:
+        while next_range < len(ranges) or pending:
+            # Keep every worker busy with one range queued behind it
+            while next_range < len(ranges) and len(pending) < 2 * PDF_EXTRACT_WORKERS:
+                pending.append(pool.submit(file_path, *ranges[next_range]))
+                next_range += 1
+            yield from pending.popleft().result()
+    finally:
+        # Other files share the pool; drop this file's ranges if it is abandoned
+        for future in pending:
+            future.cancel()
 
 def process_docx(file_path: str) -> str:
     """
@@ -0,0 +1,362 @@
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default location of the job table
+INGESTION_JOBS_DB = os.path.join(os.path.dirname(__file__), 'ingestion_jobs.db')
+
+# Worker settings
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', 2))  # Files ingested at once
+INGESTION_MAX_ATTEMPTS = 3  # Attempts per job before it is marked failed
+INGESTION_RETRY_DELAY = 2.0  # Seconds before a failed attempt is resumed
+PROGRESS_FLUSH_INTERVAL = 0.5  # Seconds between progress writes to the job table
+HEARTBEAT_INTERVAL = 10.0  # Seconds between heartbeats of running jobs, and between polls for queued jobs
+STALE_JOB_TIMEOUT = 60.0  # Seconds without a heartbeat after which a running job's process is presumed dead
+
+# Progress counters reported for every job
+PROGRESS_FIELDS = ('pages_parsed', 'chunks_embedded', 'batches_upserted', 'committed_chunks')
+
+class JobProgress:
+    """
+    Progress of a running job.
+
+    Counters are updated in memory on every call and written to the job
+    table at most every PROGRESS_FLUSH_INTERVAL seconds. Checkpoints are
+    always written immediately, since a resumed job starts from them.
+    """
+
+    def __init__(self, jobs: 'IngestionJobQueue', job: Dict[str, Any]):
+        self._jobs = jobs
+        self.job_id = job['id']
+        self.file_hash = job.get('file_hash')
+        self.counters = {field: job[field] for field in PROGRESS_FIELDS}
+        self._flushed_at = 0.0
+        # Updated from both the embedding and the upsert threads
+        self._lock = threading.Lock()
+
+    @property
+    def committed_chunks(self) -> int:
+        """Chunks known to be fully upserted, where a resumed attempt starts."""
+        return self.counters['committed_chunks']
+
+    def start(self, file_hash: str) -> int:
+        """
+        Record the hash of the file being ingested and return where to resume.
+
+        A checkpoint only applies to the content it was made for, so if the
+        file changed since the last attempt the job starts over.
+
+        Args:
+            file_hash (str): Hash of the file contents
+
+        Returns:
+            int: Chunks to skip
+        """
+        with self._lock:
+            if self.file_hash != file_hash:
+                if self.counters['committed_chunks']:
+                    logger.warning(f"File of ingestion job {self.job_id} changed since its last attempt, starting over")
+                self.file_hash = file_hash
+                self.counters['committed_chunks'] = 0
+                self._jobs._update(self.job_id, file_hash=file_hash, **self.counters)
+            return self.counters['committed_chunks']
+
+    def add(self, **increments: int) -> None:
+        """Increase progress counters, e.g. add(pages_parsed=1)."""
+        with self._lock:
+            for field, increment in increments.items():
+                self.counters[field] += increment
+            self._flush()
+
+    def checkpoint(self, committed_chunks: int) -> None:
+        """Record that every chunk before committed_chunks is upserted."""
+        with self._lock:
+            self.counters['committed_chunks'] = committed_chunks
+            self._flush(force=True)
+
+    def _flush(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self._flushed_at >= PROGRESS_FLUSH_INTERVAL:
+            self._jobs._update(self.job_id, **self.counters)
+            self._flushed_at = now
+
+class IngestionJobQueue:
+    """
+    Background file ingestion backed by an SQLite job table.
+
+    Jobs are queued by submit and run by a pool of worker threads through
+    the handler, which receives the job and its JobProgress. Failed
+    attempts are retried up to INGESTION_MAX_ATTEMPTS times, resuming from
+    the job's last checkpoint. When a job fails for good, on_failed is
+    called with it before it is marked failed, while later jobs for the
+    same file are still held back, so it can undo the job's partial writes.
+
+    Several processes may share the table, e.g. gunicorn workers or the
+    Flask reloader. A job is claimed by one of them at a time and its owner
+    sends heartbeats while it runs; jobs whose owner stopped sending them
+    are queued again. Jobs for the same file run one at a time, in the
+    order they were submitted.
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any], JobProgress], Optional[dict]],
+                 db_path: str = INGESTION_JOBS_DB, workers: int = INGESTION_WORKERS,
+                 on_failed: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.handler = handler
+        self.on_failed = on_failed
+        self.db_path = db_path
+        # Identifies this queue's process in the owner column
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue()
+        self._queued_ids = set()
+        self._queued_lock = threading.Lock()
+        self._init_db()
+
+        # Pick up jobs left queued, or running in a process that has stopped
+        self._poll()
+
+        self._workers = [
+            threading.Thread(target=self._run, name=f'ingestion-worker-{i}', daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+        threading.Thread(target=self._heartbeat, name='ingestion-heartbeat', daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                     (id TEXT PRIMARY KEY,
+                      username TEXT NOT NULL,
+                      filename TEXT NOT NULL,
+                      file_path TEXT NOT NULL,
+                      status TEXT NOT NULL,
+                      attempts INTEGER NOT NULL DEFAULT 0,
+                      pages_parsed INTEGER NOT NULL DEFAULT 0,
+                      chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                      batches_upserted INTEGER NOT NULL DEFAULT 0,
+                      committed_chunks INTEGER NOT NULL DEFAULT 0,
+                      result TEXT,
+                      error TEXT,
+                      created_at REAL NOT NULL,
+                      updated_at REAL NOT NULL)''')
+        # Columns added after the table was first created
+        columns = {row['name'] for row in c.execute('PRAGMA table_info(jobs)')}
+        for column in ('file_hash TEXT', 'owner TEXT', 'heartbeat_at REAL'):
+            if column.split()[0] not in columns:
+                c.execute(f'ALTER TABLE jobs ADD COLUMN {column}')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_file ON jobs (username, filename)')
+        conn.commit()
+        conn.close()
+
+    def _enqueue(self, job_id: str) -> None:
+        with self._queued_lock:
+            if job_id in self._queued_ids:
+                return
+            self._queued_ids.add(job_id)
+        self._queue.put(job_id)
+
+    def _poll(self) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            # Jobs whose owner stopped sending heartbeats were interrupted by a crash or restart
+            c = conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND attempts < ? "
+                             "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                             (INGESTION_MAX_ATTEMPTS, now - STALE_JOB_TIMEOUT))
+            if c.rowcount:
+                logger.info(f"Requeued {c.rowcount} interrupted ingestion jobs")
+            # Take over interrupted jobs that are out of attempts, so only this process cleans them up
+            stale = conn.execute("SELECT id FROM jobs WHERE status = 'running' AND attempts >= ? "
+                                 "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                                 (INGESTION_MAX_ATTEMPTS, now - STALE_JOB_TIMEOUT)).fetchall()
+            failed = []
+            for row in stale:
+                c = conn.execute("UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE id = ? AND status = 'running' "
+                                 "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                                 (self.owner, now, row['id'], now - STALE_JOB_TIMEOUT))
+                if c.rowcount:
+                    failed.append(row['id'])
+            conn.commit()
+            rows = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        finally:
+            conn.close()
+        for job_id in failed:
+            job = self.get(job_id)
+            self._fail(job, 'Interrupted too many times', {field: job[field] for field in PROGRESS_FIELDS})
+            self._enqueue_next(job)
+        # Also picks up jobs submitted by other processes, or waiting for another job of the same file
+        for row in rows:
+            self._enqueue(row['id'])
+
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                                 (time.time(), self.owner))
+                    conn.commit()
+                finally:
+                    conn.close()
+                self._poll()
+            except Exception as e:
+                logger.error(f"Error in ingestion heartbeat: {str(e)}", exc_info=True)
+
+    def _claim(self, job_id: str) -> bool:
+        # Only one worker, in any process sharing the table, may move a job from queued to running,
+        # and only once no earlier job for the same file is queued or running
+        now = time.time()
+        conn = self._connect()
+        try:
+            c = conn.execute('''UPDATE jobs SET status = 'running', attempts = attempts + 1, error = NULL,
+                                     owner = ?, heartbeat_at = ?, updated_at = ?
+                                 WHERE id = ? AND status = 'queued' AND NOT EXISTS
+                                     (SELECT 1 FROM jobs AS other
+                                      WHERE other.username = jobs.username AND other.filename = jobs.filename
+                                        AND other.id != jobs.id
+                                        AND (other.status = 'running'
+                                             OR (other.status = 'queued' AND other.created_at < jobs.created_at)))''',
+                             (self.owner, now, now, job_id))
+            conn.commit()
+            return c.rowcount == 1
+        finally:
+            conn.close()
+
+    def _update(self, job_id: str, **fields) -> None:
+        # Writes are dropped once the job was requeued and claimed by another owner
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ? AND owner = ?',
+                         [*fields.values(), job_id, self.owner])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def submit(self, username: str, filename: str, file_path: str) -> str:
+        """
+        Queue a file for ingestion.
+
+        Args:
+            username (str): Owner of the file
+            filename (str): Name of the file
+            file_path (str): Where the uploaded file was saved; must not be
+                shared with other jobs, since the job may read it much later
+
+        Returns:
+            str: Job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('''INSERT INTO jobs (id, username, filename, file_path, status, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, 'queued', ?, ?)''',
+                         (job_id, username, filename, file_path, now, now))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._enqueue(job_id)
+        logger.info(f"Queued ingestion job {job_id} for {filename} ({username})")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a job.
+
+        Returns:
+            Optional[Dict]: The job's status, progress counters and result, or None if unknown
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _run(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            with self._queued_lock:
+                self._queued_ids.discard(job_id)
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Error running ingestion job {job_id}: {str(e)}", exc_info=True)
+
+    def _run_job(self, job_id: str) -> None:
+        # Jobs waiting for another job of the same file are queued again when it finishes
+        if not self._claim(job_id):
+            return
+        job = self.get(job_id)
+        try:
+            self._attempt(job)
+        finally:
+            self._enqueue_next(job)
+
+    def _attempt(self, job: Dict[str, Any]) -> None:
+        job_id = job['id']
+        attempt = job['attempts']
+        progress = JobProgress(self, job)
+        start = time.perf_counter()
+        try:
+            result = self.handler(job, progress)
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed on attempt {attempt}: {str(e)}", exc_info=True)
+            if attempt >= INGESTION_MAX_ATTEMPTS:
+                self._fail(job, str(e), progress.counters)
+                return
+            # Resume from the last checkpoint after a short delay
+            self._update(job_id, status='queued', error=str(e), **progress.counters)
+            timer = threading.Timer(INGESTION_RETRY_DELAY, self._enqueue, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+            return
+
+        self._update(job_id, status='completed', result=json.dumps(result or {}), **progress.counters)
+        logger.info(f"Ingestion job {job_id} completed in {time.perf_counter() - start:.2f}s")
+
+    def _fail(self, job: Dict[str, Any], error: str, counters: Dict[str, int]) -> None:
+        if self.on_failed is not None:
+            try:
+                self.on_failed(job)
+            except Exception as e:
+                logger.error(f"Error cleaning up failed ingestion job {job['id']}: {str(e)}", exc_info=True)
+        self._update(job['id'], status='failed', error=error, **counters)
+        logger.error(f"Ingestion job {job['id']} for {job['filename']} failed: {error}")
+
+    def _enqueue_next(self, job: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            # A retried job is queued again by its own timer
+            rows = conn.execute("SELECT id FROM jobs WHERE username = ? AND filename = ? AND status = 'queued' "
+                                "AND id != ? ORDER BY created_at",
+                                (job['username'], job['filename'], job['id'])).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            self._enqueue(row['id'])
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default location of the keyword index
+KEYWORD_INDEX_DB = os.path.join(os.path.dirname(__file__), 'keyword_index.db')
+
+# Words left out of keyword queries, they match nearly every chunk
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'how', 'in', 'is', 'it',
+    'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'which',
+    'who', 'why', 'with'
+}
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query matching any of its terms.
+
+    Args:
+        query (str): Free-text query
+
+    Returns:
+        Optional[str]: FTS5 MATCH expression, or None if the query has no usable terms
+    """
+    terms = [term for term in re.findall(r'\w+', query.lower()) if term not in STOPWORDS]
+    if not terms:
+        return None
+    # Quote every term so user input is never parsed as FTS5 syntax
+    return ' OR '.join(f'"{term}"' for term in dict.fromkeys(terms))
+
+def owner_token(username: str) -> str:
+    """Return the term that stands for a user in the indexed owner column."""
+    # Digits only, so the tokenizer keeps it as one term and the stemmer leaves it alone
+    return str(int(hashlib.sha256(username.encode('utf-8')).hexdigest()[:15], 16))
+
+class KeywordIndex:
+    """
+    BM25 keyword index over the same chunks that go to the vector store.
+
+    Backed by an SQLite FTS5 table with Porter stemming; ranking uses
+    FTS5's built-in BM25, so a query only touches the postings of its terms.
+    Each chunk's owner is indexed as a term of its own, so a search for one
+    user's chunks only scores postings that also carry that user's term.
+    Chunk ids are mapped to FTS5 rowids in a regular table, since looking up
+    an UNINDEXED column would scan the whole index.
+    """
+
+    def __init__(self, db_path: str = KEYWORD_INDEX_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.documents_indexed = 0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        conn.create_function('owner_token', 1, owner_token, deterministic=True)
+        c = conn.cursor()
+        columns = [row[1] for row in c.execute('PRAGMA table_info(chunks)')]
+        if columns and 'owner' not in columns:
+            # Tables created before owners were indexed are rebuilt, keeping their rowids
+            logger.info("Rebuilding keyword index with indexed owners")
+            c.execute('BEGIN')
+            c.execute('ALTER TABLE chunks RENAME TO chunks_old')
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5
+                     (text,
+                      doc_id UNINDEXED,
+                      username UNINDEXED,
+                      filename UNINDEXED,
+                      chunk_index UNINDEXED,
+                      owner,
+                      tokenize = 'porter unicode61')''')
+        if columns and 'owner' not in columns:
+            c.execute('''INSERT INTO chunks (rowid, text, doc_id, username, filename, chunk_index, owner)
+                         SELECT rowid, text, doc_id, username, filename, chunk_index, owner_token(coalesce(username, ''))
+                         FROM chunks_old''')
+            c.execute('DROP TABLE chunks_old')
+        c.execute('''CREATE TABLE IF NOT EXISTS doc_rows
+                     (row INTEGER PRIMARY KEY,
+                      doc_id TEXT NOT NULL UNIQUE)''')
+        # Map chunks indexed before the table existed
+        if c.execute('SELECT 1 FROM doc_rows LIMIT 1').fetchone() is None:
+            c.execute('INSERT OR IGNORE INTO doc_rows (row, doc_id) SELECT rowid, doc_id FROM chunks')
+        conn.commit()
+        conn.close()
+
+    def add_documents(self, documents: Iterable[Dict]) -> int:
+        """
+        Index chunks, replacing any previous entries with the same id.
+
+        Args:
+            documents (Iterable[Dict]): Documents shaped like those passed to
+                upsert_documents, with 'id', 'text' and 'metadata' keys
+
+        Returns:
+            int: Number of chunks indexed
+        """
+        # The last document with a given id wins
+        documents = list({doc['id']: doc for doc in documents}.values())
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.executemany('INSERT OR IGNORE INTO doc_rows (doc_id) VALUES (?)', [(doc['id'],) for doc in documents])
+            doc_rows = self._doc_rows(c, [doc['id'] for doc in documents])
+            rows = [(doc_rows[doc['id']], doc['text'], doc['id'], doc['metadata'].get('username'),
+                     doc['metadata'].get('filename'), doc['metadata'].get('chunk_index'),
+                     owner_token(doc['metadata'].get('username') or '')) for doc in documents]
+            c.executemany('DELETE FROM chunks WHERE rowid = ?', [(row[0],) for row in rows])
+            c.executemany('''INSERT INTO chunks (rowid, text, doc_id, username, filename, chunk_index, owner)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.documents_indexed += len(rows)
+        return len(rows)
+
+    @staticmethod
+    def _doc_rows(c: sqlite3.Cursor, doc_ids: List[str]) -> Dict[str, int]:
+        found = {}
+        # Stay under SQLite's limit on bound parameters
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            c.execute(f'SELECT doc_id, row FROM doc_rows WHERE doc_id IN ({placeholders})', batch)
+            found.update(c.fetchall())
+        return found
+
+    def indexed_files(self) -> Set[Tuple[str, str]]:
+        """Return the (username, filename) of every file with chunks in the index."""
+        conn = self._connect()
+        try:
+            return set(conn.execute('SELECT DISTINCT username, filename FROM chunks').fetchall())
+        finally:
+            conn.close()
+
+    def delete_ids(self, doc_ids: List[str], username: Optional[str] = None) -> None:
+        """
+        Remove chunks by id.
+
+        Args:
+            doc_ids (List[str]): Ids of the chunks to remove
+            username (str, optional): Only remove chunks owned by this user
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            rows = list(self._doc_rows(c, list(doc_ids)).values())
+            if username is not None:
+                owned = set()
+                for start in range(0, len(rows), 500):
+                    batch = rows[start:start + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    c.execute(f'SELECT rowid FROM chunks WHERE rowid IN ({placeholders}) AND username = ?',
+                              batch + [username])
+                    owned.update(row[0] for row in c.fetchall())
+                rows = [row for row in rows if row in owned]
+            c.executemany('DELETE FROM chunks WHERE rowid = ?', [(row,) for row in rows])
+            c.executemany('DELETE FROM doc_rows WHERE row = ?', [(row,) for row in rows])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete_file(self, username: str, filename: str) -> int:
+        """
+        Remove every chunk of a file.
+
+        Returns:
+            int: Number of chunks removed
+        """
+        conn = self._connect()
+        try:
+            c = conn.cursor()
+            c.execute('SELECT rowid FROM chunks WHERE chunks MATCH ? AND username = ? AND filename = ?',
+                      (f'owner : "{owner_token(username)}"', username, filename))
+            rows = [(row[0],) for row in c.fetchall()]
+            c.executemany('DELETE FROM chunks WHERE rowid = ?', rows)
+            c.executemany('DELETE FROM doc_rows WHERE row = ?', rows)
+            removed = len(rows)
+            conn.commit()
+        finally:
+            conn.close()
+        return removed
+
+    def search(self, query: str, top_k: int = 5, username: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks that best match a query by BM25.
+
+        Args:
+            query (str): Free-text query
+            top_k (int): Number of results to return
+            username (str, optional): Only search this user's chunks
+
+        Returns:
+            List[Dict]: Matches with 'id', 'text', 'score' and 'metadata', best first
+        """
+        match_query = build_match_query(query)
+        if match_query is None:
+            return []
+
+        match_query = f'text : ({match_query})'
+        if username is not None:
+            # Only rows carrying the user's owner term are scored
+            match_query = f'owner : "{owner_token(username)}" AND {match_query}'
+        # Only the text counts towards BM25
+        sql = '''SELECT doc_id, text, username, filename, chunk_index, bm25(chunks, 1, 0, 0, 0, 0, 0) AS rank
+                 FROM chunks WHERE chunks MATCH ?'''
+        params: List[Any] = [match_query]
+        if username is not None:
+            # Owner terms are hashes; the stored name settles any collision
+            sql += ' AND username = ?'
+            params.append(username)
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(top_k)
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.queries += 1
+        # FTS5 reports BM25 as a negative number, lower is better
+        return [{
+            'id': doc_id,
+            'text': text,
+            'score': -rank,
+            'metadata': {'username': owner, 'filename': filename, 'chunk_index': chunk_index}
+        } for doc_id, text, owner, filename, chunk_index, rank in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return query and indexing counters."""
+        with self._lock:
+            return {
+                'queries': self.queries,
+                'documents_indexed': self.documents_indexed
+            }
+
+# Shared keyword index instance
+keyword_index = KeywordIndex()
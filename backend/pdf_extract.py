@@ -0,0 +1,118 @@
+import logging
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Worker processes shared by every PDF being extracted
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+
+# Script run by each worker process
+PDF_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_worker.py')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class PdfExtractError(RuntimeError):
+    """Raised when a worker could not extract a range of pages."""
+
+class PdfWorkerPool:
+    """
+    Pool of worker processes extracting text from page ranges of PDFs.
+
+    Each worker runs pdf_worker.py as a script rather than being forked or
+    spawned by multiprocessing, so it never re-imports the application's
+    main module, which would load the models and start another ingestion
+    queue. Every worker is driven by a thread of its own that takes ranges
+    from a shared queue; a worker that dies is replaced by its thread
+    before the next range.
+    """
+
+    def __init__(self, workers: int = PDF_EXTRACT_WORKERS):
+        self.workers = max(1, workers)
+        self._tasks = queue.Queue()
+        self._threads = [threading.Thread(target=self._serve, name=f'pdf-worker-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, file_path: str, start: int, end: int) -> Future:
+        """
+        Queue the extraction of a range of pages.
+
+        Args:
+            file_path (str): Path to the PDF file
+            start (int): First page index
+            end (int): Page index after the last page
+
+        Returns:
+            Future: Resolves to the text of each page in the range, or raises PdfExtractError
+        """
+        future = Future()
+        self._tasks.put((future, (file_path, start, end)))
+        return future
+
+    def shutdown(self) -> None:
+        """Stop every worker once the ranges already queued are done."""
+        for _ in self._threads:
+            self._tasks.put(None)
+
+    def _start_worker(self) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, PDF_WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def _serve(self) -> None:
+        process = None
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    return
+                future, request = task
+                # Skip ranges whose file was abandoned while they were queued
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if process is None:
+                        process = self._start_worker()
+                    pickle.dump(request, process.stdin)
+                    process.stdin.flush()
+                    status, value = pickle.load(process.stdout)
+                except (OSError, EOFError, pickle.UnpicklingError) as e:
+                    if process is not None:
+                        process.kill()
+                        process.wait()
+                        process = None
+                    future.set_exception(PdfExtractError(f"PDF worker failed on pages {request[1]}-{request[2]} "
+                                                         f"of {request[0]}: {str(e)}"))
+                    continue
+                if status == 'ok':
+                    future.set_result(value)
+                else:
+                    future.set_exception(PdfExtractError(value))
+        finally:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+
+def get_pdf_pool() -> Optional[PdfWorkerPool]:
+    """
+    Return the worker pool shared by all PDF extractions, creating it on first use.
+
+    Returns:
+        Optional[PdfWorkerPool]: The pool, or None if parallel extraction is disabled
+    """
+    global _pool
+    if PDF_EXTRACT_WORKERS <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = PdfWorkerPool(PDF_EXTRACT_WORKERS)
+            logger.info(f"Started PDF extraction pool with {PDF_EXTRACT_WORKERS} workers")
+        return _pool
@@ -0,0 +1,49 @@
+"""
+Entry point of the PDF extraction worker processes started by pdf_extract.
+
+Run as a script, so a worker imports this module and PyPDF2 only, never
+the application. Requests are read from stdin and results written to
+stdout, one pickle each: a request is (file_path, start, end) and its
+result is ('ok', page_texts) or ('error', message).
+"""
+import pickle
+import sys
+from typing import List
+
+import PyPDF2
+
+def extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """
+    Extract the text of a range of pages, opening the PDF independently.
+
+    Args:
+        file_path (str): Path to the PDF file
+        start (int): First page index
+        end (int): Page index after the last page
+
+    Returns:
+        List[str]: Text of each page in the range
+    """
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+def main() -> None:
+    requests = sys.stdin.buffer
+    results = sys.stdout.buffer
+    # Keep anything printed while extracting off the result pipe
+    sys.stdout = sys.stderr
+    while True:
+        try:
+            file_path, start, end = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            result = ('ok', extract_pdf_page_range(file_path, start, end))
+        except Exception as e:
+            result = ('error', f"{type(e).__name__}: {e}")
+        pickle.dump(result, results)
+        results.flush()
+
+if __name__ == '__main__':
+    main()
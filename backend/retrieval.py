@@ -1,12 +1,22 @@
 import pinecone
 from sentence_transformers import SentenceTransformer
 import os
-from typing import List, Dict
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Dict, Optional
 import numpy as np
 from dotenv import load_dotenv
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from transformers import pipeline, AutoModelForSequenceClassification, AutoTokenizer
 import torch
+from vector_store import LocalVectorIndex
+from keyword_index import keyword_index
+from urllib3.exceptions import TimeoutError as HTTPTimeoutError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -19,31 +29,105 @@ PINECONE_API_KEY = 'pcsk_3QD2yg_ErC9WPvf686c64wNkqf7hMg8TWjFxS3vXnN2oYEdKtJF3YDF
 PINECONE_ENVIRONMENT = 'us-east-1'
 PINECONE_INDEX_NAME = 'study-guide'  # Consistent index name
 
+# Vector store backend: 'pinecone' or 'local'
+VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'pinecone')
+LOCAL_VECTOR_STORE_DIR = os.getenv('LOCAL_VECTOR_STORE_DIR', os.path.join(os.path.dirname(__file__), 'vector_store'))
+LOCAL_VECTOR_SEARCH = os.getenv('LOCAL_VECTOR_SEARCH', 'brute')  # 'brute' or 'ivf'
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIMENSION = 384  # dimension of the all-MiniLM-L6-v2 model
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))  # Chunks per embedding forward pass
+
+# Ingestion pipeline settings
+UPSERT_BATCH_SIZE = 100  # Vectors per upsert request
+UPSERT_MAX_IN_FLIGHT = int(os.getenv('UPSERT_MAX_IN_FLIGHT', 4))  # Upsert requests sent concurrently
+UPSERT_QUEUE_SIZE = 4  # Embedded batches buffered while waiting for an upsert slot
+UPSERT_MAX_RETRIES = 3
+UPSERT_RETRY_BACKOFF = 0.5  # Seconds before the first retry, doubled on each further retry
+DELETE_BATCH_SIZE = 1000  # Ids per delete request
+
+# Cross-encoder reranking settings
+RERANK_MAX_CANDIDATES = int(os.getenv('RERANK_MAX_CANDIDATES', 50))  # Chunks scored per query, the rest are dropped
+RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', 16))  # (query, chunk) pairs per forward pass
+RERANK_MAX_LENGTH = 512  # Word pieces per pair, the model's limit
+RERANK_CACHE_SIZE = 10000  # Cached (query, chunk) scores
+
+# Query embedding cache settings
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))  # Cached query embeddings
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', 3600))  # Seconds a cached embedding stays valid
+
+# Hybrid retrieval settings
+HYBRID_CANDIDATES = 50  # Results taken from each of the keyword and dense searches before fusion
+RRF_K = 60  # Reciprocal rank fusion constant, damps the weight of top ranks
+
+if VECTOR_STORE_BACKEND not in ('pinecone', 'local'):
+    raise ValueError(f"Unsupported vector store backend: {VECTOR_STORE_BACKEND}")
+
 # Initialize Pinecone with new API
-pc = pinecone.Pinecone(
-    api_key=PINECONE_API_KEY,
-    environment=PINECONE_ENVIRONMENT
-)
+pc = None
+if VECTOR_STORE_BACKEND == 'pinecone':
+    pc = pinecone.Pinecone(
+        api_key=PINECONE_API_KEY,
+        environment=PINECONE_ENVIRONMENT
+    )
+
+# Local index, opened on first use
+_local_index = None
+_local_index_lock = threading.Lock()
+
+# Process-wide Pinecone index handle, resolved on first use
+INDEX_POOL_THREADS = int(os.getenv('PINECONE_POOL_THREADS', 8))  # Connection pool size for data-plane requests
+INDEX_HEALTH_CHECK_INTERVAL = 300  # Seconds between health checks of the cached handle
+_index_handle = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+_index_stats = {
+    'control_plane_calls': 0,
+    'control_plane_calls_avoided': 0,
+    'health_checks': 0,
+    'health_check_failures': 0,
+    'reresolutions': 0
+}
 
 # Initialize the sentence transformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+model = SentenceTransformer(EMBEDDING_MODEL_NAME)
 
 # Initialize the cross-encoder reranker
 reranker_tokenizer = AutoTokenizer.from_pretrained("cross-encoder/ms-marco-MiniLM-L-6-v2")
 reranker_model = AutoModelForSequenceClassification.from_pretrained("cross-encoder/ms-marco-MiniLM-L-6-v2")
+reranker_model.eval()
 
-def get_index():
-    """Get or create the Pinecone index."""
+# Cross-encoder scores keyed by (query hash, chunk id)
+_rerank_cache = OrderedDict()
+_rerank_lock = threading.Lock()
+_rerank_stats = {'queries': 0, 'pairs_scored': 0, 'cache_hits': 0, 'batches': 0}
+
+# Query embeddings keyed by (model name, normalized query text)
+_query_cache = OrderedDict()  # key -> (embedding, cached_at)
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+def get_local_index() -> LocalVectorIndex:
+    """Get or open the local on-disk vector index."""
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            _local_index = LocalVectorIndex(LOCAL_VECTOR_STORE_DIR, EMBEDDING_DIMENSION, LOCAL_VECTOR_SEARCH)
+    return _local_index
+
+def _resolve_index():
+    """Look up or create the Pinecone index and open a handle to it."""
     try:
         logger.info("Checking if index exists...")
+        _index_stats['control_plane_calls'] += 1
         existing_indexes = pc.list_indexes().names()
         logger.info(f"Existing indexes: {existing_indexes}")
         
         if PINECONE_INDEX_NAME not in existing_indexes:
             logger.info(f"Creating new index: {PINECONE_INDEX_NAME}")
+            _index_stats['control_plane_calls'] += 1
             pc.create_index(
                 name=PINECONE_INDEX_NAME,
-                dimension=384,  # dimension of the all-MiniLM-L6-v2 model
+                dimension=EMBEDDING_DIMENSION,
                 metric="cosine",
                 spec=pinecone.ServerlessSpec(
                     cloud="aws",
@@ -54,85 +138,588 @@ def get_index():
         else:
             logger.info(f"Using existing index: {PINECONE_INDEX_NAME}")
         
-        index = pc.Index(PINECONE_INDEX_NAME)
+        index = pc.Index(PINECONE_INDEX_NAME, pool_threads=INDEX_POOL_THREADS)
         logger.info("Index retrieved successfully")
         return index
     except Exception as e:
         logger.error(f"Error in get_index: {str(e)}", exc_info=True)
         raise
 
-def upsert_documents(documents):
-    """Upsert documents to Pinecone index."""
+def get_index(refresh: bool = False):
+    """
+    Get the index for the configured vector store backend.
+    
+    The Pinecone handle is resolved once and reused by every call, with a
+    periodic health check; pass refresh=True to resolve it again. The
+    health check runs outside the lock, so other requests keep using the
+    handle while it is in flight.
+    """
+    global _index_handle, _index_checked_at
+    if VECTOR_STORE_BACKEND == 'local':
+        return get_local_index()
+    
+    with _index_lock:
+        handle = _index_handle
+        if handle is not None and not refresh:
+            _index_stats['control_plane_calls_avoided'] += 1
+            now = time.monotonic()
+            if now - _index_checked_at < INDEX_HEALTH_CHECK_INTERVAL:
+                return handle
+            # This thread runs the check; the others keep the handle until it is replaced
+            _index_checked_at = now
+            _index_stats['health_checks'] += 1
+    
+    if handle is not None and not refresh:
+        # Make sure the cached handle still works before handing it out
+        try:
+            handle.describe_index_stats()
+            return handle
+        except Exception as e:
+            logger.warning(f"Cached index handle failed health check: {str(e)}")
+            with _index_lock:
+                _index_stats['health_check_failures'] += 1
+    
+    with _index_lock:
+        # Another thread may have replaced the handle in the meantime
+        if _index_handle is not handle and _index_handle is not None:
+            return _index_handle
+        if _index_handle is not None:
+            _index_stats['reresolutions'] += 1
+        _index_handle = _resolve_index()
+        _index_checked_at = time.monotonic()
+        return _index_handle
+
+def _request_options(timeout: Optional[float]) -> dict:
+    # Pinecone takes a per-request timeout; the local index answers in-process
+    if timeout is None or VECTOR_STORE_BACKEND == 'local':
+        return {}
+    return {'_request_timeout': timeout}
+
+def _should_refresh(error: BaseException) -> bool:
+    # A new handle does not help with a request that timed out or was rejected as invalid
+    while error is not None:
+        if isinstance(error, (TimeoutError, HTTPTimeoutError)):
+            return False
+        status = getattr(error, 'status', None)
+        if isinstance(status, int) and 400 <= status < 500:
+            return False
+        reason = getattr(error, 'reason', None)
+        error = reason if isinstance(reason, BaseException) else error.__cause__
+    return True
+
+def call_index(operation: Callable, timeout: Optional[float] = None):
+    """
+    Run an operation against the cached index, re-resolving the handle once if it fails.
+    
+    Timeouts and client errors are raised as they are, since a new handle
+    would not fix them. The retry only gets the time left of timeout.
+    
+    Args:
+        operation (Callable): Function taking the index, plus keyword arguments
+            to pass on to the index call, and returning a result
+        timeout (float, optional): Seconds the call may take, retry included
+        
+    Returns:
+        The operation's result
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
     try:
-        logger.info(f"Starting upsert of {len(documents)} documents")
-        index = get_index()
+        return operation(get_index(), **_request_options(timeout))
+    except Exception as e:
+        if VECTOR_STORE_BACKEND == 'local' or not _should_refresh(e):
+            raise
+        logger.warning(f"Index call failed ({str(e)}), re-resolving index handle")
+        index = get_index(refresh=True)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise
+        return operation(index, **_request_options(remaining))
+
+def get_index_stats() -> dict:
+    """Return control-plane usage of the index handle cache."""
+    with _index_lock:
+        return {'backend': VECTOR_STORE_BACKEND, **_index_stats}
+
+def embed_texts(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE, sort_by_length: bool = True) -> np.ndarray:
+    """
+    Embed texts in batches.
+    
+    Args:
+        texts (List[str]): Texts to embed
+        batch_size (int): Number of texts per forward pass
+        sort_by_length (bool): Group texts of similar length into the same batch
+            to reduce padding
+        
+    Returns:
+        np.ndarray: L2-normalized float32 embeddings, one row per text in input order
+    """
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+    if not texts:
+        return embeddings
+    
+    order = list(range(len(texts)))
+    if sort_by_length:
+        order.sort(key=lambda i: len(texts[i]))
+    
+    batch_size = max(1, batch_size)
+    start = time.perf_counter()
+    for i in range(0, len(order), batch_size):
+        batch_indices = order[i:i + batch_size]
+        embeddings[batch_indices] = model.encode(
+            [texts[j] for j in batch_indices],
+            batch_size=len(batch_indices),
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+    
+    elapsed = time.perf_counter() - start
+    logger.info(f"Embedded {len(texts)} texts in {elapsed:.2f}s ({len(texts) / max(elapsed, 1e-9):.1f} texts/s)")
+    return embeddings
+
+def upsert_with_retry(index, vectors: List[dict], max_retries: int = UPSERT_MAX_RETRIES,
+                      backoff: float = UPSERT_RETRY_BACKOFF) -> int:
+    """
+    Upsert one batch of vectors, retrying with exponential backoff.
+    
+    Args:
+        index: Vector index to upsert into
+        vectors (List[dict]): Vectors to upsert
+        max_retries (int): Retries after the first failed attempt
+        backoff (float): Seconds to wait before the first retry
         
-        # Prepare vectors for upserting
-        vectors = []
-        for doc in documents:
-            # Generate embedding for the text
-            logger.info(f"Generating embedding for document: {doc['id']}")
-            embedding = model.encode(doc['text']).tolist()
-            
-            # Create vector with metadata
-            vector = {
-                'id': doc['id'],
-                'values': embedding,
-                'metadata': {
-                    **doc.get('metadata', {}),
-                    'text': doc['text']  # Store the text in metadata for retrieval
-                }
+    Returns:
+        int: Number of vectors upserted
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            index.upsert(vectors=vectors)
+            return len(vectors)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            logger.warning(f"Upsert of {len(vectors)} vectors failed ({str(e)}), "
+                           f"retrying in {delay:.1f}s (attempt {attempt + 1} of {max_retries})")
+            time.sleep(delay)
+            if VECTOR_STORE_BACKEND == 'pinecone':
+                # The handle may be stale, resolve it again before retrying
+                index = get_index(refresh=True)
+
+def build_vectors(documents: List[dict], embeddings: Iterable) -> List[dict]:
+    """Pair documents with their embeddings in the format the index expects."""
+    return [
+        {
+            'id': doc['id'],
+            'values': np.asarray(embedding, dtype=np.float32).tolist(),
+            'metadata': {
+                **doc.get('metadata', {}),
+                'text': doc['text']  # Store the text in metadata for retrieval
             }
-            vectors.append(vector)
+        }
+        for doc, embedding in zip(documents, embeddings)
+    ]
+
+def upsert_documents(documents: Iterable[dict], batch_size: int = UPSERT_BATCH_SIZE,
+                     max_in_flight: int = UPSERT_MAX_IN_FLIGHT,
+                     on_embedded: Optional[Callable[[List[dict], np.ndarray], None]] = None,
+                     on_upserted: Optional[Callable[[List[str]], None]] = None) -> int:
+    """
+    Embed documents and upsert them to the vector index.
+    
+    Embedding and upserting run as a pipeline: a producer thread embeds one
+    batch at a time into a bounded queue while up to max_in_flight upserts
+    of earlier batches are sent, so the total time is set by the slower of
+    the two stages rather than their sum.
+    
+    Documents that already carry an embedding under 'values' are upserted
+    as they are; only the rest are embedded.
+    
+    Args:
+        documents (Iterable[dict]): Documents with 'id', 'text' and optional 'metadata' and 'values'
+        batch_size (int): Documents per embedding batch and upsert request
+        max_in_flight (int): Upsert requests allowed to run at once
+        on_embedded (Callable, optional): Called from the embedding thread with each batch of
+            newly embedded documents and their embeddings
+        on_upserted (Callable, optional): Called with the ids of each batch once it is
+            upserted; batches may finish out of order
+        
+    Returns:
+        int: Number of documents upserted
+    """
+    try:
+        logger.info("Starting document upsert pipeline")
+        index = get_index()
+        start = time.perf_counter()
+        
+        max_in_flight = max(1, max_in_flight)
+        embedded_batches = queue.Queue(maxsize=UPSERT_QUEUE_SIZE)
+        stop = threading.Event()
+        done = object()
+        
+        def put(item) -> bool:
+            # Block on the bounded queue, giving up if the consumer has stopped
+            while not stop.is_set():
+                try:
+                    embedded_batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
         
-        # Upsert in batches
-        batch_size = 100
-        for i in range(0, len(vectors), batch_size):
-            batch = vectors[i:i + batch_size]
-            logger.info(f"Upserting batch {i//batch_size + 1} of {(len(vectors) + batch_size - 1)//batch_size}")
-            index.upsert(vectors=batch)
+        def produce():
+            try:
+                iterator = iter(documents)
+                while True:
+                    batch = list(islice(iterator, batch_size))
+                    if not batch:
+                        break
+                    missing = [doc for doc in batch if doc.get('values') is None]
+                    computed = iter(())
+                    if missing:
+                        new_embeddings = embed_texts([doc['text'] for doc in missing])
+                        if on_embedded is not None:
+                            on_embedded(missing, new_embeddings)
+                        computed = iter(new_embeddings)
+                    embeddings = [doc['values'] if doc.get('values') is not None else next(computed) for doc in batch]
+                    if not put(build_vectors(batch, embeddings)):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
         
-        logger.info("All documents upserted successfully")
+        producer = threading.Thread(target=produce, name='embedding-producer', daemon=True)
+        producer.start()
+        
+        upserted = 0
+        batch_number = 0
+        batch_ids = {}
+        
+        def finish(future) -> int:
+            count = future.result()
+            ids = batch_ids.pop(future)
+            if on_upserted is not None:
+                on_upserted(ids)
+            return count
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                in_flight = set()
+                while True:
+                    item = embedded_batches.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    
+                    # Wait for a free upsert slot, surfacing failures as soon as they happen
+                    while len(in_flight) >= max_in_flight:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            upserted += finish(future)
+                    
+                    logger.info(f"Upserting batch {batch_number + 1} ({len(item)} vectors)")
+                    future = executor.submit(upsert_with_retry, index, item)
+                    batch_ids[future] = [vector['id'] for vector in item]
+                    in_flight.add(future)
+                    batch_number += 1
+                
+                for future in in_flight:
+                    upserted += finish(future)
+        finally:
+            stop.set()
+            producer.join()
+        logger.info(f"All {upserted} documents upserted successfully in {time.perf_counter() - start:.2f}s")
+        return upserted
     except Exception as e:
         logger.error(f"Error in upsert_documents: {str(e)}", exc_info=True)
         raise
 
-def search_similar_documents(query, top_k=5, filter=None):
-    """Search for similar documents in Pinecone index."""
-    try:
-        index = get_index()
+def delete_documents(ids: List[str], batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """
+    Delete vectors from the index in batches.
+    
+    Args:
+        ids (List[str]): Ids of the vectors to delete
+        batch_size (int): Ids per delete request
         
-            # Generate query embedding
-        query_embedding = model.encode(query).tolist()
-            
-        # Search with filter if provided
-        results = index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            include_metadata=True,
-            filter=filter  # Add filter parameter
-        )
+    Returns:
+        int: Number of ids deleted
+    """
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        call_index(lambda index, **options: index.delete(ids=batch, **options))
+    if ids:
+        logger.info(f"Deleted {len(ids)} vectors in {(len(ids) + batch_size - 1) // batch_size} batches")
+    return len(ids)
+
+def fetch_metadata(ids: List[str]) -> Dict[str, dict]:
+    """
+    Look up the metadata of vectors by id.
+    
+    Args:
+        ids (List[str]): Ids of the vectors to look up
         
-        # Extract text from results
-        similar_docs = []
-        for match in results.matches:
-            if 'text' in match.metadata:
-                similar_docs.append(match.metadata['text'])
+    Returns:
+        Dict[str, dict]: Metadata of each id found in the index
+    """
+    response = call_index(lambda index, **options: index.fetch(ids=ids, **options))
+    return {vector_id: dict(vector.metadata or {}) for vector_id, vector in response.vectors.items()}
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups; the embedding model is uncased."""
+    return ' '.join(query.lower().split())
+
+def embed_query(query: str) -> List[float]:
+    """
+    Embed a search query, serving repeated queries from an LRU cache.
+    
+    Args:
+        query (str): Query text
         
+    Returns:
+        List[float]: Normalized query embedding
+    """
+    normalized = normalize_query(query)
+    key = (EMBEDDING_MODEL_NAME, normalized)
+    now = time.monotonic()
+    
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is not None:
+            embedding, cached_at = entry
+            if now - cached_at < QUERY_CACHE_TTL:
+                _query_cache.move_to_end(key)
+                _query_cache_stats['hits'] += 1
+                return embedding
+            del _query_cache[key]
+            _query_cache_stats['expired'] += 1
+        _query_cache_stats['misses'] += 1
+    
+    # Normalized like the stored document embeddings
+    embedding = model.encode(normalized, normalize_embeddings=True).tolist()
+    
+    with _query_cache_lock:
+        _query_cache[key] = (embedding, now)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+            _query_cache_stats['evictions'] += 1
+    return embedding
+
+def get_query_cache_stats() -> dict:
+    """Return query embedding cache counters."""
+    with _query_cache_lock:
+        lookups = _query_cache_stats['hits'] + _query_cache_stats['misses']
+        return {
+            **_query_cache_stats,
+            'hit_rate': _query_cache_stats['hits'] / lookups if lookups else 0.0,
+            'entries': len(_query_cache),
+            'max_entries': QUERY_CACHE_SIZE,
+            'ttl_seconds': QUERY_CACHE_TTL
+        }
+
+def search_documents(query: str, top_k: int = 5, filter: Optional[dict] = None,
+                     timeout: Optional[float] = None) -> List[Dict]:
+    """
+    Dense search of the vector index.
+    
+    Args:
+        query (str): Query text
+        top_k (int): Number of results to return
+        filter (dict, optional): Metadata filter
+        timeout (float, optional): Seconds to wait for the index to respond
+        
+    Returns:
+        List[Dict]: Matches with 'id', 'text', 'score' and 'metadata', best first
+    """
+    # Generate query embedding
+    query_embedding = embed_query(query)
+    
+    # Search with filter if provided
+    results = call_index(lambda index, **options: index.query(
+        vector=query_embedding,
+        top_k=top_k,
+        include_metadata=True,
+        filter=filter,
+        **options
+    ), timeout)
+    
+    return [{
+        'id': match.id,
+        'text': match.metadata['text'],
+        'score': match.score,
+        'metadata': match.metadata
+    } for match in results.matches if 'text' in match.metadata]
+
+def search_similar_documents(query, top_k=5, filter=None, timeout=None):
+    """Search for similar documents in Pinecone index."""
+    try:
+        similar_docs = [match['text'] for match in search_documents(query, top_k, filter, timeout)]
         logger.info(f"Found {len(similar_docs)} similar documents")
         return similar_docs
     except Exception as e:
         logger.error(f"Error in search_similar_documents: {str(e)}", exc_info=True)
         raise
 
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """
+    Merge ranked result lists by reciprocal rank fusion.
+    
+    Each result scores sum(1 / (k + rank)) over the lists it appears in, so
+    chunks found by several retrievers rise to the top without having to
+    calibrate their raw scores against each other.
+    
+    Args:
+        result_lists (List[List[Dict]]): Ranked matches, each with an 'id'
+        k (int): Fusion constant
+        
+    Returns:
+        List[Dict]: Unique matches sorted by fused score, stored under 'score'
+    """
+    fused: Dict[str, Dict] = {}
+    for results in result_lists:
+        for rank, match in enumerate(results, start=1):
+            entry = fused.setdefault(match['id'], {**match, 'score': 0.0})
+            entry['score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda match: match['score'], reverse=True)
+
+def hybrid_search(query: str, username: str, top_k: int = 5, candidates: int = HYBRID_CANDIDATES) -> List[Dict]:
+    """
+    Search a user's chunks with BM25 and dense retrieval, fused by reciprocal rank.
+    
+    The keyword search runs locally while the dense query is in flight.
+    
+    Args:
+        query (str): Query text
+        username (str): Owner of the chunks to search
+        top_k (int): Number of results to return
+        candidates (int): Results taken from each retriever before fusion
+        
+    Returns:
+        List[Dict]: Matches with 'id', 'text', 'score' and 'metadata', best first
+    """
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        keyword_future = executor.submit(keyword_index.search, query, candidates, username)
+        try:
+            dense_results = search_documents(query, candidates, {'username': {"$eq": username}})
+        except Exception as e:
+            logger.error(f"Dense search failed, using keyword results only: {str(e)}")
+            dense_results = []
+        keyword_results = keyword_future.result()
+    
+    fused = reciprocal_rank_fusion([keyword_results, dense_results])[:top_k]
+    logger.info(f"Hybrid search returned {len(fused)} chunks ({len(keyword_results)} keyword, "
+                f"{len(dense_results)} dense) in {time.perf_counter() - start_time:.3f}s")
+    return fused
+
 def check_index_contents():
-    """Check the contents of the Pinecone index."""
-    index = get_index()
-    stats = index.describe_index_stats()
+    """Check the contents of the vector index."""
+    stats = call_index(lambda index, **options: index.describe_index_stats(**options))
     print(f"Index stats: {stats}")
 
-def rerank_chunks(query, chunks, top_k=5):
-    """Rerank chunks based on relevance to the query."""
-    # For now, just return the top k chunks
-    # In a more sophisticated implementation, you could use a cross-encoder
-    return chunks[:top_k] 
\ No newline at end of file
+def text_hash(text: str) -> str:
+    """Return a stable hex digest of a text, used as a cache key."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def score_chunks(query: str, chunks: List[str], chunk_ids: Optional[List[str]] = None,
+                 batch_size: int = RERANK_BATCH_SIZE) -> List[float]:
+    """
+    Score (query, chunk) pairs with the cross-encoder.
+    
+    Scores already computed for the same query and chunk are served from the
+    cache; the rest are scored in padded batches.
+    
+    Args:
+        query (str): Query text
+        chunks (List[str]): Chunk texts to score
+        chunk_ids (List[str], optional): Stable ids of the chunks, hashes of the text if None
+        batch_size (int): Pairs per forward pass
+        
+    Returns:
+        List[float]: Relevance logits, one per chunk
+    """
+    if chunk_ids is None:
+        chunk_ids = [text_hash(chunk) for chunk in chunks]
+    query_key = text_hash(query)
+    
+    scores: List[Optional[float]] = [None] * len(chunks)
+    with _rerank_lock:
+        for i, chunk_id in enumerate(chunk_ids):
+            score = _rerank_cache.get((query_key, chunk_id))
+            if score is not None:
+                _rerank_cache.move_to_end((query_key, chunk_id))
+                scores[i] = score
+    missing = [i for i, score in enumerate(scores) if score is None]
+    
+    batches = 0
+    with torch.inference_mode():
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            features = reranker_tokenizer(
+                [query] * len(batch),
+                [chunks[i] for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=RERANK_MAX_LENGTH,
+                return_tensors='pt'
+            )
+            logits = reranker_model(**features).logits.view(-1).tolist()
+            for i, score in zip(batch, logits):
+                scores[i] = score
+            batches += 1
+    
+    with _rerank_lock:
+        for i in missing:
+            _rerank_cache[(query_key, chunk_ids[i])] = scores[i]
+        while len(_rerank_cache) > RERANK_CACHE_SIZE:
+            _rerank_cache.popitem(last=False)
+        _rerank_stats['pairs_scored'] += len(missing)
+        _rerank_stats['cache_hits'] += len(chunks) - len(missing)
+        _rerank_stats['batches'] += batches
+    return scores
+
+def rerank_chunks(query: str, chunks: List[str], top_k: int = 5, chunk_ids: Optional[List[str]] = None,
+                  max_candidates: int = RERANK_MAX_CANDIDATES) -> List[str]:
+    """
+    Rerank chunks by cross-encoder relevance to the query.
+    
+    Args:
+        query (str): Query text
+        chunks (List[str]): Candidate chunks, best first-stage matches first
+        top_k (int): Number of chunks to return
+        chunk_ids (List[str], optional): Stable ids of the chunks, used for score caching
+        max_candidates (int): Only the first max_candidates chunks are scored
+        
+    Returns:
+        List[str]: The top_k chunks, sorted by score
+    """
+    if not chunks:
+        return []
+    try:
+        start_time = time.perf_counter()
+        candidates = chunks[:max_candidates]
+        candidate_ids = chunk_ids[:max_candidates] if chunk_ids is not None else None
+        scores = score_chunks(query, candidates, candidate_ids)
+        with _rerank_lock:
+            _rerank_stats['queries'] += 1
+        
+        ranked = sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)[:top_k]
+        logger.info(f"Reranked {len(candidates)} chunks in {time.perf_counter() - start_time:.3f}s")
+        return [chunk for chunk, _ in ranked]
+    except Exception as e:
+        logger.error(f"Error in rerank_chunks: {str(e)}", exc_info=True)
+        # Fall back to the first-stage order
+        return chunks[:top_k]
+
+def get_rerank_stats() -> dict:
+    """Return cross-encoder scoring and cache counters."""
+    with _rerank_lock:
+        pairs = _rerank_stats['pairs_scored'] + _rerank_stats['cache_hits']
+        return {
+            **_rerank_stats,
+            'cache_entries': len(_rerank_cache),
+            'cache_hit_rate': _rerank_stats['cache_hits'] / pairs if pairs else 0.0,
+            'max_candidates': RERANK_MAX_CANDIDATES
+        } 
\ No newline at end of file
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default location of the persistent cache tier
+SUMMARY_CACHE_DB = os.path.join(os.path.dirname(__file__), 'summary_cache.db')
+
+# Size limits for the two cache tiers
+MAX_MEMORY_BYTES = 8 * 1024 * 1024  # 8MB of summaries kept in memory
+MAX_DISK_BYTES = 128 * 1024 * 1024  # 128MB of summaries kept on disk
+
+def make_cache_key(text: str, topic: str, preferences: str = "", params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a content-addressed key for a generated summary.
+
+    Args:
+        text (str): Input text the summary is generated from
+        topic (str): Topic of the summary
+        preferences (str): User preferences for the guide
+        params (dict, optional): Model and decoding parameters used for generation
+
+    Returns:
+        str: SHA-256 hex digest identifying the summary
+    """
+    payload = json.dumps({
+        'text': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'topic': topic,
+        'preferences': preferences,
+        'params': params or {}
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SummaryCache:
+    """
+    Two-tier cache of generated summaries.
+
+    Recently used summaries live in an in-memory LRU; every summary is also
+    written to SQLite so it survives restarts. Both tiers evict least recently
+    used entries once their total size exceeds the configured byte limit.
+    """
+
+    def __init__(self, db_path: str = SUMMARY_CACHE_DB, max_memory_bytes: int = MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = MAX_DISK_BYTES):
+        self.db_path = db_path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> (summary, username)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS summaries
+                     (key TEXT PRIMARY KEY,
+                      username TEXT,
+                      summary TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      last_access REAL NOT NULL)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_summaries_username ON summaries (username)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_summaries_last_access ON summaries (last_access)')
+        conn.commit()
+        conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a summary, checking memory first and then disk.
+
+        Args:
+            key (str): Key from make_cache_key
+
+        Returns:
+            Optional[str]: The cached summary, or None on a miss
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+
+        try:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('SELECT summary, username FROM summaries WHERE key = ?', (key,))
+            row = c.fetchone()
+            if row:
+                c.execute('UPDATE summaries SET last_access = ? WHERE key = ?', (time.time(), key))
+                conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading summary cache: {str(e)}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def set(self, key: str, summary: str, username: Optional[str] = None) -> None:
+        """
+        Store a summary in both tiers.
+
+        Args:
+            key (str): Key from make_cache_key
+            summary (str): Generated summary
+            username (str, optional): Owner of the files the summary was built from,
+                used for invalidation
+        """
+        with self._lock:
+            self._remember(key, summary, username)
+
+        try:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('INSERT OR REPLACE INTO summaries (key, username, summary, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                      (key, username, summary, len(summary.encode('utf-8')), time.time()))
+            self._evict_disk(c)
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing summary cache: {str(e)}")
+
+    def invalidate_user(self, username: str) -> int:
+        """
+        Drop every cached summary built from a user's files.
+
+        Args:
+            username (str): User whose entries should be removed
+
+        Returns:
+            int: Number of entries removed from the persistent tier
+        """
+        with self._lock:
+            stale = [key for key, (_, owner) in self._memory.items() if owner == username]
+            for key in stale:
+                self._forget(key)
+
+        try:
+            conn = self._connect()
+            c = conn.cursor()
+            c.execute('DELETE FROM summaries WHERE username = ?', (username,))
+            removed = c.rowcount
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error invalidating summary cache: {str(e)}")
+            removed = 0
+
+        logger.info(f"Invalidated {removed} cached summaries for user {username}")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes
+            }
+
+    def _remember(self, key: str, summary: str, username: Optional[str]) -> None:
+        # Caller holds the lock
+        if key in self._memory:
+            self._forget(key)
+        self._memory[key] = (summary, username)
+        self._memory_bytes += len(summary.encode('utf-8'))
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            oldest = next(iter(self._memory))
+            self._forget(oldest)
+            self.evictions += 1
+
+    def _forget(self, key: str) -> None:
+        # Caller holds the lock
+        summary, _ = self._memory.pop(key)
+        self._memory_bytes -= len(summary.encode('utf-8'))
+
+    def _evict_disk(self, c: sqlite3.Cursor) -> None:
+        c.execute('SELECT COALESCE(SUM(size), 0) FROM summaries')
+        total = c.fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        # Remove least recently used entries until the tier is back under its limit
+        c.execute('SELECT key, size FROM summaries ORDER BY last_access ASC')
+        stale: List[str] = []
+        for key, size in c.fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            stale.append(key)
+            total -= size
+        c.executemany('DELETE FROM summaries WHERE key = ?', [(key,) for key in stale])
+        with self._lock:
+            self.evictions += len(stale)
+        logger.info(f"Evicted {len(stale)} summaries from the persistent cache")
+
+# Shared cache instance
+summary_cache = SummaryCache()
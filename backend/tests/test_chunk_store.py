@@ -0,0 +1,53 @@
+import os
+
+from chunk_store import ChunkStore, find_legacy_vector_ids
+from keyword_index import KeywordIndex
+
+def legacy_index():
+    """Positional vectors left by two users uploading notes.pdf: bob's shorter upload overwrote alice's first ids."""
+    index = {}
+    for i in range(250):
+        index[f"notes.pdf_{i}"] = {'username': 'alice', 'filename': 'notes.pdf', 'chunk_index': i}
+    for i in range(120):
+        index[f"notes.pdf_{i}"] = {'username': 'bob', 'filename': 'notes.pdf', 'chunk_index': i}
+    return index
+
+def make_fetch(index, requests=None):
+    def fetch_metadata(ids):
+        if requests is not None:
+            requests.append(ids)
+        return {vector_id: index[vector_id] for vector_id in ids if vector_id in index}
+    return fetch_metadata
+
+def test_legacy_ids_are_scoped_to_owner():
+    index = legacy_index()
+    alice = find_legacy_vector_ids(make_fetch(index), 'alice', 'notes.pdf')
+    bob = find_legacy_vector_ids(make_fetch(index), 'bob', 'notes.pdf')
+    assert alice == [f"notes.pdf_{i}" for i in range(120, 250)]
+    assert bob == [f"notes.pdf_{i}" for i in range(120)]
+
+def test_legacy_lookup_stops_after_last_position():
+    requests = []
+    find_legacy_vector_ids(make_fetch(legacy_index(), requests), 'bob', 'notes.pdf', batch_size=100)
+    assert len(requests) == 4
+
+def test_files_without_legacy_vectors():
+    assert find_legacy_vector_ids(make_fetch(legacy_index()), 'carol', 'notes.pdf') == []
+    assert find_legacy_vector_ids(make_fetch({}), 'alice', 'other.pdf') == []
+
+def test_vector_ids_are_not_derived_from_chunk_rows(tmp_path):
+    store = ChunkStore(os.path.join(tmp_path, 'chunks.db'))
+    store.append_chunks('alice', 'notes.pdf', 0, ['one', 'two'])
+    assert store.get_vector_ids('alice', 'notes.pdf') == []
+    store.add_vector_ids('alice', 'notes.pdf', ['a', 'b'])
+    assert sorted(store.get_vector_ids('alice', 'notes.pdf')) == ['a', 'b']
+    assert store.get_vector_ids('bob', 'notes.pdf') == []
+
+def test_keyword_deletes_are_scoped_to_owner(tmp_path):
+    keywords = KeywordIndex(os.path.join(tmp_path, 'keywords.db'))
+    keywords.add_documents([
+        {'id': 'notes.pdf_0', 'text': 'mitochondria', 'metadata': {'username': 'bob', 'filename': 'notes.pdf'}},
+        {'id': 'notes.pdf_1', 'text': 'mitochondria', 'metadata': {'username': 'alice', 'filename': 'notes.pdf'}},
+    ])
+    keywords.delete_ids(['notes.pdf_0', 'notes.pdf_1'], 'alice')
+    assert [match['id'] for match in keywords.search('mitochondria')] == ['notes.pdf_0']
@@ -0,0 +1,57 @@
+import io
+import re
+
+import pytest
+
+from chunker import TokenChunker
+
+TEXT = ' '.join(
+    f"Sentence {i} says the quick brown fox jumps over the lazy dog{'!' if i % 3 else '.'}"
+    + ('\n\n' if i % 7 == 0 else ' ')
+    for i in range(200)
+)
+
+class WhitespaceTokenizer:
+    """Stands in for the embedding model's tokenizer: one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False, return_offsets_mapping=False):
+        def encode(text):
+            return [(m.start(), m.end()) for m in re.finditer(r'\S+', text)]
+        if isinstance(texts, str):
+            offsets = encode(texts)
+            encoding = {'input_ids': [1] * len(offsets)}
+            if return_offsets_mapping:
+                encoding['offset_mapping'] = offsets
+            return encoding
+        return {'input_ids': [[1] * len(encode(text)) for text in texts]}
+
+def make_chunker():
+    return TokenChunker(max_tokens=40, overlap_tokens=10, tokenizer=WhitespaceTokenizer())
+
+def cut(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 1000])
+def test_stream_of_blocks_matches_whole_text(block_size):
+    chunker = make_chunker()
+    expected = chunker.chunk_text(TEXT)
+    assert list(chunker.chunk_stream(cut(TEXT, block_size), separator='')) == expected
+
+def test_blocks_do_not_split_words():
+    chunker = make_chunker()
+    words = set(TEXT.split())
+    for chunk in chunker.chunk_stream(cut(TEXT, 13), separator=''):
+        assert set(chunk.split()) <= words
+
+def test_pages_are_joined_with_separator():
+    chunker = make_chunker()
+    pages = ['First page ends here', 'second page starts here.']
+    assert list(chunker.chunk_stream(pages)) == ['First page ends here second page starts here.']
+
+def test_text_blocks_end_at_whitespace():
+    ingestion = pytest.importorskip('ingestion')
+    blocks = list(ingestion.iter_text_blocks(io.StringIO(TEXT), block_size=50))
+    assert ''.join(blocks) == TEXT
+    assert all(block[-1].isspace() for block in blocks[:-1])
+    chunker = make_chunker()
+    assert list(chunker.chunk_stream(blocks)) == chunker.chunk_text(TEXT)
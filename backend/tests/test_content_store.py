@@ -0,0 +1,30 @@
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from content_store import ContentStore
+
+def test_file_chunks_are_keyed_by_chunker(tmp_path):
+    store = ContentStore(os.path.join(tmp_path, 'content.db'))
+    store.add_file_chunks('abc', 'chunker-a', 0, ['one', 'two'])
+    store.commit_file('abc', 'chunker-a', 10, 2)
+    assert store.get_file_chunks('abc', 'chunker-a') == ['one', 'two']
+    assert store.get_file_chunks('abc', 'chunker-b') is None
+
+def test_files_parsed_without_chunker_are_dropped(tmp_path):
+    db_path = os.path.join(tmp_path, 'content.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE files (file_hash TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                 'chunk_count INTEGER NOT NULL, created_at REAL NOT NULL)')
+    conn.execute('CREATE TABLE file_chunks (file_hash TEXT NOT NULL, chunk_index INTEGER NOT NULL, '
+                 'chunk_hash TEXT NOT NULL, PRIMARY KEY (file_hash, chunk_index))')
+    conn.execute("INSERT INTO files VALUES ('abc', 10, 1, 0)")
+    conn.execute("INSERT INTO file_chunks VALUES ('abc', 0, 'hash')")
+    conn.commit()
+    conn.close()
+
+    store = ContentStore(db_path)
+    assert store.get_file_chunks('abc', 'chunker-a') is None
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import time
+
+import ingestion_jobs
+from ingestion_jobs import INGESTION_MAX_ATTEMPTS, IngestionJobQueue
+
+def wait_for_status(jobs, job_id, status, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not reach {status}")
+
+def test_permanent_failure_is_cleaned_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, 'INGESTION_RETRY_DELAY', 0)
+    cleaned = []
+
+    def handler(job, progress):
+        raise RuntimeError('index unavailable')
+
+    def on_failed(job):
+        # Runs while the job still holds back later jobs for the same file
+        cleaned.append((job['id'], jobs.get(job['id'])['status']))
+
+    jobs = IngestionJobQueue(handler, db_path=os.path.join(tmp_path, 'jobs.db'), workers=1, on_failed=on_failed)
+    job_id = jobs.submit('alice', 'notes.pdf', str(tmp_path / 'notes.pdf'))
+    job = wait_for_status(jobs, job_id, 'failed')
+    assert job['attempts'] == INGESTION_MAX_ATTEMPTS
+    assert job['error'] == 'index unavailable'
+    assert cleaned == [(job_id, 'running')]
+
+def test_interrupted_job_out_of_attempts_is_cleaned_up(tmp_path):
+    db_path = os.path.join(tmp_path, 'jobs.db')
+    IngestionJobQueue(lambda job, progress: None, db_path=db_path, workers=1)
+    conn = sqlite3.connect(db_path)
+    conn.execute('''INSERT INTO jobs (id, username, filename, file_path, status, attempts, owner, heartbeat_at,
+                                      created_at, updated_at)
+                    VALUES ('stale', 'alice', 'notes.pdf', 'notes.pdf', 'running', ?, 'gone', 0, 0, 0)''',
+                 (INGESTION_MAX_ATTEMPTS,))
+    conn.commit()
+    conn.close()
+
+    cleaned = []
+    jobs = IngestionJobQueue(lambda job, progress: None, db_path=db_path, workers=1,
+                             on_failed=lambda job: cleaned.append(job['id']))
+    assert cleaned == ['stale']
+    job = jobs.get('stale')
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Interrupted too many times'
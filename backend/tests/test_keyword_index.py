@@ -0,0 +1,45 @@
+import os
+import sqlite3
+
+from keyword_index import KeywordIndex
+
+def doc(doc_id, text, username, filename='notes.pdf', chunk_index=0):
+    return {'id': doc_id, 'text': text,
+            'metadata': {'username': username, 'filename': filename, 'chunk_index': chunk_index}}
+
+def test_search_is_scoped_to_user(tmp_path):
+    keywords = KeywordIndex(os.path.join(tmp_path, 'keywords.db'))
+    keywords.add_documents([
+        doc('a0', 'mitochondria are the powerhouse of the cell', 'alice'),
+        doc('b0', 'mitochondria mitochondria mitochondria', 'bob'),
+        doc('a1', 'ribosomes make proteins', 'alice', chunk_index=1),
+    ])
+    assert [match['id'] for match in keywords.search('mitochondria', username='alice')] == ['a0']
+    assert [match['id'] for match in keywords.search('mitochondria', username='carol')] == []
+    assert {match['id'] for match in keywords.search('mitochondria')} == {'a0', 'b0'}
+
+def test_owner_terms_do_not_match_query_text(tmp_path):
+    keywords = KeywordIndex(os.path.join(tmp_path, 'keywords.db'))
+    keywords.add_documents([doc('a0', 'cells', 'alice')])
+    assert keywords.search('alice', username='alice') == []
+
+def test_delete_file_only_removes_that_users_file(tmp_path):
+    keywords = KeywordIndex(os.path.join(tmp_path, 'keywords.db'))
+    keywords.add_documents([doc('a0', 'cells', 'alice'), doc('b0', 'cells', 'bob')])
+    assert keywords.delete_file('alice', 'notes.pdf') == 1
+    assert keywords.indexed_files() == {('bob', 'notes.pdf')}
+
+def test_index_without_owners_is_rebuilt(tmp_path):
+    db_path = os.path.join(tmp_path, 'keywords.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE VIRTUAL TABLE chunks USING fts5
+                    (text, doc_id UNINDEXED, username UNINDEXED, filename UNINDEXED, chunk_index UNINDEXED,
+                     tokenize = 'porter unicode61')''')
+    conn.execute("INSERT INTO chunks VALUES ('mitochondria', 'a0', 'alice', 'notes.pdf', 0)")
+    conn.commit()
+    conn.close()
+
+    keywords = KeywordIndex(db_path)
+    assert [match['id'] for match in keywords.search('mitochondria', username='alice')] == ['a0']
+    keywords.delete_ids(['a0'])
+    assert keywords.search('mitochondria') == []
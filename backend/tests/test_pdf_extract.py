@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+PyPDF2 = pytest.importorskip('PyPDF2')
+
+from pdf_extract import PdfExtractError, PdfWorkerPool
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+def write_pdf(path, pages):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    with open(path, 'wb') as file:
+        writer.write(file)
+    return str(path)
+
+def test_pool_extracts_page_ranges(tmp_path):
+    pdf = write_pdf(tmp_path / 'blank.pdf', 5)
+    pool = PdfWorkerPool(2)
+    try:
+        futures = [pool.submit(pdf, 0, 3), pool.submit(pdf, 3, 5)]
+        assert [future.result(timeout=60) for future in futures] == [[''] * 3, [''] * 2]
+    finally:
+        pool.shutdown()
+
+def test_worker_errors_are_raised(tmp_path):
+    pdf = write_pdf(tmp_path / 'blank.pdf', 1)
+    pool = PdfWorkerPool(1)
+    try:
+        with pytest.raises(PdfExtractError):
+            pool.submit(str(tmp_path / 'missing.pdf'), 0, 1).result(timeout=60)
+        # The worker survives a failed range
+        assert pool.submit(pdf, 0, 1).result(timeout=60) == ['']
+    finally:
+        pool.shutdown()
+
+def test_workers_do_not_rerun_main_script(tmp_path):
+    # Stands in for running app.py directly, whose import loads the models and starts the ingestion queue
+    pdf = write_pdf(tmp_path / 'blank.pdf', 4)
+    marker = tmp_path / 'imports.txt'
+    script = tmp_path / 'main.py'
+    script.write_text(textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {os.path.abspath(BACKEND_DIR)!r})
+        with open({str(marker)!r}, 'a') as marker:
+            marker.write('imported\\n')
+        from pdf_extract import PdfWorkerPool
+        if __name__ == '__main__':
+            pool = PdfWorkerPool(2)
+            print([pool.submit({pdf!r}, i, i + 1).result(timeout=60) for i in range(4)])
+            pool.shutdown()
+    """))
+    output = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120, check=True)
+    assert output.stdout.strip() == str([['']] * 4)
+    assert marker.read_text() == 'imported\n'
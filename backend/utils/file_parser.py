@@ -22,17 +22,11 @@ def parse_file(file_path, file_extension):
 
 def parse_pdf(file_path):
     """Extract text from PDF files."""
-    text = ''
     with open(file_path, 'rb') as file:
         pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + '\n'
-    return text
+        return ''.join(page.extract_text() + '\n' for page in pdf_reader.pages)
 
 def parse_docx(file_path):
     """Extract text from DOCX files."""
     doc = docx.Document(file_path)
-    text = ''
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + '\n'
-    return text 
\ No newline at end of file
+    return ''.join(paragraph.text + '\n' for paragraph in doc.paragraphs) 
\ No newline at end of file
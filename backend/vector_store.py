@@ -0,0 +1,395 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# IVF search settings
+IVF_NUM_LISTS = 64  # Number of k-means clusters
+IVF_NUM_PROBES = 8  # Clusters searched per query
+IVF_MIN_VECTORS = 2048  # Below this many vectors brute force is used even in IVF mode
+IVF_KMEANS_ITERATIONS = 10
+
+# Metadata fields that are never used in filters and are not worth indexing
+UNINDEXED_FIELDS = {'text'}
+
+def _matches_condition(value, condition) -> bool:
+    # Evaluate one metadata filter condition against a value
+    if not isinstance(condition, dict):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == '$eq' and value != operand:
+            return False
+        if operator == '$ne' and value == operand:
+            return False
+        if operator == '$in' and value not in operand:
+            return False
+        if operator == '$nin' and value in operand:
+            return False
+        if operator not in ('$eq', '$ne', '$in', '$nin'):
+            raise ValueError(f"Unsupported filter operator: {operator}")
+    return True
+
+class LocalVectorIndex:
+    """
+    On-disk vector index with the parts of the Pinecone Index API this app uses.
+
+    Vectors are L2-normalized and stored in a memory-mapped float32 NumPy
+    matrix, so dot products are cosine similarities. Ids and metadata live in
+    SQLite next to it. Metadata filters support $eq, $ne, $in and $nin and are
+    answered from an in-memory value index before any vectors are scored.
+    Search is brute force, or IVF (k-means lists, nprobe lists searched) when
+    search='ivf' and the index is large enough. IVF lists are trained in a
+    background thread; queries use brute force until the first training
+    finishes, and the previous lists while a retraining runs.
+    """
+
+    def __init__(self, directory: str, dimension: int = 384, search: str = 'brute',
+                 num_lists: int = IVF_NUM_LISTS, num_probes: int = IVF_NUM_PROBES):
+        if search not in ('brute', 'ivf'):
+            raise ValueError(f"Unsupported local vector search: {search}")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dimension = dimension
+        self.search = search
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self._vectors_path = os.path.join(directory, 'vectors.npy')
+        self._db_path = os.path.join(directory, 'metadata.db')
+        self._lock = threading.RLock()
+
+        # Row-aligned state, rebuilt from SQLite on startup
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Optional[dict]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._field_index: Dict[str, Dict[object, set]] = {}
+
+        # IVF state
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._trained_size = 0
+        # Rows upserted while a training runs, reassigned once it finishes; None when not training
+        self._rows_changed_in_training: Optional[set] = None
+
+        self._init_db()
+        self._load()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS vectors
+                     (row INTEGER PRIMARY KEY,
+                      id TEXT UNIQUE NOT NULL,
+                      metadata TEXT NOT NULL)''')
+        conn.commit()
+        conn.close()
+
+    def _load(self) -> None:
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute('SELECT row, id, metadata FROM vectors ORDER BY row')
+        rows = c.fetchall()
+        conn.close()
+
+        size = rows[-1][0] + 1 if rows else 0
+        self._ids = [None] * size
+        self._metadata = [None] * size
+        for row, vector_id, metadata in rows:
+            self._set_row(row, vector_id, json.loads(metadata))
+
+        if os.path.exists(self._vectors_path):
+            self._matrix = np.load(self._vectors_path, mmap_mode='r+')
+        else:
+            self._matrix = np.lib.format.open_memmap(self._vectors_path, mode='w+', dtype=np.float32,
+                                                     shape=(max(1024, size), self.dimension))
+        logger.info(f"Loaded local vector index with {len(self._row_by_id)} vectors from {self.directory}")
+
+    def _ensure_capacity(self, size: int) -> None:
+        # Grow the memory-mapped matrix by doubling, copying existing rows
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+
+        tmp_path = self._vectors_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(capacity, self.dimension))
+        grown[:self._matrix.shape[0]] = self._matrix
+        grown.flush()
+        del grown
+        del self._matrix
+        os.replace(tmp_path, self._vectors_path)
+        self._matrix = np.load(self._vectors_path, mmap_mode='r+')
+
+    def _set_row(self, row: int, vector_id: str, metadata: dict) -> None:
+        self._ids[row] = vector_id
+        self._metadata[row] = metadata
+        self._row_by_id[vector_id] = row
+        for field, value in metadata.items():
+            if field in UNINDEXED_FIELDS or not isinstance(value, (str, int, float, bool)):
+                continue
+            self._field_index.setdefault(field, {}).setdefault(value, set()).add(row)
+
+    def _clear_row(self, row: int) -> None:
+        metadata = self._metadata[row] or {}
+        for field, value in metadata.items():
+            rows = self._field_index.get(field, {}).get(value)
+            if rows is not None:
+                rows.discard(row)
+        self._row_by_id.pop(self._ids[row], None)
+        self._ids[row] = None
+        self._metadata[row] = None
+
+    def upsert(self, vectors: List[dict], **kwargs) -> dict:
+        """
+        Insert or overwrite vectors.
+
+        Args:
+            vectors (List[dict]): Dicts with 'id', 'values' and optional 'metadata'
+
+        Returns:
+            dict: {'upserted_count': n}
+        """
+        if not vectors:
+            return {'upserted_count': 0}
+
+        values = np.asarray([vector['values'] for vector in vectors], dtype=np.float32)
+        if values.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {values.shape[1]} does not match index dimension {self.dimension}")
+        norms = np.linalg.norm(values, axis=1, keepdims=True)
+        values = values / np.maximum(norms, 1e-12)
+
+        with self._lock:
+            rows = []
+            for vector in vectors:
+                row = self._row_by_id.get(vector['id'])
+                if row is None:
+                    row = len(self._ids)
+                    self._ids.append(None)
+                    self._metadata.append(None)
+                else:
+                    self._clear_row(row)
+                self._set_row(row, vector['id'], vector.get('metadata', {}))
+                rows.append(row)
+
+            self._ensure_capacity(len(self._ids))
+            self._matrix[rows] = values
+            self._matrix.flush()
+            if self._assignments is not None:
+                self._assign(rows)
+            if self._rows_changed_in_training is not None:
+                self._rows_changed_in_training.update(rows)
+
+            conn = self._connect()
+            c = conn.cursor()
+            c.executemany('INSERT OR REPLACE INTO vectors (row, id, metadata) VALUES (?, ?, ?)',
+                          [(row, vector['id'], json.dumps(vector.get('metadata', {})))
+                           for row, vector in zip(rows, vectors)])
+            conn.commit()
+            conn.close()
+
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids: List[str], **kwargs) -> dict:
+        """
+        Delete vectors by id. Unknown ids are ignored.
+
+        Args:
+            ids (List[str]): Ids to delete
+        """
+        with self._lock:
+            rows = [self._row_by_id[vector_id] for vector_id in ids if vector_id in self._row_by_id]
+            for row in rows:
+                self._clear_row(row)
+            conn = self._connect()
+            c = conn.cursor()
+            c.executemany('DELETE FROM vectors WHERE row = ?', [(row,) for row in rows])
+            conn.commit()
+            conn.close()
+        return {}
+
+    def fetch(self, ids: List[str], **kwargs) -> SimpleNamespace:
+        """
+        Fetch stored vectors by id.
+
+        Args:
+            ids (List[str]): Ids to fetch
+
+        Returns:
+            SimpleNamespace: .vectors maps each known id to an object with
+                .id, .values and .metadata
+        """
+        with self._lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self._row_by_id.get(vector_id)
+                if row is not None:
+                    vectors[vector_id] = SimpleNamespace(id=vector_id, values=self._matrix[row].tolist(),
+                                                         metadata=self._metadata[row])
+        return SimpleNamespace(vectors=vectors)
+
+    def _candidate_rows(self, filter: Optional[dict]) -> np.ndarray:
+        # Rows that are alive and pass the metadata filter
+        alive = np.fromiter((vector_id is not None for vector_id in self._ids), dtype=bool, count=len(self._ids))
+        if not filter:
+            return np.flatnonzero(alive)
+
+        mask = alive
+        for field, condition in filter.items():
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+
+            if field in self._field_index and set(condition) <= {'$eq', '$in'}:
+                # Answer equality filters from the value index
+                field_rows = set()
+                if '$eq' in condition:
+                    field_rows = set(self._field_index[field].get(condition['$eq'], ()))
+                if '$in' in condition:
+                    in_rows = set().union(*(self._field_index[field].get(value, ()) for value in condition['$in']))
+                    field_rows = field_rows & in_rows if '$eq' in condition else in_rows
+                field_mask = np.zeros(len(self._ids), dtype=bool)
+                field_mask[list(field_rows)] = True
+            else:
+                field_mask = np.fromiter(
+                    (metadata is not None and _matches_condition(metadata.get(field), condition)
+                     for metadata in self._metadata),
+                    dtype=bool, count=len(self._ids)
+                )
+            mask = mask & field_mask
+        return np.flatnonzero(mask)
+
+    def _maybe_start_training(self) -> None:
+        # Train the first IVF lists, or retrain once the index doubled in size, off the query path
+        if self._rows_changed_in_training is not None:
+            return
+        live = len(self._row_by_id)
+        if live < IVF_MIN_VECTORS or (self._centroids is not None and live <= 2 * self._trained_size):
+            return
+        self._rows_changed_in_training = set()
+        threading.Thread(target=self._train_ivf, name='ivf-training', daemon=True).start()
+
+    def _train_ivf(self) -> None:
+        try:
+            with self._lock:
+                rows = np.flatnonzero(np.fromiter((vector_id is not None for vector_id in self._ids), dtype=bool,
+                                                  count=len(self._ids)))
+                matrix = self._matrix
+
+            # Cluster the live vectors with a few rounds of k-means, without holding the lock
+            data = np.asarray(matrix[rows])
+            num_lists = min(self.num_lists, len(rows))
+            rng = np.random.default_rng(0)
+            centroids = data[rng.choice(len(rows), num_lists, replace=False)]
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                labels = np.argmax(data @ centroids.T, axis=1)
+                for k in range(num_lists):
+                    members = data[labels == k]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[k] = centroid / max(np.linalg.norm(centroid), 1e-12)
+            labels = np.argmax(data @ centroids.T, axis=1)
+
+            with self._lock:
+                self._centroids = centroids
+                self._assignments = np.full(len(self._ids), -1, dtype=np.int32)
+                self._assignments[rows] = labels
+                # Rows written after the snapshot may hold different vectors
+                changed = [row for row in self._rows_changed_in_training if self._ids[row] is not None]
+                if changed:
+                    self._assign(changed)
+                self._trained_size = len(rows)
+            logger.info(f"Trained IVF index with {num_lists} lists over {len(rows)} vectors")
+        except Exception as e:
+            logger.error(f"Error training IVF index: {str(e)}", exc_info=True)
+        finally:
+            with self._lock:
+                self._rows_changed_in_training = None
+
+    def _assign(self, rows: List[int]) -> None:
+        # Assign new or updated rows to their nearest IVF list
+        if len(self._assignments) < len(self._ids):
+            grown = np.full(len(self._ids), -1, dtype=np.int32)
+            grown[:len(self._assignments)] = self._assignments
+            self._assignments = grown
+        self._assignments[rows] = np.argmax(np.asarray(self._matrix[rows]) @ self._centroids.T, axis=1)
+
+    def _probe(self, rows: np.ndarray, query: np.ndarray, top_k: int) -> np.ndarray:
+        # Keep the candidates in the lists nearest the query. A filter may leave the nearest
+        # lists empty, so only lists holding candidates count as probes, and further lists
+        # are searched until at least top_k candidates remain.
+        assignments = self._assignments[rows]
+        counts = np.bincount(assignments[assignments >= 0], minlength=len(self._centroids))
+        order = np.argsort(-(self._centroids @ query))
+        order = order[counts[order] > 0]
+        covered = np.cumsum(counts[order])
+        enough = int(np.searchsorted(covered, min(top_k, len(rows)))) + 1
+        probes = order[:max(self.num_probes, enough)]
+        return rows[np.isin(assignments, probes)]
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False,
+              filter: Optional[dict] = None, **kwargs) -> SimpleNamespace:
+        """
+        Find the vectors most similar to a query vector.
+
+        Args:
+            vector (List[float]): Query vector
+            top_k (int): Number of matches to return
+            include_metadata (bool): Whether matches carry their metadata
+            filter (dict, optional): Pinecone-style metadata filter
+
+        Returns:
+            SimpleNamespace: .matches, a list of objects with .id, .score and
+                .metadata, best match first
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+
+        with self._lock:
+            rows = self._candidate_rows(filter)
+
+            if self.search == 'ivf':
+                self._maybe_start_training()
+            # Few candidates, e.g. after a selective filter, are cheaper to score directly
+            if self.search == 'ivf' and self._centroids is not None and len(rows) >= IVF_MIN_VECTORS:
+                rows = self._probe(rows, query, top_k)
+
+            if len(rows) == 0:
+                return SimpleNamespace(matches=[])
+
+            scores = np.asarray(self._matrix[rows]) @ query
+            k = min(top_k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            matches = [
+                SimpleNamespace(
+                    id=self._ids[rows[i]],
+                    score=float(scores[i]),
+                    metadata=dict(self._metadata[rows[i]]) if include_metadata else {}
+                )
+                for i in best
+            ]
+        return SimpleNamespace(matches=matches)
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        """Return vector counts in the same shape as Pinecone's index stats."""
+        with self._lock:
+            count = len(self._row_by_id)
+            return {
+                'dimension': self.dimension,
+                'total_vector_count': count,
+                'index_fullness': count / self._matrix.shape[0],
+                'namespaces': {'': {'vector_count': count}},
+                'search': self.search
+            }